@@ -0,0 +1,205 @@
+'''
+Benchmark suite for the boids simulation, rendering and full frames.
+
+Runs on SDL's dummy video driver, so no window is opened. Run it from the repository
+root so the resource paths resolve:
+
+    python benchmarks/bench_boids.py run --out results.json
+    python benchmarks/bench_boids.py compare old.json new.json --threshold 0.1
+
+"compare" exits with status 1 when any case got slower than the threshold allows.
+'''
+
+import json
+import os
+import platform
+import sys
+import time
+from argparse import ArgumentParser
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numba
+import numpy as np
+import pygame as pg
+
+DEFAULT_SIZES = (1000, 10000, 100000)
+# (sep_radius, ali_radius, coh_radius)
+DEFAULT_RADII = ((10.0, 25.0, 25.0), (20.0, 50.0, 50.0), (40.0, 100.0, 100.0))
+
+
+def time_call(func, repeats):
+    """
+    Call func once to warm up caches and buffers, then time it repeats times. Kernels
+    that only run now and then (the verlet rebuild) must be compiled beforehand, run()
+    does that with compile_kernels. Returns a dict of timing statistics in milliseconds.
+    """
+    func()
+    samples = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000.0)
+    samples = np.array(samples)
+    return {
+        "repeats": repeats,
+        "min_ms": float(samples.min()),
+        "median_ms": float(np.median(samples)),
+        "mean_ms": float(samples.mean()),
+    }
+
+
+def make_flock(n, radii, backend="grid", dtype="float64"):
+    from data.boids_logic import BoidFlock
+    sep, ali, coh = radii
+    weights = {"sep_radius": sep, "ali_radius": ali, "coh_radius": coh}
+    return BoidFlock(n, weights=weights, backend=backend, dtype=dtype, seed=0)
+
+
+def bench_simulation(n, radii, backend, dtype, repeats):
+    """boid_update + loop_out_of_bounds, through BoidFlock.update."""
+    flock = make_flock(n, radii, backend, dtype)
+    return time_call(lambda: flock.update(0), repeats)
+
+
+def bench_draw(n, radii, repeats):
+    """BoidFlock.draw onto the display surface."""
+    flock = make_flock(n, radii)
+    surface = pg.display.get_surface()
+    return time_call(lambda: flock.draw(surface), repeats)
+
+
+def bench_bloom(repeats):
+    """Game._apply_bloom on a frame with a typical flock drawn into it."""
+    from data.states.game import Game
+    game = Game()
+    game.startup(0, {})
+    game.flock.add_boids(10000)
+    surface = pg.display.get_surface()
+    surface.fill((0, 0, 0))
+    game.flock.draw(surface)
+    return time_call(lambda: game._apply_bloom(surface), repeats)
+
+
+def bench_frame(n, radii, repeats):
+    """One full Game.update + Game.draw cycle."""
+    from data.states.game import Game
+    game = Game()
+    game.startup(0, {})
+    sep, ali, coh = radii
+    game.flock.sep_radius, game.flock.ali_radius, game.flock.coh_radius = sep, ali, coh
+    game.flock.add_boids(n - game.flock.num_boids)
+    surface = pg.display.get_surface()
+    keys = pg.key.get_pressed()
+
+    def frame():
+        game.update(keys, 0, (0, 0))
+        game.draw(surface, 0.0)
+    return time_call(frame, repeats)
+
+
+def run(args):
+    # Initializes pygame and opens the (dummy) display
+    from data import boids_logic, prepare, render
+    prepare.init_display()
+    # Compile every kernel up front, so no case times the JIT
+    boids_logic.compile_kernels()
+    render.compile_kernels()
+    radii_settings = [tuple(float(r) for r in setting.split(",")) for setting in args.radii]
+
+    results = []
+
+    def record(name, stats, **case):
+        case.update(name=name, **stats)
+        results.append(case)
+        label = " ".join(f"{key}={value}" for key, value in case.items() if key not in stats and key != "name")
+        print(f"{name:<6} {label:<50} median {stats['median_ms']:10.3f} ms")
+
+    for n in args.sizes:
+        for radii in radii_settings:
+            backends = ["grid", "verlet"] + (["brute"] if n <= args.brute_max else [])
+            for backend in backends:
+                for dtype in args.dtypes:
+                    record("sim", bench_simulation(n, radii, backend, dtype, args.repeats),
+                           n=n, radii=list(radii), backend=backend, dtype=dtype)
+            record("frame", bench_frame(n, radii, args.repeats), n=n, radii=list(radii))
+        record("draw", bench_draw(n, radii_settings[0], args.repeats), n=n)
+    record("bloom", bench_bloom(args.repeats), size=list(pg.display.get_surface().get_size()))
+
+    output = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "platform": platform.platform(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "numba": numba.__version__,
+            "pygame": pg.version.ver,
+            "cpu_count": os.cpu_count(),
+            "numba_threads": numba.get_num_threads(),
+        },
+        "results": results,
+    }
+    with open(args.out, "w") as f:
+        json.dump(output, f, indent=2)
+    print(f"Wrote {len(results)} results to {args.out}")
+
+
+def case_key(result):
+    """Everything that identifies a case, i.e. all fields except the timings."""
+    return tuple(sorted((key, json.dumps(value)) for key, value in result.items()
+                        if not key.endswith("_ms") and key != "repeats"))
+
+
+def compare(args):
+    with open(args.old) as f:
+        old = {case_key(result): result for result in json.load(f)["results"]}
+    with open(args.new) as f:
+        new = {case_key(result): result for result in json.load(f)["results"]}
+
+    regressions = 0
+    for key, result in new.items():
+        if key not in old:
+            continue
+        before, after = old[key]["median_ms"], result["median_ms"]
+        ratio = after / before if before > 0 else float("inf")
+        flag = ""
+        if ratio > 1.0 + args.threshold:
+            flag = "REGRESSION"
+            regressions += 1
+        elif ratio < 1.0 - args.threshold:
+            flag = "improved"
+        label = " ".join(f"{k}={json.loads(v)}" for k, v in key)
+        print(f"{label:<70} {before:10.3f} -> {after:10.3f} ms  x{ratio:5.2f} {flag}")
+    print(f"{regressions} regression(s) above {args.threshold:.0%}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Boids benchmarks")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="Run the benchmarks and write JSON results")
+    run_parser.add_argument("--sizes", type=int, nargs="+", default=list(DEFAULT_SIZES),
+                            help="Flock sizes to benchmark")
+    run_parser.add_argument("--radii", nargs="+", default=[",".join(map(str, r)) for r in DEFAULT_RADII],
+                            help="Radius settings as sep,ali,coh")
+    run_parser.add_argument("--dtypes", nargs="+", default=["float64", "float32"],
+                            choices=("float64", "float32"), help="Flock storage precisions to benchmark")
+    run_parser.add_argument("--repeats", type=int, default=10, help="Timed calls per case")
+    run_parser.add_argument("--brute-max", type=int, default=10000,
+                            help="Largest flock to also run the brute force backend on")
+    run_parser.add_argument("--out", default="bench_results.json", help="Where to write the JSON results")
+
+    compare_parser = commands.add_parser("compare", help="Compare two result files")
+    compare_parser.add_argument("old", help="Baseline results")
+    compare_parser.add_argument("new", help="Results to check against the baseline")
+    compare_parser.add_argument("--threshold", type=float, default=0.10,
+                                help="Relative slowdown of the median that counts as a regression")
+
+    args = parser.parse_args()
+    if args.command == "run":
+        run(args)
+    else:
+        sys.exit(compare(args))
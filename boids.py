@@ -14,15 +14,80 @@ cleanly structure a large and complex pygame project that will give me a lot of
 
 
 import sys
-import pygame as pg
-from data.main import main 
 from argparse import ArgumentParser
 
 if __name__ == "__main__":
     parser = ArgumentParser(description="Boids Simulation")
     parser.add_argument("--skip-intro", action="store_true", help="Skip the intro screen")
+    parser.add_argument("--headless", action="store_true",
+                        help="Run the simulation without opening a window and report throughput")
+    parser.add_argument("--boids", type=int, default=1000, help="Number of boids for headless runs")
+    parser.add_argument("--steps", type=int, default=1000, help="Number of simulation steps for headless runs")
+    parser.add_argument("--backend", choices=("grid", "brute", "verlet"),
+                        help="Neighbor search backend for headless runs, grid (or the autosave's) by default")
+    parser.add_argument("--dtype", choices=("float64", "float32"), default="float64",
+                        help="Storage precision of the flock for headless runs")
+    parser.add_argument("--workers", type=int, default=0,
+                        help="Split the simulation across this many worker processes")
+    parser.add_argument("--profile-csv", metavar="PATH",
+                        help="Write per-phase frame timings to a CSV file on exit")
+    parser.add_argument("--record", metavar="PATH", help="Record the simulation to a trajectory file")
+    parser.add_argument("--quantize", action="store_true",
+                        help="Store recorded positions and velocities as int16")
+    parser.add_argument("--replay", metavar="PATH", help="Play back a recorded trajectory file")
+    parser.add_argument("--autosave", metavar="PATH",
+                        help="Restore the flock from this checkpoint if it exists and save it there on exit")
+    parser.add_argument("--lod", choices=("round_robin", "focus"),
+                        help="Recompute the steering of only a rotating subset of the boids each tick")
+    parser.add_argument("--lod-budget", type=float, metavar="MS",
+                        help="Milliseconds of steering per tick the level of detail subset is sized to")
+    parser.add_argument("--sim-thread", action="store_true",
+                        help="Run the simulation on a background thread, decoupled from drawing")
+    parser.add_argument("--obstacles", metavar="IMAGE",
+                        help="Add the obstacles of an image, a path or the name of one in resources/graphics/objects")
+    parser.add_argument("--density-threshold", type=int, metavar="N",
+                        help="Draw flocks of at least N boids as a density field")
+    parser.add_argument("--serve", metavar="[HOST:]PORT",
+                        help="Stream the simulation to viewers connecting to this address")
+    parser.add_argument("--connect", metavar="[HOST:]PORT",
+                        help="Watch a simulation streamed from this address instead of running one")
+    parser.add_argument("--sweep", action="append", metavar="PARAM=SPEC",
+                        help="Sweep a rule parameter over values (1,2,4) or a range (low:high:count), "
+                             "may be repeated. Runs headless with --boids, --steps, --backend and --dtype")
+    parser.add_argument("--sweep-samples", type=int, metavar="N",
+                        help="Run N random configurations of the sweep instead of the full grid")
+    parser.add_argument("--sweep-repeats", type=int, default=1, help="Runs per configuration, each with its own seed")
+    parser.add_argument("--sweep-out", metavar="PATH", default="sweep.jsonl",
+                        help="JSON lines file the sweep results are appended to")
+    parser.add_argument("--sweep-processes", type=int, help="Worker processes of the sweep, one per core by default")
+    parser.add_argument("--sweep-threads", type=int,
+                        help="Numba threads per sweep process, an even share of the cores by default")
     args = parser.parse_args()
+    if args.lod is not None and args.workers > 1:
+        parser.error("--lod can't be combined with --workers, worker processes update every boid")
 
-    main(skip_intro=args.skip_intro)
+    if args.sweep:
+        from data.sweep import parse_space, run_sweep
+        run_sweep(parse_space(args.sweep), args.sweep_out, samples=args.sweep_samples, num_boids=args.boids,
+                  steps=args.steps, repeats=args.sweep_repeats, processes=args.sweep_processes,
+                  threads=args.sweep_threads, backend=args.backend or "grid", dtype=args.dtype)
+        sys.exit()
+
+    if args.headless:
+        # Imported here so that headless runs never load the states, the UI or the assets
+        from data.headless import run_headless
+        run_headless(args.boids, args.steps, backend=args.backend, dtype=args.dtype, workers=args.workers,
+                     record=args.record, quantize=args.quantize, autosave=args.autosave,
+                     lod=args.lod, lod_budget=args.lod_budget, obstacles=args.obstacles, serve=args.serve)
+        sys.exit()
+
+    import pygame as pg
+    from data.main import main
+
+    main(skip_intro=args.skip_intro, profile_csv=args.profile_csv, workers=args.workers,
+         record=args.record, quantize=args.quantize, replay_path=args.replay, autosave=args.autosave,
+         lod=args.lod, lod_budget=args.lod_budget, sim_thread=args.sim_thread,
+         obstacles=args.obstacles, density_threshold=args.density_threshold, serve=args.serve,
+         connect=args.connect)
     pg.quit()
     sys.exit()
\ No newline at end of file
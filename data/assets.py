@@ -0,0 +1,157 @@
+'''
+Lazy, cached asset registry.
+
+Nothing is loaded when this module is imported. The directories under resources are only
+listed on first access, and every image, sound and font is loaded the first time it is
+asked for and kept from then on. Fonts are cached per (name, size), so asking for the
+same font again never builds a new pg.font.Font.
+
+prefetch loads everything on a background thread while something else (the splash
+screen) is on screen, so the first state that needs an asset finds it already loaded.
+An asset that is asked for while the prefetch thread is loading it is simply waited for.
+'''
+
+import os
+import threading
+from collections.abc import Mapping
+
+import pygame as pg
+
+RESOURCES = "resources"
+GFX_DIRECTORIES = ("backgrounds", "creatures", "misc", "objects")
+GFX_EXTENSIONS = (".png", ".jpg", ".jpeg", ".gif")
+SOUND_EXTENSIONS = (".ogg", ".wav", ".mp3", ".mdi")
+FONT_EXTENSIONS = (".ttf",)
+COLORKEY = (255, 0, 255)
+
+
+def list_directory(directory, accept):
+    """Map the names (without extension) of the files in directory with an accepted extension to their paths."""
+    paths = {}
+    if not os.path.isdir(directory):
+        return paths
+    for filename in os.listdir(directory):
+        name, ext = os.path.splitext(filename)
+        if ext.lower() in accept:
+            paths[name] = os.path.join(directory, filename)
+    return paths
+
+
+def load_image(path, colorkey=COLORKEY):
+    """Load an image, converted for fast blitting once the display is open."""
+    image = pg.image.load(path)
+    if pg.display.get_surface() is None:
+        return image
+    if image.get_alpha():
+        return image.convert_alpha()
+    image = image.convert()
+    image.set_colorkey(colorkey)
+    return image
+
+
+def load_sound(path):
+    if not pg.mixer.get_init():
+        pg.mixer.init()
+    return pg.mixer.Sound(path)
+
+
+class AssetDirectory(Mapping):
+    """
+    A read only dict of the assets in one directory, by file name without extension.
+    The directory is listed on first access and each asset loaded on first lookup.
+    """
+    def __init__(self, directory, accept, loader):
+        self.directory = directory
+        self.accept = accept
+        self.loader = loader
+        self._paths = None
+        self._loaded = {}
+        self._lock = threading.Lock()
+
+    @property
+    def paths(self):
+        if self._paths is None:
+            self._paths = list_directory(self.directory, self.accept)
+        return self._paths
+
+    def __getitem__(self, name):
+        asset = self._loaded.get(name)
+        if asset is None:
+            path = self.paths[name]
+            with self._lock:
+                asset = self._loaded.get(name)
+                if asset is None:
+                    asset = self._loaded[name] = self.loader(path)
+        return asset
+
+    def __iter__(self):
+        return iter(self.paths)
+
+    def __len__(self):
+        return len(self.paths)
+
+    def loaded(self, name):
+        """Whether name was loaded already, without loading it."""
+        return name in self._loaded
+
+
+class AssetRegistry(object):
+    """
+    Every asset under root. fonts and music are the paths of the files (pygame streams
+    music from disk), gfx is a dict of AssetDirectory per graphics subdirectory and sfx
+    the loaded sounds.
+    """
+    def __init__(self, root=RESOURCES):
+        self.root = root
+        self.fonts = AssetDirectory(os.path.join(root, "fonts"), FONT_EXTENSIONS, str)
+        self.music = AssetDirectory(os.path.join(root, "music"), SOUND_EXTENSIONS, str)
+        self.sfx = AssetDirectory(os.path.join(root, "sound"), SOUND_EXTENSIONS, load_sound)
+        self.gfx = {directory: AssetDirectory(os.path.join(root, "graphics", directory), GFX_EXTENSIONS, load_image)
+                    for directory in GFX_DIRECTORIES}
+        self._fonts = {}
+        self._font_lock = threading.Lock()
+        self.prefetch_thread = None
+
+    def font(self, name, size):
+        """The Font for a font name in fonts (or a path to a font file) at size, cached."""
+        key = (name, size)
+        cached = self._fonts.get(key)
+        if cached is None:
+            with self._font_lock:
+                cached = self._fonts.get(key)
+                if cached is None:
+                    if not pg.font.get_init():
+                        pg.font.init()
+                    cached = self._fonts[key] = pg.font.Font(self.fonts.get(name, name), size)
+        return cached
+
+    def prefetch(self, fonts=()):
+        """
+        Load every graphic and sound, and the (name, size) fonts given, on a daemon thread.
+        Does nothing if a prefetch was started already.
+        """
+        if self.prefetch_thread is not None:
+            return
+        self.prefetch_thread = threading.Thread(target=self._prefetch, args=(tuple(fonts),),
+                                                name="asset-prefetch", daemon=True)
+        self.prefetch_thread.start()
+
+    def _prefetch(self, fonts):
+        try:
+            for name, size in fonts:
+                self.font(name, size)
+            for directory in list(self.gfx.values()) + [self.sfx]:
+                for name in directory:
+                    directory[name]
+        except Exception as error:
+            # Whatever failed here is loaded (and fails loudly) on first use instead
+            print(f"Asset prefetch failed: {error!r}")
+
+
+# Shared by everything that needs assets, the same way PROFILER is
+ASSETS = AssetRegistry()
+
+
+def font(name, size):
+    """ASSETS.font, the cached Font for name at size."""
+    return ASSETS.font(name, size)
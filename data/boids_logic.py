@@ -1,204 +1,1287 @@
+import json
+import os
+import time
+
 import numpy as np
-import pygame as pg
-from numba import njit, prange
-from .prepare import BLOOM_ON, BOIDS_VISIBLE
+from numba import njit, prange, types
+
+from . import render
+from .obstacles import ObstacleField
+
+
+# Neighbor search backends for BoidFlock.update. "grid" bins boids into cells the
+# size of the largest rule radius and only scans the 3x3 surrounding cells,
+# "brute" is the original all-pairs kernel kept around as a reference.
+# "verlet" keeps a list of neighbors within the largest radius plus a skin per boid and
+# reuses it until some boid has moved more than half the skin since it was built.
+BACKENDS = ("grid", "brute", "verlet")
+
+# Ticks the Verlet lists are reused for after the tick they were built on. The default skin
+# is sized from the fastest species' max_speed so that half of it is a little more than this
+# many ticks of movement (SKIN_SLACK). A wider skin lets the lists last more ticks but makes
+# them longer, so every tick that uses them gets slower; at the default speeds and radii one
+# reuse tick is the cheapest.
+VERLET_REUSE_TICKS = 1
+SKIN_SLACK = 1.1
+# The Verlet lists are built from cells this many times smaller than the cutoff, which
+# scans less area around each boid than cells as wide as the cutoff
+VERLET_CELL_DIVISIONS = 3
+# Rebuild the Verlet lists early once this much of the flock wrapped around the world edge,
+# every wrapped boid costs a grid lookup per tick until the next rebuild
+WRAPPED_REBUILD_FRACTION = 0.05
+
+# Level of detail scheduling (see BoidFlock.lod_mode). Only a subset of the boids gets its
+# steering recomputed each tick, the rest keep steering the way they did when they were last
+# refreshed. "round_robin" cycles through the flock, "focus" refreshes boids near lod_focus
+# more often, by ranking them on ticks since their last refresh over distance to the focus.
+LOD_MODES = ("round_robin", "focus")
+LOD_BUDGET = 8.0 # Milliseconds of steering per tick the subset size is adapted to
+LOD_INITIAL_SUBSET = 4096 # Subset size until the cost per boid has been measured
+LOD_MIN_SUBSET = 256
+LOD_FALLOFF = 200.0 # Distance from the focus at which boids get refreshed half as often
+
+# Storage precisions a flock can be created with. float32 halves the memory traffic of
+# every kernel, float64 matches the original simulation exactly.
+DTYPES = (np.float64, np.float32)
+
+# Rule parameters that can be passed in the weights dict of a BoidFlock. Every species has
+# its own value of each, they are the columns of BoidFlock.species_params in this order.
+WEIGHT_KEYS = ('sep_weight', 'ali_weight', 'coh_weight', 'sep_radius', 'ali_radius', 'coh_radius',
+               'max_speed', 'max_force', 'boid_mass', 'center_weight', 'avoid_weight')
+DEFAULT_WEIGHTS = {
+    'sep_weight': 2.0, # Weight for separation rule
+    'ali_weight': 1.0,
+    'coh_weight': 1.0,
+    'sep_radius': 20.0, # Radius for each rule
+    'ali_radius': 50.0,
+    'coh_radius': 50.0,
+    'max_speed': 10.0,
+    'max_force': 0.1,
+    'boid_mass': 5.0,
+    'center_weight': 0.1, # Weight for centering force (pulls boids toward center of simulation)
+    'avoid_weight': 2.5, # Weight for steering away from obstacles, not limited by max_force
+}
+# Boids start steering away from obstacles this far from their surface
+AVOID_MARGIN = 40.0
+
+# Color tint of each species when drawn, species past the end of the list reuse it from the start
+SPECIES_COLORS = ((1.0, 1.0, 1.0), (1.0, 0.45, 0.35), (0.45, 1.0, 0.5), (1.0, 0.85, 0.3), (0.8, 0.5, 1.0))
+
+# Display settings that are saved in checkpoints along with the weights
+DISPLAY_KEYS = ('bloom_on', 'bloom_intensity', 'bloom_quality', 'splat_radius', 'visible', 'render_mode',
+                'density_hue')
+
+# Checkpoint files are the magic, a JSON header and then the raw arrays at an aligned offset
+CHECKPOINT_MAGIC = b"BOIDCKP1"
+CHECKPOINT_ALIGNMENT = 64
+
+# Flock storage is preallocated and grown geometrically so spawning is amortized O(1)
+INITIAL_CAPACITY = 64
+GROWTH_FACTOR = 2
+
+
+def _species_property(key):
+    """A flock attribute that reads and writes the key column of the selected species."""
+    column = WEIGHT_KEYS.index(key)
+
+    def getter(self):
+        return float(self.species_params[self.selected_species, column])
+
+    def setter(self, value):
+        self.species_params[self.selected_species, column] = value
+    return property(getter, setter, doc=f"{key} of the selected species.")
+
+
+def _cross_separation(interactions, selected):
+    """How strongly species selected separates from every other species, on average."""
+    others = np.arange(interactions.shape[0]) != selected
+    if not others.any():
+        return 1.0
+    return float(interactions[selected, others, 0].mean())
+
+
+class SpeciesSnapshot(object):
+    """
+    The species tables of a flock as of one moment. The tables are replaced rather than
+    resized when a species is added, so a snapshot stays consistent while the flock goes
+    on changing on another thread. Reads the rule parameters of the selected species like
+    the flock does.
+    """
+    __slots__ = ("params", "interactions", "colors", "selected")
+
+    def __init__(self, params, interactions, colors, selected):
+        self.params = params
+        self.interactions = interactions
+        self.colors = colors
+        self.selected = selected
+
+    @property
+    def num_species(self):
+        return self.params.shape[0]
+
+    @property
+    def selected_species(self):
+        return self.selected
+
+    @property
+    def cross_separation(self):
+        return _cross_separation(self.interactions, self.selected)
+
+    def __getattr__(self, key):
+        if key in WEIGHT_KEYS:
+            return float(self.params[self.selected, WEIGHT_KEYS.index(key)])
+        raise AttributeError(key)
 
 
 class BoidFlock:
-    def __init__(self, num_boids, weights=None):
-        self.num_boids = num_boids
+    # The rule parameters are per species, these edit the species picked by selected_species
+    sep_weight = _species_property('sep_weight')
+    ali_weight = _species_property('ali_weight')
+    coh_weight = _species_property('coh_weight')
+    sep_radius = _species_property('sep_radius')
+    ali_radius = _species_property('ali_radius')
+    coh_radius = _species_property('coh_radius')
+    max_speed = _species_property('max_speed')
+    max_force = _species_property('max_force')
+    boid_mass = _species_property('boid_mass')
+    center_weight = _species_property('center_weight')
+    avoid_weight = _species_property('avoid_weight')
+
+    def __init__(self, num_boids, weights=None, backend="grid", dtype=np.float64, seed=None):
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown backend {backend!r}, expected one of {BACKENDS}")
+        if np.dtype(dtype) not in [np.dtype(d) for d in DTYPES]:
+            raise ValueError(f"Unsupported dtype {dtype!r}, expected float32 or float64")
+        self.backend = backend
+        self.dtype = np.dtype(dtype)
         self.width = 1200
         self.height = 800
-        self.positions = np.random.rand(num_boids, 2)
-        self.positions[:, 0] *= self.width
-        self.positions[:, 1] *= self.height # Scale positions to full world size
-        self.velocities = (np.random.rand(num_boids, 2) - 0.5) * 10
+        # Every random spawn draws from this generator, so a seeded flock is reproducible
+        self.seed = seed
+        self.rng = np.random.default_rng(seed)
+        # Objects with an on_update(flock) method, called after every update (see attach)
+        self.observers = []
+        # Species parameter table, one row per species with the WEIGHT_KEYS as columns, and
+        # the interaction matrix: interactions[a, b] scales how strongly species a separates
+        # from, aligns with and coheres with (in that order) neighbors of species b
+        self.species_params = np.array([[DEFAULT_WEIGHTS[key] for key in WEIGHT_KEYS]])
+        self.interactions = np.ones((1, 1, 3))
+        self.species_colors = np.array([SPECIES_COLORS[0]])
+        self.selected_species = 0 # Species edited through the weight attributes and spawned by default
+        self.obstacles = ObstacleField(self.width, self.height)
+        # Struct-of-arrays storage, only the first num_boids rows are live
+        self.num_boids = 0
+        self.capacity = 0
+        self._positions = np.empty((0, 2), self.dtype)
+        self._velocities = np.empty((0, 2), self.dtype)
+        # Positions before the last update, so drawing can interpolate between ticks.
+        # It doubles as the buffer the next update writes into, same for _back_velocities.
+        self._prev_positions = np.empty((0, 2), self.dtype)
+        self._back_velocities = np.empty((0, 2), self.dtype)
+        self._species = np.empty(0, np.int32) # Species id of every boid
+        # Verlet neighbor lists (see BACKENDS), None when they have to be rebuilt
+        self.skin = None # Skin width in world units, None sizes it from max_speed (see verlet_skin)
+        self._neighbor_lists = None
+        self._neighbor_cutoff = 0.0
+        self._neighbor_reference = None # Positions the lists were built from, by slot
+        self._wrapped = None # Flags the slots of boids that wrapped around the world edge since then
+        self._no_wrapped = np.empty(0, np.int64)
+        self.neighbor_rebuilds = 0
+        # Level of detail scheduling, off unless lod_mode is one of LOD_MODES
+        self.lod_mode = None
+        self.lod_budget = LOD_BUDGET
+        self.lod_focus = (self.width / 2.0, self.height / 2.0) # World position "focus" mode favors
+        self.lod_subset = 0 # Boids refreshed in the last tick
+        self._lod_cost = None # Smoothed steering time per boid, in milliseconds
+        self._lod_cursor = 0
+        self._lod_count = 0 # Boids the steering cache below is valid for
+        self._steering = None # Velocity change of each boid when it was last refreshed
+        self._age = None # Ticks since each boid was last refreshed
+        self.add_boids(num_boids)
         self.scale_x = 1.0
         self.scale_y = 1.0
-        # Initialize the weights with starting values
-        self.sep_weight = 2.0  # Weight for separation rule
-        self.ali_weight = 1.0
-        self.coh_weight = 1.0
-        # Radius for each rule
-        self.sep_radius = 20.0
-        self.ali_radius = 50.0
-        self.coh_radius = 50.0
-        # Maximum speed and force
-        self.max_speed = 10.0
-        self.max_force = 0.1
-        # Mass of each boid
-        self.boid_mass = 5.0
-        # Weight for centering force (pulls boids toward center of simulation)
-        self.center_weight = 0.1
         self.bloom_on = True
+        self.bloom_intensity = 0.5 # How strongly the glow is added back
+        self.bloom_quality = 2 # Number of blur levels, 1 is quarter res only, 2 adds eighth res
+        self.visible = True # Whether to draw boids on the screen
+        self.splat_radius = 1 # Size of each boid in pixels when drawn
+        self.render_mode = "points" # One of render.RENDER_MODES
+        self.density_threshold = render.DENSITY_THRESHOLD # Flock size from which render_mode is ignored for "density"
+        self.density_hue = True # Color the density field by heading instead of position
         if weights is not None:
             for key in weights:
-                if key in ['sep_weight', 'ali_weight', 'coh_weight',
-                                    'sep_radius', 'ali_radius', 'coh_radius',
-                                    'max_speed', 'max_force', 'boid_mass', 'center_weight']:
+                if key in WEIGHT_KEYS:
                     setattr(self, key, weights[key])
+
+    @property
+    def positions(self):
+        """View of the live boid positions, shape (num_boids, 2)."""
+        return self._positions[:self.num_boids]
+
+    @positions.setter
+    def positions(self, value):
+        self._positions[:self.num_boids] = value
+        self.invalidate_neighbors()
+
+    @property
+    def velocities(self):
+        """View of the live boid velocities, shape (num_boids, 2)."""
+        return self._velocities[:self.num_boids]
+
+    @velocities.setter
+    def velocities(self, value):
+        self._velocities[:self.num_boids] = value
+
+    @property
+    def species(self):
+        """View of the species id of every live boid."""
+        return self._species[:self.num_boids]
+
+    @species.setter
+    def species(self, value):
+        self._species[:self.num_boids] = value
+
+    @property
+    def num_species(self):
+        return self.species_params.shape[0]
+
+    @property
+    def cross_separation(self):
+        """How strongly the selected species separates from every other species."""
+        return _cross_separation(self.interactions, self.selected_species)
+
+    @cross_separation.setter
+    def cross_separation(self, value):
+        interactions = self.interactions
+        others = np.arange(interactions.shape[0]) != self.selected_species
+        interactions[self.selected_species, others, 0] = value
+
+    def species_snapshot(self):
+        """A SpeciesSnapshot of the species tables as they are now."""
+        # species_params goes last in add_species, read it first so the others are at least as new
+        params = self.species_params
+        return SpeciesSnapshot(params, self.interactions[:params.shape[0], :params.shape[0]],
+                               self.species_colors[:params.shape[0]], self.selected_species)
+
+    def add_species(self, weights=None, color=None):
+        """
+        Add a species that starts as a copy of the selected one, with the given weights
+        overridden. It interacts with every species at full strength. Returns its id.
+        """
+        species = self.num_species
+        params = np.vstack((self.species_params, self.species_params[self.selected_species]))
+        if weights is not None:
+            for key in weights:
+                if key in WEIGHT_KEYS:
+                    params[species, WEIGHT_KEYS.index(key)] = weights[key]
+        interactions = np.ones((species + 1, species + 1, 3))
+        interactions[:species, :species] = self.interactions
+        if color is None:
+            color = SPECIES_COLORS[species % len(SPECIES_COLORS)]
+        # The tables are built first and swapped in whole, species_params (which num_species
+        # is read from) last, so readers on other threads never see them disagree in size
+        self.interactions = interactions
+        self.species_colors = np.vstack((self.species_colors, color))
+        self.species_params = params
+        return species
+
+    def set_interaction(self, species, other, separation=None, alignment=None, cohesion=None):
+        """Set how strongly species reacts to neighbors of species other, None leaves a rule as is."""
+        for rule, value in enumerate((separation, alignment, cohesion)):
+            if value is not None:
+                self.interactions[species, other, rule] = value
+
+    def invalidate_neighbors(self):
+        """Force the Verlet neighbor lists to be rebuilt, needed whenever boids are added, removed or moved."""
+        self._neighbor_lists = None
+
+    def verlet_skin(self):
+        """
+        Skin width of the Verlet lists. Unless skin is set, half of it is SKIN_SLACK times
+        the distance the fastest species covers in VERLET_REUSE_TICKS ticks, so the lists
+        outlast that many ticks however fast the boids fly. It is derived every tick, so
+        changing max_speed changes the cutoff, which rebuilds the lists with the new skin.
+        """
+        if self.skin is not None:
+            return float(self.skin)
+        return 2.0 * SKIN_SLACK * VERLET_REUSE_TICKS * float(self.species_params[:, 6].max())
+
+    def interaction_radius(self):
+        """Largest rule radius of any species, neighbors are never further apart than this."""
+        return float(max(self.species_params[:, 3:6].max(), 1.0))
+
+    @property
+    def prev_positions(self):
+        """View of the live boid positions as they were before the last update."""
+        return self._prev_positions[:self.num_boids]
+
+    def reserve(self, capacity):
+        """
+        Make sure the storage can hold at least capacity boids.
+        Grows geometrically so repeated spawning only reallocates O(log N) times.
+        """
+        if capacity <= self.capacity:
+            return
+        new_capacity = max(capacity, self.capacity * GROWTH_FACTOR, INITIAL_CAPACITY)
+        positions = np.zeros((new_capacity, 2), self.dtype)
+        velocities = np.zeros((new_capacity, 2), self.dtype)
+        prev_positions = np.zeros((new_capacity, 2), self.dtype)
+        species = np.zeros(new_capacity, np.int32)
+        positions[:self.num_boids] = self.positions
+        velocities[:self.num_boids] = self.velocities
+        prev_positions[:self.num_boids] = self.prev_positions
+        species[:self.num_boids] = self.species
+        self._positions = positions
+        self._velocities = velocities
+        self._prev_positions = prev_positions
+        self._species = species
+        self._back_velocities = np.zeros((new_capacity, 2), self.dtype)
+        self.capacity = new_capacity
     
+    def rule_params(self):
+        """
+        The rule arguments every kernel ends with: the species parameter table, the
+        interaction matrix, the obstacle distance field and its cell size, and the world
+        size. The sizes are passed as floats so calls always hit the precompiled signatures.
+        """
+        return (self.species_params, self.interactions, self.obstacles.field(), self.obstacles.cell,
+                float(self.width), float(self.height))
+
     def update(self, now):
-        self.positions, self.velocities = boid_update(self.positions, self.velocities, self.sep_weight,
-                                                    self.ali_weight, self.coh_weight,
-                                                    self.sep_radius, self.ali_radius, self.coh_radius,
-                                                    self.max_speed, self.max_force, self.boid_mass,
-                                                    self.center_weight, self.width, self.height)
-        self.positions = loop_out_of_bounds(self.positions, self.width, self.height)
+        positions, velocities, species = self.positions, self.velocities, self.species
+        # The kernels write into the back buffers, which are then swapped in, so nothing is
+        # copied. The old positions buffer becomes prev_positions for interpolated drawing.
+        out_positions = self._prev_positions[:self.num_boids]
+        out_velocities = self._back_velocities[:self.num_boids]
+        params = self.rule_params()
+        if self.lod_mode is not None:
+            self._update_lod(positions, velocities, species, out_positions, out_velocities, params)
+        elif self.backend == "grid":
+            cell_size = self.interaction_radius()
+            cell_start, cell_boids, grid_w, grid_h = build_cell_list(positions, cell_size,
+                                                                     float(self.width), float(self.height))
+            boid_update_grid(positions, velocities, species, out_positions, out_velocities,
+                             cell_start, cell_boids, cell_size, grid_w, grid_h, *params)
+        elif self.backend == "verlet":
+            boid_update_verlet(positions, velocities, species, out_positions, out_velocities,
+                               *self.neighbor_lists(), *params)
+        else:
+            boid_update(positions, velocities, species, out_positions, out_velocities, *params)
+        self._positions, self._prev_positions = self._prev_positions, self._positions
+        self._velocities, self._back_velocities = self._back_velocities, self._velocities
+        loop_out_of_bounds(self.positions, float(self.width), float(self.height))
+        self.notify_observers()
+
+    def _update_lod(self, positions, velocities, species, out_positions, out_velocities, params):
+        """
+        Recompute the steering of a subset of the boids sized to fit lod_budget, then move
+        every boid with its cached steering. With the whole flock in the subset this is
+        the same as a grid update.
+        """
+        n = self.num_boids
+        steering, age = self._lod_buffers()
+        subset = self._lod_indices(self.lod_subset_size(), positions, age)
+        cell_size = self.interaction_radius()
+        cell_start, cell_boids, grid_w, grid_h = build_cell_list(positions, cell_size,
+                                                                 float(self.width), float(self.height))
+        start = time.perf_counter()
+        steer_subset(positions, velocities, species, subset, steering, age,
+                     cell_start, cell_boids, cell_size, grid_w, grid_h, *params)
+        if subset.shape[0] > 0:
+            cost = (time.perf_counter() - start) * 1000.0 / subset.shape[0]
+            self._lod_cost = cost if self._lod_cost is None else 0.8 * self._lod_cost + 0.2 * cost
+        integrate(positions, velocities, species, steering[:n], age[:n], out_positions, out_velocities,
+                  self.species_params)
+        self.lod_subset = subset.shape[0]
+
+    def lod_subset_size(self):
+        """How many boids fit into lod_budget at the measured cost per boid."""
+        if self._lod_cost is None:
+            size = LOD_INITIAL_SUBSET
+        else:
+            size = int(self.lod_budget / max(self._lod_cost, 1e-9))
+        return min(max(size, LOD_MIN_SUBSET), self.num_boids)
+
+    def _lod_indices(self, size, positions, age):
+        """The boids to refresh this tick, picked according to lod_mode."""
+        n = self.num_boids
+        if size >= n:
+            return np.arange(n)
+        if self.lod_mode == "round_robin":
+            indices = np.arange(self._lod_cursor, self._lod_cursor + size) % n
+            self._lod_cursor = (self._lod_cursor + size) % n
+            return indices
+        fx, fy = self.lod_focus
+        distance = np.hypot(positions[:, 0] - fx, positions[:, 1] - fy)
+        priority = age[:n] / (1.0 + distance / LOD_FALLOFF)
+        indices = np.argpartition(priority, n - size)[n - size:]
+        indices.sort() # Walk memory in order
+        return indices
+
+    def _lod_buffers(self):
+        """
+        The steering cache and refresh ages, grown to the flock size. Boids that were
+        spawned since the last tick start with no steering and get refreshed first.
+        """
+        n = self.num_boids
+        if self._steering is None or self._steering.shape[0] < n:
+            steering = np.zeros((self.capacity, 2), self.dtype)
+            age = np.zeros(self.capacity, np.int64)
+            if self._steering is not None:
+                steering[:self._lod_count] = self._steering[:self._lod_count]
+                age[:self._lod_count] = self._age[:self._lod_count]
+            self._steering, self._age = steering, age
+        if self._lod_count < n:
+            self._steering[self._lod_count:n] = 0.0
+            self._age[self._lod_count:n] = np.iinfo(np.int64).max // 2
+        self._lod_count = n
+        return self._steering, self._age
+
+    def neighbor_lists(self):
+        """
+        The Verlet neighbor lists with everything boid_update_verlet needs to use them, as
+        the tuple of its arguments from neighbor_start to grid_h. The lists are kept in the
+        order of the cell list they were built from, so boids that are close together are
+        close in memory: slot s is boid order[s], and the slots of its neighbors are
+        neighbors[neighbor_start[s]:neighbor_start[s + 1] - 1], every boid within the
+        largest rule radius plus the skin when the lists were built.
+
+        The lists stay valid while no boid moved more than half the skin, since only then
+        can two boids have closed the gap between them. Boids that wrapped around the world
+        edge are tracked separately instead, so the lists are only rebuilt once some other
+        boid moved too far or more than WRAPPED_REBUILD_FRACTION of the flock wrapped.
+        """
+        skin = self.verlet_skin()
+        cutoff = self.interaction_radius() + skin
+        cell_size = cutoff / VERLET_CELL_DIVISIONS
+        positions = self.positions
+        width, height = float(self.width), float(self.height)
+        wrapped_count = -1
+        if self._neighbor_lists is not None and cutoff == self._neighbor_cutoff:
+            wrapped_count = verlet_status(positions, self._neighbor_lists[2], self._neighbor_reference,
+                                          self._wrapped, skin / 2.0, width, height)
+        if wrapped_count < 0 or wrapped_count > WRAPPED_REBUILD_FRACTION * self.num_boids:
+            cell_start, order, grid_w, grid_h = build_cell_list(positions, cell_size, width, height)
+            reference = positions[order]
+            neighbor_start, neighbors = build_neighbor_lists(reference, cell_start, cutoff, cell_size,
+                                                             VERLET_CELL_DIVISIONS, grid_w, grid_h)
+            self._neighbor_lists = (neighbor_start, neighbors, order, cell_start, grid_w, grid_h)
+            self._neighbor_cutoff = cutoff
+            self._neighbor_reference = reference
+            self._wrapped = np.zeros(self.num_boids, np.uint8)
+            self.neighbor_rebuilds += 1
+            wrapped_count = 0
+        neighbor_start, neighbors, order, cell_start, grid_w, grid_h = self._neighbor_lists
+        wrapped_slots = np.flatnonzero(self._wrapped) if wrapped_count else self._no_wrapped
+        # The wrapped boids are binned on the same grid, an empty list bins nothing
+        wrapped_start, wrapped_boids, _, _ = build_cell_list(positions[order[wrapped_slots]], cell_size,
+                                                             width, height)
+        return (neighbor_start, neighbors, order, self._wrapped, cell_start, wrapped_slots[wrapped_boids],
+                wrapped_start, cell_size, VERLET_CELL_DIVISIONS, grid_w, grid_h)
+
+    def attach(self, observer):
+        """Call observer.on_update(flock) after every update, e.g. to record the run."""
+        self.observers.append(observer)
+
+    def detach(self, observer):
+        self.observers.remove(observer)
+
+    def notify_observers(self):
+        for observer in self.observers:
+            observer.on_update(self)
     
-    def add_boid(self, position=None, velocity=None):
+    def add_boid(self, position=None, velocity=None, species=None):
         if position is None:
-            position = np.random.rand(2) * [self.width, self.height]
+            position = self.rng.random(2) * [self.width, self.height]
         if velocity is None:
-            velocity = (np.random.rand(2) - 0.5) * 10
+            velocity = (self.rng.random(2) - 0.5) * 10
         # Scale position to window size
         scaled_x = position[0] / self.scale_x
         scaled_y = position[1] / self.scale_y
         position = (scaled_x, scaled_y)
-        
-        self.positions = np.vstack((self.positions, position))
-        self.velocities = np.vstack((self.velocities, velocity))
+
+        self.reserve(self.num_boids + 1)
+        self._positions[self.num_boids] = position
+        self._velocities[self.num_boids] = velocity
+        self._prev_positions[self.num_boids] = position
+        self._species[self.num_boids] = self.selected_species if species is None else species
         self.num_boids += 1
+        self.invalidate_neighbors()
+
+    def add_boids(self, n, region=None, velocities=None, species=None):
+        """
+        Spawn n boids at once, uniformly inside region (x, y, width, height) in world
+        coordinates, or anywhere in the world if region is None.
+        Velocities are random unless an (n, 2) array is given. The boids are of the
+        selected species unless species is given, as an id or an array of n ids.
+        """
+        if n <= 0:
+            return
+        if region is None:
+            region = (0, 0, self.width, self.height)
+        x, y, w, h = region
+        start, end = self.num_boids, self.num_boids + n
+        self.reserve(end)
+        self._positions[start:end] = self.rng.random((n, 2)) * (w, h) + (x, y)
+        if velocities is None:
+            velocities = (self.rng.random((n, 2)) - 0.5) * 10
+        self._velocities[start:end] = velocities
+        self._prev_positions[start:end] = self._positions[start:end]
+        self._species[start:end] = self.selected_species if species is None else species
+        self.num_boids = end
+        self.invalidate_neighbors()
+
+    def remove_boids(self, mask):
+        """
+        Remove every live boid where the boolean mask is True.
+        Survivors are compacted to the front of the storage, keeping their order.
+        """
+        keep = ~np.asarray(mask, dtype=bool)
+        count = int(np.count_nonzero(keep))
+        self._positions[:count] = self.positions[keep]
+        self._velocities[:count] = self.velocities[keep]
+        self._prev_positions[:count] = self.prev_positions[keep]
+        self._species[:count] = self.species[keep]
+        if self._steering is not None:
+            live = keep[:self._lod_count]
+            self._steering[:np.count_nonzero(live)] = self._steering[:self._lod_count][live]
+            self._age[:np.count_nonzero(live)] = self._age[:self._lod_count][live]
+            self._lod_count = int(np.count_nonzero(live))
+        self.num_boids = count
+        self.invalidate_neighbors()
+
+    def save(self, path):
+        """
+        Write a checkpoint of the whole flock: positions, velocities, species, the species
+        tables, the obstacles, the backend, display settings and the RNG state. The file is
+        written next to path and then moved over it, so an interrupted save never destroys
+        the previous checkpoint.
+        """
+        obstacles = None
+        if not self.obstacles.empty:
+            obstacles = {"cell": self.obstacles.cell, "shape": list(self.obstacles.mask.shape)}
+        header = {
+            "version": 3,
+            "dtype": self.dtype.str,
+            "num_boids": self.num_boids,
+            "backend": self.backend,
+            "world": [self.width, self.height],
+            "weights": {key: float(getattr(self, key)) for key in WEIGHT_KEYS},
+            "species_params": self.species_params.tolist(),
+            "interactions": self.interactions.tolist(),
+            "species_colors": self.species_colors.tolist(),
+            "selected_species": self.selected_species,
+            "display": {key: getattr(self, key) for key in DISPLAY_KEYS},
+            "seed": self.seed,
+            "rng": self.rng.bit_generator.state,
+            "obstacles": obstacles,
+        }
+        text = json.dumps(header).encode()
+        offset = _aligned(len(CHECKPOINT_MAGIC) + 4 + len(text))
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "wb") as f:
+            f.write(CHECKPOINT_MAGIC + np.uint32(len(text)).tobytes() + text)
+            f.write(bytes(offset - f.tell()))
+            # Live views are contiguous, so they are written without an intermediate copy
+            f.write(memoryview(np.ascontiguousarray(self.positions)))
+            f.write(memoryview(np.ascontiguousarray(self.velocities)))
+            f.write(bytes(_aligned(f.tell()) - f.tell()))
+            f.write(memoryview(np.ascontiguousarray(self.species)))
+            if obstacles is not None:
+                f.write(bytes(_aligned(f.tell()) - f.tell()))
+                f.write(memoryview(np.ascontiguousarray(self.obstacles.mask).view(np.uint8)))
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load(cls, path, **kwargs):
+        """
+        Create a flock from a checkpoint written by save. Extra keyword arguments go to the
+        constructor, a backend given there wins over the checkpoint's. The arrays are a
+        copy-on-write memory map of the file, so nothing is read until it is used and loading
+        takes the same time for any flock size.
+        """
+        with open(path, "rb") as f:
+            if f.read(len(CHECKPOINT_MAGIC)) != CHECKPOINT_MAGIC:
+                raise ValueError(f"{path} is not a boids checkpoint")
+            length = int(np.frombuffer(f.read(4), dtype=np.uint32)[0])
+            header = json.loads(f.read(length))
+        kwargs.setdefault("backend", header.get("backend", "grid"))
+        flock = cls(0, weights=header["weights"], dtype=header["dtype"], seed=header["seed"], **kwargs)
+        flock.width, flock.height = header["world"]
+        obstacles = header.get("obstacles")
+        if obstacles is None:
+            flock.obstacles = ObstacleField(flock.width, flock.height)
+        else:
+            flock.obstacles = ObstacleField(flock.width, flock.height, obstacles["cell"])
+        for key, value in header["display"].items():
+            setattr(flock, key, value)
+        flock.rng.bit_generator.state = header["rng"]
+        if "species_params" in header:
+            species_params = np.array(header["species_params"])
+            # Checkpoints from before a weight was added get its default
+            missing = WEIGHT_KEYS[species_params.shape[1]:]
+            flock.species_params = np.hstack((species_params,
+                                              np.tile([DEFAULT_WEIGHTS[key] for key in missing],
+                                                      (species_params.shape[0], 1))))
+            flock.interactions = np.array(header["interactions"])
+            flock.species_colors = np.array(header["species_colors"])
+            flock.selected_species = header["selected_species"]
+        n = header["num_boids"]
+        offset = _aligned(len(CHECKPOINT_MAGIC) + 4 + length)
+        species_offset = _aligned(offset + 2 * n * 2 * flock.dtype.itemsize)
+        if n > 0:
+            state = np.memmap(path, dtype=flock.dtype, mode="c", offset=offset, shape=(2, n, 2))
+            species = None
+            if "species_params" in header:
+                species = np.memmap(path, dtype=np.int32, mode="c", offset=species_offset, shape=n)
+                species = np.asarray(species)
+            flock.adopt(np.asarray(state[0]), np.asarray(state[1]), species)
+        if obstacles is not None:
+            mask = np.fromfile(path, dtype=np.uint8, count=int(np.prod(obstacles["shape"])),
+                               offset=_aligned(species_offset + 4 * n))
+            flock.obstacles.set_mask(mask.reshape(obstacles["shape"]).view(np.bool_))
+        return flock
+
+    def adopt(self, positions, velocities, species=None):
+        """
+        Take over the given arrays as the flock's storage without copying them.
+        Without species every boid is of species 0.
+        """
+        n = positions.shape[0]
+        self._positions = positions
+        self._velocities = velocities
+        self._species = np.zeros(n, np.int32) if species is None else species
+        # The back buffers are needed by the first update anyway. Copying the positions is
+        # the only full pass over the data, interpolated drawing needs it before that update.
+        self._prev_positions = positions.copy()
+        self._back_velocities = np.zeros((n, 2), self.dtype)
+        self.num_boids = n
+        self.capacity = n
+        self._steering = self._age = None
+        self._lod_count = 0
+        self.invalidate_neighbors()
     
-    def draw(self, surface):
-        if not BOIDS_VISIBLE:
+    def draw(self, surface, interpolate=1.0, radius=None, render_scale=1.0):
+        """
+        Draw the flock. interpolate is how far between the previous and the current
+        update to draw the boids, 1.0 draws the latest positions.
+        radius overrides splat_radius. render_scale is the size of surface relative to the
+        window, so scale_x/scale_y keep mapping window pixels (like the mouse) to the world.
+        """
+        if not self.visible:
             return
         # Get surface dimensions
-        current_window_height = surface.get_height()
-        current_window_width = surface.get_width()
+        current_window_height = surface.get_height() / render_scale
+        current_window_width = surface.get_width() / render_scale
         
         self.scale_x = current_window_width / self.width
         self.scale_y = current_window_height / self.height
-        # Draw the boid on the surface
-        
-        for pos in self.positions:
-            x, y = pos
-            render_position = (int(x * self.scale_x), int(y * self.scale_y))
-            width, height = self.width, self.height
-            ''' 
-            if BLOOM_ON:
-                    bloom_color = [float(55 * x / width), float(55 * y / height), 20]
-                    #print("BLOOM COLOR", bloom_color)
-                    pg.draw.circle(surface, bloom_color, render_position, 5)
-            '''
-                
-            boid_color = [float(100 * x / width) + 155, float(100 * y / height) + 155, 255]
-            #print("BOID COLOR", boid_color)
-            pg.draw.circle(surface, boid_color, render_position, 1)
-            pass
-
-
-@njit(parallel=True)
-def boid_update(positions, velocities, sep_weight, ali_weight, coh_weight,
-                 separation_dist, alignment_dist, cohesion_dist,
-                 max_speed, max_force, boid_mass,
-                 center_weight, world_width, world_height):
+        radius = self.splat_radius if radius is None else radius
+        render.draw_flock(surface, self.render_mode, self.positions, self.velocities, self.width, self.height,
+                          radius, previous=self.prev_positions, alpha=interpolate,
+                          species=self.species, colors=self.species_colors,
+                          density_threshold=self.density_threshold, hue=self.density_hue)
+
+
+def _aligned(offset):
+    return -(-offset // CHECKPOINT_ALIGNMENT) * CHECKPOINT_ALIGNMENT
+
+
+@njit(parallel=True, nogil=True, cache=True)
+def boid_update(positions, velocities, species, out_positions, out_velocities,
+                species_params, interactions, obstacles, obstacle_cell, world_width, world_height):
     """
     Update all boid positions and velocities using the three flocking rules:
     separation, alignment, and cohesion, plus a centering force.
+    Every boid follows the parameter row of its species, and each neighbor's contribution
+    is scaled by the interaction weights between the two species.
+    This is the O(N^2) reference kernel, every boid is compared with every other boid.
+    Results are written to out_positions/out_velocities, which must not alias the inputs.
     """
-    
     N = positions.shape[0]
-    new_positions = positions.copy()
-    new_velocities = velocities.copy()
 
     for i in prange(N):
-        pos = positions[i]
-        vel = velocities[i]
+        px = positions[i, 0]
+        py = positions[i, 1]
+        own = species[i]
+        params = species_params[own]
+        # Compare squared distances so the neighbor loop never takes a square root
+        sep_dist2 = params[3] * params[3]
+        ali_dist2 = params[4] * params[4]
+        coh_dist2 = params[5] * params[5]
 
-        # Initialize rule vectors and neighbor counters
-        separation = np.zeros(2)
-        alignment = np.zeros(2)
-        cohesion = np.zeros(2)
-        total_sep = 0
-        total_ali = 0
-        total_coh = 0
+        # Scalar rule accumulators and (interaction weighted) neighbor counts, nothing is allocated per boid
+        sep_x = 0.0
+        sep_y = 0.0
+        ali_x = 0.0
+        ali_y = 0.0
+        coh_x = 0.0
+        coh_y = 0.0
+        total_ali = 0.0
+        total_coh = 0.0
 
         # Loop over all other boids to compute rule effects
         for j in range(N):
             if i == j:
                 continue
-            diff = positions[j] - pos
-            dist = np.linalg.norm(diff)
-            if dist < 1e-5:
+            dx = positions[j, 0] - px
+            dy = positions[j, 1] - py
+            dist2 = dx * dx + dy * dy
+            if dist2 < 1e-10:
                 continue
+            other = species[j]
 
             # Separation: steer away from close neighbors
-            if dist < separation_dist:
-                if dist > 0:
-                    separation -= (diff) / (dist * dist)
-                else:
-                    separation -= 1 # Avoid division by zero
-                total_sep += 1
+            if dist2 < sep_dist2:
+                weight = interactions[own, other, 0]
+                sep_x -= weight * dx / dist2
+                sep_y -= weight * dy / dist2
 
             # Alignment: match velocity with nearby boids
-            if dist < alignment_dist:
-                alignment += velocities[j]
-                total_ali += 1
+            if dist2 < ali_dist2:
+                weight = interactions[own, other, 1]
+                ali_x += weight * velocities[j, 0]
+                ali_y += weight * velocities[j, 1]
+                total_ali += weight
 
             # Cohesion: move toward the average position of nearby boids
-            if dist < cohesion_dist:
-                cohesion += positions[j]
-                total_coh += 1
-
-        # Average and finalize rule vectors
-        norm_sep = np.linalg.norm(separation)
-        if norm_sep > 0:
-            separation = separation / norm_sep * max_speed - vel
-        if total_ali > 0:
-            alignment /= total_ali
-            # Desired velocity for alignment
-            alignment = alignment / (np.linalg.norm(alignment) + 1e-8) * max_speed - vel
-        if total_coh > 0:
-            cohesion /= total_coh
-            # Desired velocity toward center of mass
-            cohesion = cohesion - pos
-            cohesion = cohesion / (np.linalg.norm(cohesion) + 1e-8) * max_speed - vel
-
-        # Centering: steer toward the center of the world
-        center = np.array([world_width / 2.0, world_height / 2.0])
-        to_center = center - pos
-        dist_to_center = np.linalg.norm(to_center)
-        centering = np.zeros(2)
-        if dist_to_center > 0:
-            # Desired velocity toward center, scaled by distance from center
-            centering = to_center / dist_to_center * max_speed - vel
-
-        # Combine the three rules with weights
-        steer = (
-            sep_weight * separation +
-            ali_weight * alignment +
-            coh_weight * cohesion +
-            center_weight * centering
-        )
-
-        # Limit the steering force to max_force
-        norm = np.linalg.norm(steer)
-        if norm > max_force:
-            steer = steer / norm * max_force
-        
-        # Scale steering by boid mass
-        steer /= boid_mass
+            if dist2 < coh_dist2:
+                weight = interactions[own, other, 2]
+                coh_x += weight * positions[j, 0]
+                coh_y += weight * positions[j, 1]
+                total_coh += weight
+
+        vx, vy = _steer(px, py, velocities[i, 0], velocities[i, 1],
+                        sep_x, sep_y, ali_x, ali_y, total_ali, coh_x, coh_y, total_coh,
+                        params, obstacles, obstacle_cell, world_width, world_height)
+
+        # Write the new velocity and position
+        out_velocities[i, 0] = vx
+        out_velocities[i, 1] = vy
+        out_positions[i, 0] = px + vx
+        out_positions[i, 1] = py + vy
+
+@njit(parallel=True, nogil=True, cache=True)
+def boid_update_grid(positions, velocities, species, out_positions, out_velocities,
+                     cell_start, cell_boids, cell_size, grid_w, grid_h,
+                     species_params, interactions, obstacles, obstacle_cell, world_width, world_height):
+    """
+    Same flocking rules as boid_update, but neighbors are looked up through the
+    cell list built by build_cell_list. Cells are at least as wide as the largest
+    rule radius of any species, so every neighbor of a boid is inside the 3x3 block
+    of cells around it.
+    """
+    N = positions.shape[0]
+
+    for i in prange(N):
+        px = positions[i, 0]
+        py = positions[i, 1]
+        own = species[i]
+        params = species_params[own]
+        sep_dist2 = params[3] * params[3]
+        ali_dist2 = params[4] * params[4]
+        coh_dist2 = params[5] * params[5]
+
+        sep_x = 0.0
+        sep_y = 0.0
+        ali_x = 0.0
+        ali_y = 0.0
+        coh_x = 0.0
+        coh_y = 0.0
+        total_ali = 0.0
+        total_coh = 0.0
+
+        cx, cy = _cell_coords(px, py, cell_size, grid_w, grid_h)
+        for gy in range(max(cy - 1, 0), min(cy + 2, grid_h)):
+            for gx in range(max(cx - 1, 0), min(cx + 2, grid_w)):
+                cell = gy * grid_w + gx
+                for k in range(cell_start[cell], cell_start[cell + 1]):
+                    j = cell_boids[k]
+                    if i == j:
+                        continue
+                    dx = positions[j, 0] - px
+                    dy = positions[j, 1] - py
+                    dist2 = dx * dx + dy * dy
+                    if dist2 < 1e-10:
+                        continue
+                    other = species[j]
+                    if dist2 < sep_dist2:
+                        weight = interactions[own, other, 0]
+                        sep_x -= weight * dx / dist2
+                        sep_y -= weight * dy / dist2
+                    if dist2 < ali_dist2:
+                        weight = interactions[own, other, 1]
+                        ali_x += weight * velocities[j, 0]
+                        ali_y += weight * velocities[j, 1]
+                        total_ali += weight
+                    if dist2 < coh_dist2:
+                        weight = interactions[own, other, 2]
+                        coh_x += weight * positions[j, 0]
+                        coh_y += weight * positions[j, 1]
+                        total_coh += weight
+
+        vx, vy = _steer(px, py, velocities[i, 0], velocities[i, 1],
+                        sep_x, sep_y, ali_x, ali_y, total_ali, coh_x, coh_y, total_coh,
+                        params, obstacles, obstacle_cell, world_width, world_height)
+        out_velocities[i, 0] = vx
+        out_velocities[i, 1] = vy
+        out_positions[i, 0] = px + vx
+        out_positions[i, 1] = py + vy
+
+@njit(parallel=True, nogil=True, cache=True)
+def boid_update_verlet(positions, velocities, species, out_positions, out_velocities,
+                       neighbor_start, neighbors, order, wrapped, cell_start, wrapped_slots, wrapped_start,
+                       cell_size, reach, grid_w, grid_h,
+                       species_params, interactions, obstacles, obstacle_cell, world_width, world_height):
+    """
+    Same flocking rules as boid_update, with neighbors taken from the Verlet lists built
+    by build_neighbor_lists. The boids are first gathered into the cell order the lists
+    were built in (slot s holds boid order[s]), so boids that are close together are
+    close in memory too and the lists are walked through mostly cached rows.
+
+    Boids flagged in wrapped (by slot) have jumped across the world since the lists
+    were built, so the lists are wrong for them in both directions:
+    - every boid looks them up in the small cell list of wrapped boids (wrapped_start,
+      wrapped_slots) and skips them in its own list
+    - they find everyone else in the cell list the Verlet lists were built from
+      (cell_start), which still covers every boid that stayed within half the skin
+    Both cell lists use cells cell_size wide and are searched reach cells around the boid.
+    Cells are numbered row by row, so each row of that block is one contiguous run of slots.
+    """
+    N = positions.shape[0]
+    sorted_positions = np.empty_like(positions)
+    sorted_velocities = np.empty_like(velocities)
+    sorted_species = np.empty_like(species)
+    for s in prange(N):
+        i = order[s]
+        sorted_positions[s, 0] = positions[i, 0]
+        sorted_positions[s, 1] = positions[i, 1]
+        sorted_velocities[s, 0] = velocities[i, 0]
+        sorted_velocities[s, 1] = velocities[i, 1]
+        sorted_species[s] = species[i]
+
+    for s in prange(N):
+        px = sorted_positions[s, 0]
+        py = sorted_positions[s, 1]
+        own = sorted_species[s]
+        params = species_params[own]
+        sep_dist2 = params[3] * params[3]
+        ali_dist2 = params[4] * params[4]
+        coh_dist2 = params[5] * params[5]
+
+        sep_x = 0.0
+        sep_y = 0.0
+        ali_x = 0.0
+        ali_y = 0.0
+        coh_x = 0.0
+        coh_y = 0.0
+        total_ali = 0.0
+        total_coh = 0.0
+
+        cx, cy = _cell_coords(px, py, cell_size, grid_w, grid_h)
+        x0 = max(cx - reach, 0)
+        x1 = min(cx + reach + 1, grid_w)
+        if wrapped[s]:
+            for gy in range(max(cy - reach, 0), min(cy + reach + 1, grid_h)):
+                for j in range(cell_start[gy * grid_w + x0], cell_start[gy * grid_w + x1]):
+                    if wrapped[j]:
+                        continue
+                    other = sorted_species[j]
+                    sep_x, sep_y, ali_x, ali_y, total_ali, coh_x, coh_y, total_coh = _accumulate(
+                        px, py, sorted_positions[j, 0], sorted_positions[j, 1],
+                        sorted_velocities[j, 0], sorted_velocities[j, 1],
+                        interactions[own, other, 0], interactions[own, other, 1],
+                        interactions[own, other, 2], sep_dist2, ali_dist2, coh_dist2,
+                        sep_x, sep_y, ali_x, ali_y, total_ali, coh_x, coh_y, total_coh)
+        else:
+            # The last slot of every list is padding, see build_neighbor_lists
+            for k in range(neighbor_start[s], neighbor_start[s + 1] - 1):
+                j = neighbors[k]
+                if wrapped[j]:
+                    continue
+                other = sorted_species[j]
+                sep_x, sep_y, ali_x, ali_y, total_ali, coh_x, coh_y, total_coh = _accumulate(
+                    px, py, sorted_positions[j, 0], sorted_positions[j, 1],
+                    sorted_velocities[j, 0], sorted_velocities[j, 1],
+                    interactions[own, other, 0], interactions[own, other, 1],
+                    interactions[own, other, 2], sep_dist2, ali_dist2, coh_dist2,
+                    sep_x, sep_y, ali_x, ali_y, total_ali, coh_x, coh_y, total_coh)
+        if wrapped_slots.shape[0] > 0:
+            for gy in range(max(cy - reach, 0), min(cy + reach + 1, grid_h)):
+                for k in range(wrapped_start[gy * grid_w + x0], wrapped_start[gy * grid_w + x1]):
+                    j = wrapped_slots[k]
+                    if j == s:
+                        continue
+                    other = sorted_species[j]
+                    sep_x, sep_y, ali_x, ali_y, total_ali, coh_x, coh_y, total_coh = _accumulate(
+                        px, py, sorted_positions[j, 0], sorted_positions[j, 1],
+                        sorted_velocities[j, 0], sorted_velocities[j, 1],
+                        interactions[own, other, 0], interactions[own, other, 1],
+                        interactions[own, other, 2], sep_dist2, ali_dist2, coh_dist2,
+                        sep_x, sep_y, ali_x, ali_y, total_ali, coh_x, coh_y, total_coh)
+
+        vx, vy = _steer(px, py, sorted_velocities[s, 0], sorted_velocities[s, 1],
+                        sep_x, sep_y, ali_x, ali_y, total_ali, coh_x, coh_y, total_coh,
+                        params, obstacles, obstacle_cell, world_width, world_height)
+        i = order[s]
+        out_velocities[i, 0] = vx
+        out_velocities[i, 1] = vy
+        out_positions[i, 0] = px + vx
+        out_positions[i, 1] = py + vy
+
+@njit(nogil=True, cache=True)
+def _accumulate(px, py, qx, qy, wx, wy, sep_scale, ali_scale, coh_scale, sep_dist2, ali_dist2, coh_dist2,
+                sep_x, sep_y, ali_x, ali_y, total_ali, coh_x, coh_y, total_coh):
+    """
+    Add one neighbor at (qx, qy) moving at (wx, wy) to the rule sums of the boid at (px, py),
+    scaled by the interaction weights of the two species. Returns the updated sums.
+    Rules a neighbor is out of range of add zero instead of being branched around: whether
+    it is in range is close to a coin flip, and mispredicted branches used to cost more
+    than all of the arithmetic.
+    """
+    dx = qx - px
+    dy = qy - py
+    dist2 = dx * dx + dy * dy
+    apart = dist2 >= 1e-10
+    sep = sep_scale if apart and dist2 < sep_dist2 else 0.0
+    sep = sep / max(dist2, 1e-10)
+    ali = ali_scale if apart and dist2 < ali_dist2 else 0.0
+    coh = coh_scale if apart and dist2 < coh_dist2 else 0.0
+    return (sep_x - sep * dx, sep_y - sep * dy, ali_x + ali * wx, ali_y + ali * wy, total_ali + ali,
+            coh_x + coh * qx, coh_y + coh * qy, total_coh + coh)
+
+@njit(parallel=True, nogil=True, cache=True)
+def steer_subset(positions, velocities, species, subset, steering, age,
+                 cell_start, cell_boids, cell_size, grid_w, grid_h,
+                 species_params, interactions, obstacles, obstacle_cell, world_width, world_height):
+    """
+    Level of detail step one: recompute the steering of just the boids in subset, with the
+    same rules and grid lookup as boid_update_grid. Their velocity change is stored in
+    steering and their age reset, nothing is moved yet.
+    """
+    for s in prange(subset.shape[0]):
+        i = subset[s]
+        px = positions[i, 0]
+        py = positions[i, 1]
+        own = species[i]
+        params = species_params[own]
+        sep_dist2 = params[3] * params[3]
+        ali_dist2 = params[4] * params[4]
+        coh_dist2 = params[5] * params[5]
+
+        sep_x = 0.0
+        sep_y = 0.0
+        ali_x = 0.0
+        ali_y = 0.0
+        coh_x = 0.0
+        coh_y = 0.0
+        total_ali = 0.0
+        total_coh = 0.0
+
+        cx, cy = _cell_coords(px, py, cell_size, grid_w, grid_h)
+        for gy in range(max(cy - 1, 0), min(cy + 2, grid_h)):
+            for gx in range(max(cx - 1, 0), min(cx + 2, grid_w)):
+                cell = gy * grid_w + gx
+                for k in range(cell_start[cell], cell_start[cell + 1]):
+                    j = cell_boids[k]
+                    if i == j:
+                        continue
+                    sep_x, sep_y, ali_x, ali_y, total_ali, coh_x, coh_y, total_coh = _accumulate(
+                        px, py, positions[j, 0], positions[j, 1], velocities[j, 0], velocities[j, 1],
+                        interactions[own, species[j], 0], interactions[own, species[j], 1],
+                        interactions[own, species[j], 2], sep_dist2, ali_dist2, coh_dist2,
+                        sep_x, sep_y, ali_x, ali_y, total_ali, coh_x, coh_y, total_coh)
 
-        # Update velocity with steering, limit to max_speed
-        new_vel = vel + steer
-        speed = np.linalg.norm(new_vel)
+        vx, vy = _steer(px, py, velocities[i, 0], velocities[i, 1],
+                        sep_x, sep_y, ali_x, ali_y, total_ali, coh_x, coh_y, total_coh,
+                        params, obstacles, obstacle_cell, world_width, world_height)
+        steering[i, 0] = vx - velocities[i, 0]
+        steering[i, 1] = vy - velocities[i, 1]
+        age[i] = 0
+
+@njit(parallel=True, nogil=True, cache=True)
+def integrate(positions, velocities, species, steering, age, out_positions, out_velocities, species_params):
+    """
+    Level of detail step two: move every boid, applying its cached steering and the
+    max_speed of its species. Boids refreshed this tick end up exactly where a full update puts them.
+    """
+    for i in prange(positions.shape[0]):
+        max_speed = species_params[species[i], 6]
+        vx = velocities[i, 0] + steering[i, 0]
+        vy = velocities[i, 1] + steering[i, 1]
+        speed = np.sqrt(vx * vx + vy * vy)
         if speed > max_speed:
-            new_vel = new_vel / speed * max_speed
+            vx = vx / speed * max_speed
+            vy = vy / speed * max_speed
+        out_velocities[i, 0] = vx
+        out_velocities[i, 1] = vy
+        out_positions[i, 0] = positions[i, 0] + vx
+        out_positions[i, 1] = positions[i, 1] + vy
+        age[i] += 1
 
-        # Update arrays with new velocity and position
-        new_velocities[i] = new_vel
-        new_positions[i] = pos + new_vel
+@njit(parallel=True, nogil=True, cache=True)
+def build_neighbor_lists(sorted_positions, cell_start, cutoff, cell_size, reach, grid_w, grid_h):
+    """
+    List every other boid within cutoff of each boid. sorted_positions are the positions
+    in the order of a cell list with cells cell_size wide, searched reach cells around
+    each boid, so a row of cells is one contiguous run of slots.
+    Returns (neighbor_start, neighbors) in compressed row form: the neighbors of slot s,
+    as slots, are neighbors[neighbor_start[s]:neighbor_start[s + 1] - 1]. Every list ends
+    in a padding slot that the branch free fill below may scribble on, which keeps it from
+    writing into the next list. Boids are counted in a first pass so the lists are
+    allocated once at their exact size.
+    """
+    N = sorted_positions.shape[0]
+    cutoff2 = cutoff * cutoff
+    neighbor_start = np.zeros(N + 1, dtype=np.int64)
+    for s in prange(N):
+        px = sorted_positions[s, 0]
+        py = sorted_positions[s, 1]
+        count = 1 # The padding slot
+        cx, cy = _cell_coords(px, py, cell_size, grid_w, grid_h)
+        x0 = max(cx - reach, 0)
+        x1 = min(cx + reach + 1, grid_w)
+        for gy in range(max(cy - reach, 0), min(cy + reach + 1, grid_h)):
+            for j in range(cell_start[gy * grid_w + x0], cell_start[gy * grid_w + x1]):
+                dx = sorted_positions[j, 0] - px
+                dy = sorted_positions[j, 1] - py
+                count += (dx * dx + dy * dy < cutoff2) & (j != s)
+        neighbor_start[s + 1] = count
+    for s in range(N):
+        neighbor_start[s + 1] += neighbor_start[s]
+    # 32 bit indices halve the size of the list, which is what the update streams through
+    neighbors = np.empty(neighbor_start[N], dtype=np.int32)
+    for s in prange(N):
+        px = sorted_positions[s, 0]
+        py = sorted_positions[s, 1]
+        fill = neighbor_start[s]
+        cx, cy = _cell_coords(px, py, cell_size, grid_w, grid_h)
+        x0 = max(cx - reach, 0)
+        x1 = min(cx + reach + 1, grid_w)
+        for gy in range(max(cy - reach, 0), min(cy + reach + 1, grid_h)):
+            for j in range(cell_start[gy * grid_w + x0], cell_start[gy * grid_w + x1]):
+                dx = sorted_positions[j, 0] - px
+                dy = sorted_positions[j, 1] - py
+                # Always store, only keep it by moving on when it is a neighbor
+                neighbors[fill] = j
+                fill += (dx * dx + dy * dy < cutoff2) & (j != s)
+    return neighbor_start, neighbors
 
-    return new_positions, new_velocities
+@njit(nogil=True, cache=True)
+def verlet_status(positions, order, reference, wrapped, limit, world_width, world_height):
+    """
+    Compare positions with the reference positions the Verlet lists were built from,
+    which are stored by slot (slot s is boid order[s]). Boids that moved more than half
+    the world wrapped around its edge and get their slot flagged in wrapped (flags stay
+    set until the next rebuild). Returns how many boids are flagged, or -1 as soon as
+    a boid that did not wrap moved further than limit.
+    """
+    limit2 = limit * limit
+    count = 0
+    for s in range(order.shape[0]):
+        i = order[s]
+        dx = positions[i, 0] - reference[s, 0]
+        dy = positions[i, 1] - reference[s, 1]
+        if wrapped[s] or abs(dx) > world_width / 2 or abs(dy) > world_height / 2:
+            wrapped[s] = 1
+            count += 1
+        elif dx * dx + dy * dy > limit2:
+            return -1
+    return count
 
-@njit(parallel=True)
+@njit(nogil=True, cache=True)
+def _steer(px, py, vx, vy, sep_x, sep_y, ali_x, ali_y, total_ali, coh_x, coh_y, total_coh,
+           params, obstacles, obstacle_cell, world_width, world_height):
+    """
+    Turn the accumulated rule sums of one boid into its new velocity (vx, vy).
+    params is the boid's row of the species parameter table, in WEIGHT_KEYS order.
+    obstacles is the signed distance field of an ObstacleField, sampled once per boid.
+    Shared by every neighbor search backend so they all steer the same way.
+    Everything is done on scalars so Numba keeps it in registers.
+    """
+    sep_weight = params[0]
+    ali_weight = params[1]
+    coh_weight = params[2]
+    max_speed = params[6]
+    max_force = params[7]
+    boid_mass = params[8]
+    center_weight = params[9]
+    avoid_weight = params[10]
+    # Average and finalize rule vectors
+    norm_sep = np.sqrt(sep_x * sep_x + sep_y * sep_y)
+    if norm_sep > 0:
+        sep_x = sep_x / norm_sep * max_speed - vx
+        sep_y = sep_y / norm_sep * max_speed - vy
+    if total_ali > 0:
+        ali_x /= total_ali
+        ali_y /= total_ali
+        # Desired velocity for alignment
+        norm = np.sqrt(ali_x * ali_x + ali_y * ali_y) + 1e-8
+        ali_x = ali_x / norm * max_speed - vx
+        ali_y = ali_y / norm * max_speed - vy
+    if total_coh > 0:
+        # Desired velocity toward center of mass
+        coh_x = coh_x / total_coh - px
+        coh_y = coh_y / total_coh - py
+        norm = np.sqrt(coh_x * coh_x + coh_y * coh_y) + 1e-8
+        coh_x = coh_x / norm * max_speed - vx
+        coh_y = coh_y / norm * max_speed - vy
+
+    # Centering: steer toward the center of the world
+    to_center_x = world_width / 2.0 - px
+    to_center_y = world_height / 2.0 - py
+    dist_to_center = np.sqrt(to_center_x * to_center_x + to_center_y * to_center_y)
+    center_x = 0.0
+    center_y = 0.0
+    if dist_to_center > 0:
+        # Desired velocity toward center, scaled by distance from center
+        center_x = to_center_x / dist_to_center * max_speed - vx
+        center_y = to_center_y / dist_to_center * max_speed - vy
+
+    # Combine the three rules with weights
+    steer_x = sep_weight * sep_x + ali_weight * ali_x + coh_weight * coh_x + center_weight * center_x
+    steer_y = sep_weight * sep_y + ali_weight * ali_y + coh_weight * coh_y + center_weight * center_y
+
+    # Limit the steering force to max_force
+    norm = np.sqrt(steer_x * steer_x + steer_y * steer_y)
+    if norm > max_force:
+        steer_x = steer_x / norm * max_force
+        steer_y = steer_y / norm * max_force
+
+    # Obstacle avoidance comes on top of the limited steering, so flocking never pushes
+    # boids through a wall. It grows from nothing at AVOID_MARGIN to double inside obstacles.
+    distance, away_x, away_y = _sample_field(obstacles, px, py, obstacle_cell)
+    if distance < AVOID_MARGIN:
+        strength = min((AVOID_MARGIN - distance) / AVOID_MARGIN, 2.0) * avoid_weight
+        steer_x += strength * (away_x * max_speed - vx)
+        steer_y += strength * (away_y * max_speed - vy)
+
+    # Scale steering by boid mass, update velocity and limit to max_speed
+    new_vx = vx + steer_x / boid_mass
+    new_vy = vy + steer_y / boid_mass
+    speed = np.sqrt(new_vx * new_vx + new_vy * new_vy)
+    if speed > max_speed:
+        new_vx = new_vx / speed * max_speed
+        new_vy = new_vy / speed * max_speed
+    return new_vx, new_vy
+
+@njit(nogil=True, cache=True)
+def _sample_field(field, x, y, cell):
+    """
+    Bilinear sample of the (grid_h, grid_w, 3) obstacle field at world position (x, y).
+    Returns the signed distance and the direction away from the nearest obstacle.
+    """
+    grid_h = field.shape[0]
+    grid_w = field.shape[1]
+    # Samples sit at the cell centers
+    fx = min(max(x / cell - 0.5, 0.0), grid_w - 1.0)
+    fy = min(max(y / cell - 0.5, 0.0), grid_h - 1.0)
+    x0 = min(int(fx), grid_w - 1)
+    y0 = min(int(fy), grid_h - 1)
+    x1 = min(x0 + 1, grid_w - 1)
+    y1 = min(y0 + 1, grid_h - 1)
+    tx = fx - x0
+    ty = fy - y0
+    w00 = (1.0 - tx) * (1.0 - ty)
+    w10 = tx * (1.0 - ty)
+    w01 = (1.0 - tx) * ty
+    w11 = tx * ty
+    distance = w00 * field[y0, x0, 0] + w10 * field[y0, x1, 0] + w01 * field[y1, x0, 0] + w11 * field[y1, x1, 0]
+    away_x = w00 * field[y0, x0, 1] + w10 * field[y0, x1, 1] + w01 * field[y1, x0, 1] + w11 * field[y1, x1, 1]
+    away_y = w00 * field[y0, x0, 2] + w10 * field[y0, x1, 2] + w01 * field[y1, x0, 2] + w11 * field[y1, x1, 2]
+    norm = np.sqrt(away_x * away_x + away_y * away_y)
+    if norm > 0:
+        away_x /= norm
+        away_y /= norm
+    return distance, away_x, away_y
+
+@njit(nogil=True, cache=True)
+def _cell_coords(x, y, cell_size, grid_w, grid_h):
+    """
+    Grid cell of a point. Points outside the world are clamped into the edge cells,
+    which keeps neighbors within one cell of each other.
+    """
+    cx = min(max(int(np.floor(x / cell_size)), 0), grid_w - 1)
+    cy = min(max(int(np.floor(y / cell_size)), 0), grid_h - 1)
+    return cx, cy
+
+@njit(nogil=True, cache=True)
+def build_cell_list(positions, cell_size, world_width, world_height):
+    """
+    Bin boids into a uniform grid with a counting sort.
+    Returns (cell_start, cell_boids, grid_w, grid_h): the boids in cell c are
+    cell_boids[cell_start[c]:cell_start[c + 1]], cells are numbered row by row.
+    """
+    N = positions.shape[0]
+    grid_w = max(int(np.ceil(world_width / cell_size)), 1)
+    grid_h = max(int(np.ceil(world_height / cell_size)), 1)
+    cells = np.empty(N, dtype=np.int64)
+    cell_start = np.zeros(grid_w * grid_h + 1, dtype=np.int64)
+    # Count boids per cell
+    for i in range(N):
+        cx, cy = _cell_coords(positions[i, 0], positions[i, 1], cell_size, grid_w, grid_h)
+        cells[i] = cy * grid_w + cx
+        cell_start[cells[i] + 1] += 1
+    # Prefix sum turns counts into start offsets
+    for c in range(grid_w * grid_h):
+        cell_start[c + 1] += cell_start[c]
+    # Scatter boid indices into their cells
+    fill = cell_start[:-1].copy()
+    cell_boids = np.empty(N, dtype=np.int64)
+    for i in range(N):
+        cell_boids[fill[cells[i]]] = i
+        fill[cells[i]] += 1
+    return cell_start, cell_boids, grid_w, grid_h
+
+@njit(parallel=True, nogil=True, cache=True)
 def loop_out_of_bounds(positions, width, height):
     """
     Loop all positions around if they go out of bounds.
-    positions: numpy array of shape (N, 2)
+    positions: numpy array of shape (N, 2), wrapped in place
     """
-    # Use modulo to wrap positions around the world edges
-    positions[:, 0] = np.mod(positions[:, 0], width)
-    positions[:, 1] = np.mod(positions[:, 1], height)
+    for i in prange(positions.shape[0]):
+        positions[i, 0] = positions[i, 0] % width
+        positions[i, 1] = positions[i, 1] % height
     return positions
+
+
+def kernel_signatures(dtype):
+    """
+    Explicit Numba signatures of every simulation kernel for flocks stored as dtype,
+    as (kernel, argument types) pairs. These are exactly the types BoidFlock.update calls with.
+    """
+    real = types.float64 if np.dtype(dtype) == np.float64 else types.float32
+    state = types.Array(real, 2, "C")
+    index = types.Array(types.int64, 1, "C")
+    species = types.Array(types.int32, 1, "C")
+    neighbors = types.Array(types.int32, 1, "C")
+    flags = types.Array(types.uint8, 1, "C")
+    # rule_params(): species table, interaction matrix, obstacle field and its cell size,
+    # world width and height
+    params = (types.Array(types.float64, 2, "C"), types.Array(types.float64, 3, "C"),
+              types.Array(types.float64, 3, "C"), types.float64, types.float64, types.float64)
+    return [
+        (boid_update, (state, state, species, state, state) + params),
+        (boid_update_grid, (state, state, species, state, state, index, index, types.float64,
+                            types.int64, types.int64) + params),
+        (boid_update_verlet, (state, state, species, state, state, index, neighbors, index, flags, index,
+                              index, index, types.float64, types.int64, types.int64, types.int64) + params),
+        (steer_subset, (state, state, species, index, state, index, index, index, types.float64,
+                        types.int64, types.int64) + params),
+        (integrate, (state, state, species, state, index, state, state, types.Array(types.float64, 2, "C"))),
+        (build_cell_list, (state, types.float64, types.float64, types.float64)),
+        (build_neighbor_lists, (state, index, types.float64, types.float64, types.int64, types.int64,
+                                types.int64)),
+        (verlet_status, (state, index, state, flags, types.float64, types.float64, types.float64)),
+        (loop_out_of_bounds, (state, types.float64, types.float64)),
+    ]
+
+
+def compile_kernels(dtypes=DTYPES):
+    """
+    Compile (or load from Numba's on-disk cache) every simulation kernel ahead of time,
+    so the first BoidFlock.update doesn't stall on the JIT.
+    """
+    for dtype in dtypes:
+        for kernel, signature in kernel_signatures(dtype):
+            kernel.compile(signature)
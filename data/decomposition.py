@@ -0,0 +1,317 @@
+'''
+Multi-process domain decomposition for very large flocks.
+
+DistributedFlock splits the world into vertical strips, one per worker process. Every
+update the master sorts a copy of the boids by strip (which migrates boids that crossed
+into a neighboring strip to their new owner), then each worker copies its own boids plus
+the halo of neighboring boids within one rule radius of its strip out of shared memory,
+runs the grid kernel on that and scatters the results for its own boids back to the rows
+they came from. The sort is only a scratch copy, row i is the same boid every tick.
+
+All flock state lives in multiprocessing.shared_memory, so nothing but a few small
+control messages is pickled per step. Strip boundaries are rebalanced every step from
+a histogram of x positions so each worker gets about the same number of boids.
+'''
+
+import multiprocessing as mp
+import os
+import weakref
+from multiprocessing import shared_memory
+
+import numpy as np
+from numba import njit
+
+from .boids_logic import BoidFlock, GROWTH_FACTOR, INITIAL_CAPACITY, build_cell_list, boid_update_grid, loop_out_of_bounds
+
+HISTOGRAM_BINS = 1024 # Resolution of the x histogram used to balance the strips
+
+
+class DistributedFlock(BoidFlock):
+    """
+    A BoidFlock whose update runs in worker processes that each own a strip of the world.
+    Exposes the same update()/positions interface, so Game and headless runs can use it as is.
+    The workers always run the grid kernel, backend is only accepted so checkpoints of
+    flocks with another backend can be loaded.
+    """
+    def __init__(self, num_boids, workers=2, weights=None, backend="grid", dtype=np.float64, seed=None):
+        self.num_workers = max(int(workers), 1)
+        self._segments = []
+        self._conns = []
+        self._processes = []
+        # Three position/velocity buffer pairs: current and previous (kept for interpolated
+        # drawing) swap roles every update, spare is the scratch target of the strip sort
+        self._pos_buffers = []
+        self._vel_buffers = []
+        self._cur, self._prev, self._spare = 0, 1, 2
+        # Species ids in row order, and their strip sorted scratch copy
+        self._species_buffers = []
+        # Row of the unsorted buffers every row of the sorted scratch copy came from
+        self._order = None
+        self._sent_obstacles = None # (field object, version) the workers have a copy of
+        super().__init__(num_boids, weights=weights, backend="grid", dtype=dtype, seed=seed)
+        # An empty flock still needs its buffers, update and the workers index them
+        self.reserve(1)
+        # Start with equal strips, they get rebalanced after the first update
+        self.boundaries = np.linspace(0.0, self.width, self.num_workers + 1)
+        self._start_workers()
+        self._finalizer = weakref.finalize(self, _shutdown, self._conns, self._processes, self._segments)
+
+    def _start_workers(self):
+        context = mp.get_context("spawn") # Forking a process that already runs Numba's thread pool is unsafe
+        threads = max((os.cpu_count() or 1) // self.num_workers, 1)
+        for worker_id in range(self.num_workers):
+            parent, child = context.Pipe()
+            process = context.Process(target=_worker_main, args=(child, threads),
+                                      name=f"boids-worker-{worker_id}", daemon=True)
+            process.start()
+            self._conns.append(parent)
+            self._processes.append(process)
+        self._attach_workers()
+
+    def _attach_workers(self):
+        names = [segment.name for segment in self._segments]
+        for conn in self._conns:
+            conn.send(("attach", names, self.capacity, self.dtype.str))
+        for conn in self._conns:
+            conn.recv()
+
+    def _bind(self):
+        """Point the BoidFlock storage attributes at the buffers of the current roles."""
+        self._positions = self._pos_buffers[self._cur]
+        self._velocities = self._vel_buffers[self._cur]
+        self._prev_positions = self._pos_buffers[self._prev]
+        self._back_velocities = self._vel_buffers[self._prev]
+        self._species = self._species_buffers[0]
+
+    def reserve(self, capacity):
+        """Grow the shared memory storage, workers are reattached to the new segments."""
+        if capacity <= self.capacity:
+            return
+        new_capacity = max(capacity, self.capacity * GROWTH_FACTOR, INITIAL_CAPACITY)
+        nbytes = new_capacity * 2 * self.dtype.itemsize
+        segments = [shared_memory.SharedMemory(create=True, size=nbytes) for _ in range(6)]
+        segments += [shared_memory.SharedMemory(create=True, size=new_capacity * 4) for _ in range(2)]
+        segments.append(shared_memory.SharedMemory(create=True, size=new_capacity * 8))
+        buffers, species, order = _map_buffers(segments, new_capacity, self.dtype)
+        positions, velocities, prev_positions = buffers[0], buffers[3], buffers[1]
+        positions[:self.num_boids] = self.positions
+        velocities[:self.num_boids] = self.velocities
+        prev_positions[:self.num_boids] = self.prev_positions
+        species[0][:self.num_boids] = self.species
+
+        old_segments = list(self._segments)
+        self._segments[:] = segments
+        self._pos_buffers = buffers[:3]
+        self._vel_buffers = buffers[3:]
+        self._species_buffers = species
+        self._order = order
+        self._cur, self._prev, self._spare = 0, 1, 2
+        self.capacity = new_capacity
+        self._bind()
+        if self._conns:
+            self._attach_workers()
+        for segment in old_segments:
+            _release(segment)
+
+    def adopt(self, positions, velocities, species=None):
+        """The workers can only see shared memory, so adopted arrays are copied in."""
+        n = positions.shape[0]
+        self.num_boids = 0
+        self.reserve(n)
+        self._positions[:n] = positions
+        self._velocities[:n] = velocities
+        self._prev_positions[:n] = positions
+        self._species[:n] = 0 if species is None else species
+        self.num_boids = n
+
+    def update(self, now):
+        n = self.num_boids
+        cur, prev, spare = self._cur, self._prev, self._spare
+        cell_size = self.interaction_radius()
+        # Migration: sort a copy of the boids by owning strip into the spare buffers
+        offsets, histogram = strip_sort(self._pos_buffers[cur][:n], self._vel_buffers[cur][:n],
+                                        self._species_buffers[0][:n],
+                                        self._pos_buffers[spare][:n], self._vel_buffers[spare][:n],
+                                        self._species_buffers[1][:n], self._order[:n],
+                                        self.boundaries, float(self.width), HISTOGRAM_BINS)
+        params = self.rule_params()
+        # The obstacle field only changes when obstacles are edited, so it is only pickled then
+        obstacles = (id(self.obstacles), self.obstacles.version)
+        if obstacles == self._sent_obstacles:
+            params = params[:2] + (None,) + params[3:]
+        self._sent_obstacles = obstacles
+        for worker_id, conn in enumerate(self._conns):
+            conn.send(("step", worker_id, spare, prev, n, offsets, self.boundaries, cell_size, params))
+        for conn in self._conns:
+            conn.recv()
+        # The workers scattered the new state into the old previous buffers, in row order
+        self._cur, self._prev = prev, cur
+        self._bind()
+        self.boundaries = balanced_boundaries(histogram, self.num_workers, float(self.width))
+        self.notify_observers()
+
+    def close(self):
+        """Stop the workers and free the shared memory."""
+        self._finalizer()
+
+
+def _shutdown(conns, processes, segments):
+    for conn in conns:
+        try:
+            conn.send(("quit",))
+        except (BrokenPipeError, OSError):
+            pass
+    for process in processes:
+        process.join(timeout=5)
+        if process.is_alive():
+            process.terminate()
+    for segment in segments:
+        _release(segment)
+    segments.clear()
+
+
+def _release(segment):
+    segment.unlink()
+    try:
+        segment.close()
+    except BufferError:
+        # Someone still holds a view of the old storage, the mapping goes away with it
+        pass
+
+
+def _worker_main(conn, threads):
+    """
+    Worker process loop. Owns one strip of the world per step, which strip is sent with the step.
+    """
+    import numba
+    numba.set_num_threads(min(threads, numba.config.NUMBA_NUM_THREADS))
+    segments = []
+    positions = velocities = species = order = None
+    obstacles = None
+    while True:
+        message = conn.recv()
+        command = message[0]
+        if command == "quit":
+            break
+        elif command == "attach":
+            _, names, capacity, dtype = message
+            positions = velocities = species = order = None
+            for segment in segments:
+                segment.close()
+            segments = [shared_memory.SharedMemory(name=name) for name in names]
+            buffers, species, order = _map_buffers(segments, capacity, np.dtype(dtype))
+            positions, velocities = buffers[:3], buffers[3:]
+            buffers = None
+            conn.send("attached")
+        elif command == "step":
+            _, worker_id, source, target, n, offsets, boundaries, cell_size, params = message
+            if params[2] is None:
+                params = params[:2] + (obstacles,) + params[3:]
+            obstacles = params[2]
+            _step_strip(positions[source][:n], velocities[source][:n], species[1][:n], order[:n],
+                        positions[target][:n], velocities[target][:n],
+                        worker_id, offsets, boundaries, cell_size, params)
+            conn.send("done")
+    # Drop the views before closing, shared memory can't be closed while exported
+    positions = velocities = species = order = None
+    for segment in segments:
+        segment.close()
+
+
+def _map_buffers(segments, capacity, dtype):
+    """Array views of the 6 position/velocity segments, the 2 species segments and the sort order."""
+    buffers = [np.ndarray((capacity, 2), dtype, buffer=segment.buf) for segment in segments[:6]]
+    species = [np.ndarray(capacity, np.int32, buffer=segment.buf) for segment in segments[6:8]]
+    order = np.ndarray(capacity, np.int64, buffer=segments[8].buf)
+    return buffers, species, order
+
+
+def _step_strip(positions, velocities, species, order, out_positions, out_velocities, worker_id, offsets,
+                boundaries, cell_size, params):
+    """
+    Update the boids of one strip. positions/velocities are sorted by strip, so the strip's
+    own boids are the rows offsets[worker_id]:offsets[worker_id + 1]. Their results are
+    written to the rows order says they came from, out_positions/out_velocities are unsorted.
+    """
+    start, end = offsets[worker_id], offsets[worker_id + 1]
+    if start == end:
+        return
+    num_strips = offsets.shape[0] - 1
+    # Halo exchange: copy in every boid of another strip that is within cell_size of ours
+    low = boundaries[worker_id] - cell_size if worker_id > 0 else -np.inf
+    high = boundaries[worker_id + 1] + cell_size if worker_id < num_strips - 1 else np.inf
+    halo = []
+    for strip in range(num_strips):
+        strip_low = boundaries[strip] if strip > 0 else -np.inf
+        strip_high = boundaries[strip + 1] if strip < num_strips - 1 else np.inf
+        if strip == worker_id or strip_high <= low or strip_low >= high:
+            continue
+        xs = positions[offsets[strip]:offsets[strip + 1], 0]
+        halo.append(offsets[strip] + np.flatnonzero((xs >= low) & (xs < high)))
+    halo = np.concatenate(halo) if halo else np.empty(0, dtype=np.int64)
+    local_positions = np.concatenate((positions[start:end], positions[halo]))
+    local_velocities = np.concatenate((velocities[start:end], velocities[halo]))
+    local_species = np.concatenate((species[start:end], species[halo]))
+    new_positions = np.empty_like(local_positions)
+    new_velocities = np.empty_like(local_velocities)
+
+    world_width, world_height = params[-2], params[-1]
+    cell_start, cell_boids, grid_w, grid_h = build_cell_list(local_positions, cell_size, world_width, world_height)
+    boid_update_grid(local_positions, local_velocities, local_species, new_positions, new_velocities,
+                     cell_start, cell_boids, cell_size, grid_w, grid_h, *params)
+    # Only the strip's own boids are written back, halo results are thrown away
+    own = new_positions[:end - start]
+    loop_out_of_bounds(own, world_width, world_height)
+    rows = order[start:end]
+    out_positions[rows] = own
+    out_velocities[rows] = new_velocities[:end - start]
+
+
+@njit(cache=True)
+def strip_sort(positions, velocities, species, out_positions, out_velocities, out_species, out_order,
+               boundaries, world_width, bins):
+    """
+    Counting sort of the boids into the strips delimited by boundaries (num_strips + 1 values,
+    the outer two are ignored so boids outside the world belong to the edge strips).
+    out_order[k] is set to the row sorted row k came from.
+    Returns the strip offsets into the sorted arrays and a histogram of x positions.
+    """
+    N = positions.shape[0]
+    num_strips = boundaries.shape[0] - 1
+    strips = np.empty(N, dtype=np.int64)
+    offsets = np.zeros(num_strips + 1, dtype=np.int64)
+    histogram = np.zeros(bins, dtype=np.int64)
+    for i in range(N):
+        x = positions[i, 0]
+        strip = 0
+        while strip < num_strips - 1 and x >= boundaries[strip + 1]:
+            strip += 1
+        strips[i] = strip
+        offsets[strip + 1] += 1
+        histogram[min(max(int(x / world_width * bins), 0), bins - 1)] += 1
+    for s in range(num_strips):
+        offsets[s + 1] += offsets[s]
+    fill = offsets[:-1].copy()
+    for i in range(N):
+        k = fill[strips[i]]
+        out_positions[k, 0] = positions[i, 0]
+        out_positions[k, 1] = positions[i, 1]
+        out_velocities[k, 0] = velocities[i, 0]
+        out_velocities[k, 1] = velocities[i, 1]
+        out_species[k] = species[i]
+        out_order[k] = i
+        fill[strips[i]] += 1
+    return offsets, histogram
+
+
+def balanced_boundaries(histogram, num_strips, world_width):
+    """Strip boundaries that split the boids in the histogram into equally sized strips."""
+    total = histogram.sum()
+    boundaries = np.linspace(0.0, world_width, num_strips + 1)
+    if total == 0:
+        return boundaries
+    cumulative = np.cumsum(histogram)
+    bin_width = world_width / histogram.shape[0]
+    for strip in range(1, num_strips):
+        boundaries[strip] = (np.searchsorted(cumulative, total * strip / num_strips) + 1) * bin_width
+    return boundaries
@@ -0,0 +1,100 @@
+'''
+Automatic quality governor.
+
+Once a second the governor looks at the frames the profiler recorded since its last
+look. If the slow end of them (QUANTILE) blew the frame budget of the target frame rate
+it steps one quality tier down, if they left plenty of headroom for a few seconds in a
+row it steps one tier back up. Every tier step that turns out too slow right away makes
+the next attempt to step up wait twice as long, so the quality doesn't flicker between
+two tiers that the machine can only just about hold.
+
+A tier caps the bloom levels, the resolution the flock is rendered at (the frame is
+drawn into a smaller offscreen buffer and scaled up), the boid splat radius and the
+number of simulation substeps per frame.
+'''
+
+from collections import namedtuple
+
+import numpy as np
+
+from .profiler import PROFILER
+
+QualityTier = namedtuple("QualityTier", ("name", "bloom_quality", "render_scale", "splat_radius", "max_substeps"))
+
+# Highest quality first
+TIERS = (
+    QualityTier("high", 2, 1.0, 8, 5),
+    QualityTier("medium", 1, 1.0, 3, 4),
+    QualityTier("low", 1, 0.75, 2, 3),
+    QualityTier("minimal", 0, 0.5, 1, 2),
+)
+INTERVAL = 1.0 # Seconds between quality decisions
+QUANTILE = 90 # Percentile of the frame times that has to fit into the budget
+DOWNSHIFT = 0.9 # Step down once the frames take this much of the budget, clock.tick needs the rest
+UPSHIFT = 0.5 # Frames taking less than this much of the budget count as headroom
+UPSHIFT_WAIT = 3 # Seconds of headroom in a row before stepping up
+MAX_UPSHIFT_WAIT = 48
+
+
+class QualityGovernor(object):
+    """
+    Picks the quality tier that holds target_fps. Control calls update once per frame,
+    the states read the settings of the current tier from tier.
+    """
+    def __init__(self, target_fps=60.0, tiers=TIERS):
+        self.target_fps = target_fps
+        self.tiers = tiers
+        self.index = 0
+        self.enabled = True
+        self.last_check = None
+        self.checked_frames = 0 # PROFILER.frames at the last check
+        self.headroom = 0 # Checks in a row that had headroom
+        self.upshift_wait = UPSHIFT_WAIT
+        self.just_stepped_up = False
+
+    @property
+    def tier(self):
+        return self.tiers[self.index]
+
+    def update(self, now):
+        """Decide on the tier once every INTERVAL. now is in seconds."""
+        if self.last_check is None:
+            self.last_check = now
+            self.checked_frames = PROFILER.frames
+        if now - self.last_check < INTERVAL or not self.enabled:
+            return
+        frames = min(PROFILER.frames - self.checked_frames, PROFILER.history)
+        self.last_check = now
+        self.checked_frames = PROFILER.frames
+        if frames <= 0:
+            return
+        timings, _, _ = PROFILER.recorded()
+        frame_time = np.percentile(timings[-frames:, -1], QUANTILE) * 1000.0
+        budget = 1000.0 / self.target_fps
+        if frame_time > DOWNSHIFT * budget:
+            if self.just_stepped_up:
+                self.upshift_wait = min(self.upshift_wait * 2, MAX_UPSHIFT_WAIT)
+            self.step(1)
+        elif frame_time < UPSHIFT * budget:
+            self.headroom += 1
+            self.just_stepped_up = False
+            if self.headroom >= self.upshift_wait:
+                self.step(-1)
+                self.just_stepped_up = True
+        else:
+            self.headroom = 0
+            self.just_stepped_up = False
+
+    def step(self, direction):
+        """Move direction tiers down (positive) or up (negative) in quality."""
+        index = min(max(self.index + direction, 0), len(self.tiers) - 1)
+        if index != self.index:
+            self.index = index
+            print(f"Quality tier: {self.tier.name}")
+        self.headroom = 0
+        if direction > 0:
+            self.just_stepped_up = False
+
+
+# Shared by Control and the states, the same way PROFILER is
+GOVERNOR = QualityGovernor()
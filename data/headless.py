@@ -0,0 +1,92 @@
+'''
+Headless simulation runner.
+
+Drives BoidFlock.update in a tight loop without ever touching the pygame display,
+so it can run on machines with no screen and measure raw simulation throughput.
+Nothing in here may call prepare.init_display, which opens a window.
+'''
+
+import os
+import time
+
+import numpy as np
+
+from .boids_logic import BoidFlock
+from .decomposition import DistributedFlock
+from .recording import TrajectoryRecorder
+from .streaming import StreamServer, parse_address
+
+
+def run_headless(num_boids, steps, backend=None, dtype=np.float64, workers=0, record=None, quantize=False,
+                 autosave=None, lod=None, lod_budget=None, obstacles=None, serve=None):
+    """
+    Simulate num_boids boids for the given number of steps and print the throughput.
+    The first update is run separately so Numba compilation doesn't count against the timed steps.
+    backend None uses "grid", or the backend saved in the autosave checkpoint when restoring one.
+    With workers > 1 the world is split across that many worker processes.
+    With record set every timed step is written to that recording. With autosave set the
+    flock is restored from that checkpoint if it exists and saved back to it at the end.
+    With lod set only a time budgeted subset of the boids gets its steering recomputed each step.
+    obstacles is the path of an image whose obstacles are added to the world.
+    With serve set ("host:port") every timed step is streamed to the viewers connected there.
+    Returns the flock so callers can inspect the final state.
+    """
+    flock_class = DistributedFlock if workers > 1 else BoidFlock
+    kwargs = {"workers": workers} if workers > 1 else {}
+    if backend is not None:
+        kwargs["backend"] = backend
+    if autosave is not None and os.path.exists(autosave):
+        start = time.perf_counter()
+        flock = flock_class.load(autosave, **kwargs)
+        print(f"Restored {flock.num_boids} boids from {autosave} in {time.perf_counter() - start:.3f} s")
+    else:
+        flock = flock_class(num_boids, dtype=dtype, **kwargs)
+    backend = flock.backend
+    if obstacles is not None:
+        flock.obstacles.load_image(obstacles)
+    if lod is not None and workers <= 1:
+        # Level of detail steering always searches the grid, worker processes don't support it
+        flock.lod_mode = lod
+        if lod_budget is not None:
+            flock.lod_budget = lod_budget
+        backend = f"{lod} LOD"
+    if workers > 1:
+        backend = f"{workers} workers"
+
+    start = time.perf_counter()
+    flock.update(0)
+    warmup = time.perf_counter() - start
+    print(f"Warm-up step (includes JIT compile): {warmup:.3f} s")
+    recorder = None
+    if record is not None:
+        recorder = TrajectoryRecorder(record, flock, quantize=quantize)
+        flock.attach(recorder)
+    server = None
+    if serve is not None:
+        server = StreamServer(*parse_address(serve))
+        flock.attach(server)
+
+    start = time.perf_counter()
+    for step in range(steps):
+        flock.update(step)
+    wall_time = time.perf_counter() - start
+    if recorder is not None:
+        recorder.close()
+        flock.detach(recorder)
+        print(f"Recorded {recorder.frames} frames to {record}")
+    if server is not None:
+        flock.detach(server)
+        server.close()
+        print(f"Streamed {server.encoded} of {server.ticks} steps")
+    if autosave is not None:
+        start = time.perf_counter()
+        flock.save(autosave)
+        print(f"Saved {flock.num_boids} boids to {autosave} in {time.perf_counter() - start:.3f} s")
+
+    steps_per_sec = steps / wall_time if wall_time > 0 else float("inf")
+    print(f"Boids: {flock.num_boids}  Steps: {steps}  Backend: {backend}  Dtype: {flock.dtype}")
+    print(f"Total wall time: {wall_time:.3f} s")
+    print(f"Steps/sec: {steps_per_sec:.2f}")
+    if lod is not None and workers <= 1:
+        print(f"LOD subset: {flock.lod_subset} boids per step")
+    return flock
@@ -5,16 +5,45 @@ This is the main function for the boids simulation.
 import os
 print(os.getcwd())
 
+# Imported first so its launch timestamp covers loading everything else
+from .warmup import WARMUP
 from . import tools, prepare
-from .states import title, splash, game
+from .profiler import PROFILER
+from .states import title, splash, game, replay, stream_viewer
+from .streaming import parse_address
 
-def main(skip_intro=False):
+def main(skip_intro=False, profile_csv=None, workers=0, record=None, quantize=False, replay_path=None,
+         autosave=None, lod=None, lod_budget=None, sim_thread=False, obstacles=None,
+         density_threshold=None, serve=None, connect=None):
     print("Hello, world!")
+    if sim_thread:
+        # Parallel kernels will be launched from two threads at once, which needs a thread
+        # safe layer. It has to be picked before the warm-up starts the thread pool.
+        import numba
+        numba.config.THREADING_LAYER = "threadsafe"
+    # Compile the Numba kernels in the background while the splash and title screens are up
+    WARMUP.start()
+    prepare.init_display()
     app = tools.Control(prepare.ORIGINAL_CAPTION)
     state_dict = {
                 "SPLASH"  : splash.Splash(),
                 "TITLE"   : title.Title(),
-                "GAME"    : game.Game(),
+                "GAME"    : game.Game(workers=workers, record=record, quantize=quantize, autosave=autosave,
+                                       lod=lod, lod_budget=lod_budget, sim_thread=sim_thread,
+                                       obstacles=obstacles, density_threshold=density_threshold, serve=serve),
                 }
-    app.state_machine.setup_states(state_dict, "SPLASH")
-    app.main()
\ No newline at end of file
+    start_state = "SPLASH"
+    if replay_path is not None:
+        state_dict["REPLAY"] = replay.Replay(replay_path)
+        start_state = "REPLAY"
+    elif connect is not None:
+        state_dict["STREAM"] = stream_viewer.StreamViewer(*parse_address(connect))
+        start_state = "STREAM"
+    app.state_machine.setup_states(state_dict, start_state)
+    app.state_machine.state.startup(0, {})
+    app.main()
+    # Give the last state a chance to close anything it has open and save the flock
+    app.state_machine.state.cleanup()
+    if profile_csv is not None:
+        PROFILER.dump_csv(profile_csv)
+        print(f"Frame timings written to {profile_csv}")
\ No newline at end of file
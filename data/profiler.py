@@ -0,0 +1,131 @@
+'''
+Lightweight per-phase frame profiler.
+
+Control and the Game state wrap each phase of a frame in PROFILER.phase(name). Timings go
+into a fixed size ring buffer together with the number of simulation substeps and the
+boid count, so recording never allocates. The overlay (F3) shows rolling percentiles and
+dump_csv writes everything that is still in the buffer for offline analysis.
+'''
+
+import time
+
+import numpy as np
+import pygame as pg
+
+PHASES = ("event_loop", "update", "flock_draw", "bloom", "ui", "display")
+HISTORY = 600 # Frames kept in the ring buffer, 10 seconds at 60 fps
+OVERLAY_REFRESH = 30 # Frames between overlay re-renders
+
+
+class _PhaseTimer(object):
+    """Context manager that adds its elapsed time to one phase of the current frame."""
+    __slots__ = ("profiler", "index", "start")
+
+    def __init__(self, profiler, index):
+        self.profiler = profiler
+        self.index = index
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler.current[self.index] += time.perf_counter() - self.start
+        return False
+
+
+class FrameProfiler(object):
+    """
+    Records how long each phase of every frame took, in a ring buffer of HISTORY frames.
+    """
+    def __init__(self, history=HISTORY):
+        self.history = history
+        self.timings = np.zeros((history, len(PHASES) + 1)) # Last column is the whole frame
+        self.substeps = np.zeros(history, dtype=np.int32)
+        self.boids = np.zeros(history, dtype=np.int64)
+        self.current = np.zeros(len(PHASES))
+        self.frames = 0 # Total frames recorded, the ring index is frames % history
+        self.frame_start = 0.0
+        self.boid_count = 0 # Set by whichever state owns a flock
+        self.overlay_visible = False
+        self._timers = {name: _PhaseTimer(self, i) for i, name in enumerate(PHASES)}
+        self._overlay = None
+
+    def phase(self, name):
+        """Time a block of code as the given phase, use with a with statement."""
+        return self._timers[name]
+
+    def begin_frame(self):
+        self.current[:] = 0.0
+        self.frame_start = time.perf_counter()
+
+    def end_frame(self, substeps):
+        row = self.frames % self.history
+        self.timings[row, :-1] = self.current
+        self.timings[row, -1] = time.perf_counter() - self.frame_start
+        self.substeps[row] = substeps
+        self.boids[row] = self.boid_count
+        self.frames += 1
+
+    def recorded(self):
+        """Return (timings, substeps, boids) for the buffered frames, oldest first."""
+        count = min(self.frames, self.history)
+        order = (np.arange(self.frames - count, self.frames)) % self.history
+        return self.timings[order], self.substeps[order], self.boids[order]
+
+    def percentiles(self, q=(50, 95, 99)):
+        """Per phase percentiles in milliseconds, shape (len(PHASES) + 1, len(q))."""
+        timings, _, _ = self.recorded()
+        if timings.shape[0] == 0:
+            return np.zeros((len(PHASES) + 1, len(q)))
+        return np.percentile(timings * 1000.0, q, axis=0).T
+
+    def dump_csv(self, path):
+        """Write every buffered frame to a CSV file, one row per frame, times in milliseconds."""
+        timings, substeps, boids = self.recorded()
+        first = self.frames - timings.shape[0]
+        header = ["frame"] + [f"{name}_ms" for name in PHASES] + ["total_ms", "substeps", "boids"]
+        with open(path, "w") as f:
+            f.write(",".join(header) + "\n")
+            for i in range(timings.shape[0]):
+                times = ",".join(f"{t * 1000.0:.4f}" for t in timings[i])
+                f.write(f"{first + i},{times},{substeps[i]},{boids[i]}\n")
+
+    def toggle_overlay(self):
+        self.overlay_visible = not self.overlay_visible
+        self._overlay = None
+
+    def draw_overlay(self, surface):
+        """Draw rolling p50/p95/p99 of every phase in the bottom left corner."""
+        if not self.overlay_visible:
+            return
+        if self._overlay is None or self.frames % OVERLAY_REFRESH == 0:
+            self._overlay = self._render_overlay()
+        surface.blit(self._overlay, (10, surface.get_height() - self._overlay.get_height() - 10))
+
+    def _render_overlay(self):
+        # prepare imports tools which imports this module, so the font is looked up lazily
+        from . import prepare
+        font = prepare.PIXEL_FONT
+        stats = self.percentiles()
+        _, substeps, boids = self.recorded()
+        lines = ["phase        p50    p95    p99 ms"]
+        for name, (p50, p95, p99) in zip(PHASES + ("total",), stats):
+            lines.append(f"{name:<10} {p50:6.2f} {p95:6.2f} {p99:6.2f}")
+        if substeps.shape[0]:
+            lines.append(f"substeps {substeps.mean():.2f}  boids {boids[-1]}")
+        renders = [font.render(line, True, (220, 220, 220)) for line in lines]
+        height = sum(render.get_height() for render in renders)
+        width = max(render.get_width() for render in renders)
+        overlay = pg.Surface((width + 12, height + 12), pg.SRCALPHA)
+        overlay.fill((20, 20, 30, 200))
+        y = 6
+        for render in renders:
+            overlay.blit(render, (6, y))
+            y += render.get_height()
+        return overlay
+
+
+# Shared by Control and the states, the same way prepare shares fonts and graphics
+PROFILER = FrameProfiler()
@@ -0,0 +1,192 @@
+'''
+Trajectory recording and playback.
+
+A recording is two files. The data file starts with a fixed size header block (magic,
+then the JSON header with the world size, rule parameters, species colors, seed and
+storage format) followed by the frames, each the positions, the velocities and the
+species id (uint8, padded to keep the next frame aligned) of every boid that tick.
+The data file is written through memory-mapped chunks that are mapped one after the
+other as the recording grows. The index file next to it (path + ".idx") holds one
+(byte offset, boid count) int64 pair per frame, so any frame can be found in O(1) and
+the boid count may change from frame to frame.
+
+Frames are stored in the flock's own precision, or as int16 when quantize is set,
+which quarters the size of a float64 recording at well below a pixel of error.
+'''
+
+import json
+
+import numpy as np
+
+from .boids_logic import WEIGHT_KEYS
+
+MAGIC = b"BOIDTRJ1"
+HEADER_SIZE = 4096 # Bytes reserved for the header, frames start right after it
+CHUNK_SIZE = 16 * 1024 * 1024 # Bytes mapped at a time while recording
+QUANTIZED_MAX = 32767 # Quantized values use the symmetric int16 range
+VERSION = 2 # Version 1 recordings have no species ids in their frames
+
+
+def frame_nbytes(n, dtype, version=VERSION):
+    """Size of a frame of n boids stored as dtype, in a recording of the given version."""
+    nbytes = 2 * n * 2 * dtype.itemsize
+    if version >= 2:
+        nbytes += -(-n // dtype.itemsize) * dtype.itemsize # Species ids, padded to a whole number of items
+    return nbytes
+
+
+class TrajectoryRecorder(object):
+    """
+    Flock observer that appends every tick to a recording. Attach it with flock.attach.
+    """
+    def __init__(self, path, flock, quantize=False, chunk_size=CHUNK_SIZE):
+        self.path = path
+        self.chunk_size = chunk_size
+        self.quantize = quantize
+        self.dtype = np.dtype(np.int16) if quantize else flock.dtype
+        # Positions are wrapped into the world, speeds are capped at the max_speed of each
+        # boid's species, so the fastest species sets the range. The velocity range leaves
+        # room in case max_speed is raised during the recording.
+        max_speed = float(flock.species_params[:, WEIGHT_KEYS.index("max_speed")].max())
+        self.position_scale = max(flock.width, flock.height) / QUANTIZED_MAX
+        self.velocity_scale = 2.0 * max(max_speed, 1.0) / QUANTIZED_MAX
+        self.header = {
+            "version": VERSION,
+            "dtype": self.dtype.str,
+            "quantized": quantize,
+            "position_scale": self.position_scale,
+            "velocity_scale": self.velocity_scale,
+            "world": [flock.width, flock.height],
+            "params": {key: float(getattr(flock, key)) for key in WEIGHT_KEYS},
+            "species_colors": np.round(flock.species_colors[:flock.num_species], 3).tolist(),
+            "seed": flock.seed,
+            "frames": 0,
+        }
+        self.num_species = flock.num_species # Species whose colors the header has been given
+        self.frames = 0
+        self.end = HEADER_SIZE # Bytes of the data file in use
+        self.chunk = None
+        self.chunk_start = HEADER_SIZE
+        self.file = open(path, "w+b")
+        # Unbuffered, so the index never lags behind the frames already in the memory map
+        self.index = open(path + ".idx", "wb", buffering=0)
+        self._write_header()
+
+    def _write_header(self):
+        self.header["frames"] = self.frames
+        text = json.dumps(self.header).encode()
+        if len(MAGIC) + 4 + len(text) > HEADER_SIZE:
+            raise ValueError("Recording header does not fit into the header block")
+        self.file.seek(0)
+        self.file.write(MAGIC + np.uint32(len(text)).tobytes() + text)
+        self.file.flush()
+
+    def _map_chunk(self, nbytes):
+        """Map the next chunk of the data file, at least nbytes large, starting at the end."""
+        if self.chunk is not None:
+            self.chunk.flush()
+        self.chunk_start = self.end
+        # np.memmap grows the file to cover the mapping
+        self.chunk = np.memmap(self.file, dtype=np.uint8, mode="r+", offset=self.chunk_start,
+                               shape=max(self.chunk_size, nbytes))
+
+    def on_update(self, flock):
+        if flock.num_species != self.num_species:
+            # Species added during the recording, the replay needs their colors too
+            self.num_species = flock.num_species
+            colors = self.header["species_colors"]
+            self.header["species_colors"] = np.round(flock.species_colors[:self.num_species], 3).tolist()
+            try:
+                self._write_header()
+            except ValueError:
+                # More species than the header block has room for, the replay reuses the first colors
+                self.header["species_colors"] = colors
+        self.write_frame(flock.positions, flock.velocities, flock.species)
+
+    def write_frame(self, positions, velocities, species=None):
+        """Append a frame. species are the boids' species ids, None records them all as species 0."""
+        n = positions.shape[0]
+        nbytes = frame_nbytes(n, self.dtype)
+        if self.chunk is None or self.end + nbytes > self.chunk_start + self.chunk.shape[0]:
+            self._map_chunk(nbytes)
+        start = self.end - self.chunk_start
+        state_bytes = 2 * n * 2 * self.dtype.itemsize
+        frame = self.chunk[start:start + state_bytes].view(self.dtype).reshape(2, n, 2)
+        if self.quantize:
+            frame[0] = np.clip(np.rint(positions / self.position_scale), -QUANTIZED_MAX, QUANTIZED_MAX)
+            frame[1] = np.clip(np.rint(velocities / self.velocity_scale), -QUANTIZED_MAX, QUANTIZED_MAX)
+        else:
+            frame[0] = positions
+            frame[1] = velocities
+        # Species ids past 255 wrap around, their boids get another species' tint
+        self.chunk[start + state_bytes:start + state_bytes + n] = 0 if species is None else species
+        self.index.write(np.array([self.end, n], dtype=np.int64).tobytes())
+        self.end += nbytes
+        self.frames += 1
+
+    def close(self):
+        """Flush everything, trim the unused end of the last chunk and finalize the header."""
+        if self.file.closed:
+            return
+        if self.chunk is not None:
+            self.chunk.flush()
+            self.chunk = None
+        self.file.truncate(self.end)
+        self._write_header()
+        self.file.close()
+        self.index.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+
+class TrajectoryReader(object):
+    """
+    Random access to the frames of a recording, straight out of a read-only memory map.
+    A recording that was never closed is still readable up to the last indexed frame.
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{path} is not a boids recording")
+            length = int(np.frombuffer(f.read(4), dtype=np.uint32)[0])
+            self.header = json.loads(f.read(length))
+        self.dtype = np.dtype(self.header["dtype"])
+        self.version = self.header["version"]
+        self.quantized = self.header["quantized"]
+        self.width, self.height = self.header["world"]
+        # (S, 3) tint of each species, recordings without species have a single untinted one
+        self.colors = np.array(self.header.get("species_colors", [(1.0, 1.0, 1.0)]), dtype=np.float64)
+        self.data = np.memmap(path, dtype=np.uint8, mode="r")
+        index = np.fromfile(path + ".idx", dtype=np.int64).reshape(-1, 2)
+        # Drop frames the index got ahead of, in case the recorder died mid write
+        sizes = frame_nbytes(index[:, 1], self.dtype, self.version)
+        self.index = index[index[:, 0] + sizes <= self.data.shape[0]]
+
+    def __len__(self):
+        return self.index.shape[0]
+
+    def frame(self, i):
+        """Return (positions, velocities) of frame i as new float arrays."""
+        offset, n = self.index[i]
+        raw = self.data[offset:offset + 2 * n * 2 * self.dtype.itemsize].view(self.dtype).reshape(2, n, 2)
+        if self.quantized:
+            return raw[0] * self.header["position_scale"], raw[1] * self.header["velocity_scale"]
+        return np.array(raw[0]), np.array(raw[1])
+
+    def species(self, i):
+        """Species id of every boid in frame i, or None if the recording has no species."""
+        if self.version < 2:
+            return None
+        offset, n = self.index[i]
+        start = offset + 2 * n * 2 * self.dtype.itemsize
+        # Ids without a color of their own (see TrajectoryRecorder.on_update) reuse one
+        return self.data[start:start + n].astype(np.int32) % self.colors.shape[0]
+
+    def close(self):
+        self.data = None
@@ -0,0 +1,499 @@
+'''
+Vectorized drawing routines for the flock.
+
+Instead of calling pg.draw once per boid, these write straight into the pixel buffer
+of a surface through pygame.surfarray, with the per-boid math done in Numba.
+'''
+
+import numba
+import numpy as np
+import pygame as pg
+from numba import njit, prange, types
+
+NO_TINT = np.ones((1, 3)) # Species colors for boids drawn without species, all species 0
+
+# How the flock is drawn: "points" splats a dot per boid, "glyphs" blits a small arrow
+# pointing along the boid's heading out of a pre-rotated sprite atlas, "density" shades
+# every screen cell by how many boids are in it, for flocks too large to draw one by one
+RENDER_MODES = ("points", "glyphs", "density")
+DENSITY_THRESHOLD = 1000000 # Flocks at least this large are drawn as a density field whatever the mode
+DENSITY_CELL = 2 # Side of a density cell in pixels
+DENSITY_SATURATION = 4.0 # Cells this many times fuller than the average occupied cell are at full brightness
+GLYPH_SIZE = 7 # Side of a glyph sprite in pixels at splat radius 1, each extra radius adds 4
+GLYPH_ANGLES = 32 # Headings are quantized to this many directions
+GLYPH_COLOR_BINS = 4 # The position color gradient is quantized to this many steps along each axis
+GLYPH_SUPERSAMPLE = 4 # Glyphs are drawn this many times larger and scaled down, for antialiasing
+# Atlases that have been built, keyed by sprite size and species colors
+GLYPH_ATLASES = {}
+
+
+def draw_points(surface, positions, world_width, world_height, radius=1, previous=None, alpha=1.0,
+                species=None, colors=None):
+    """
+    Splat every boid as a small colored dot directly into the surface's pixels.
+    positions are in world coordinates and get scaled to the surface size.
+    radius is in pixels, 1 draws a single pixel per boid.
+    If previous positions are given, boids are drawn alpha of the way from previous to positions.
+    species and colors tint each boid by colors[species[i]], an (S, 3) array of factors.
+    """
+    if previous is None:
+        previous = positions
+    if positions.shape[0] == 0:
+        return
+    if species is None:
+        species, colors = np.zeros(positions.shape[0], np.int32), NO_TINT
+    width, height = surface.get_size()
+    # pixels3d locks the surface for as long as the array is alive
+    pixels = pg.surfarray.pixels3d(surface)
+    splat_points(pixels, previous, positions, species, colors, float(alpha), width / world_width,
+                 height / world_height, float(world_width), float(world_height), int(radius))
+    del pixels
+
+
+@njit(parallel=True, nogil=True, cache=True)
+def splat_points(pixels, previous, positions, species, colors, alpha, scale_x, scale_y,
+                 world_width, world_height, radius):
+    """
+    Write one colored disk per boid into a (width, height, 3) pixel array.
+    Boids are interpolated alpha of the way from previous to positions, except
+    for boids that wrapped around the world edge, which are drawn where they are now.
+    Color is the same position based gradient the boids have always used, tinted by species.
+    Overlapping boids race on the same pixel, which only decides whose color wins.
+    """
+    N = positions.shape[0]
+    width = pixels.shape[0]
+    height = pixels.shape[1]
+    r = max(radius, 1)
+    r2 = r * r
+    for i in prange(N):
+        x = positions[i, 0]
+        y = positions[i, 1]
+        step_x = x - previous[i, 0]
+        step_y = y - previous[i, 1]
+        if abs(step_x) < world_width / 2 and abs(step_y) < world_height / 2:
+            x -= step_x * (1.0 - alpha)
+            y -= step_y * (1.0 - alpha)
+        px = int(x * scale_x)
+        py = int(y * scale_y)
+        tint = species[i]
+        red = min(max(100.0 * x / world_width + 155.0, 0.0), 255.0) * colors[tint, 0]
+        green = min(max(100.0 * y / world_height + 155.0, 0.0), 255.0) * colors[tint, 1]
+        blue = 255.0 * colors[tint, 2]
+        for dy in range(1 - r, r):
+            yy = py + dy
+            if yy < 0 or yy >= height:
+                continue
+            for dx in range(1 - r, r):
+                xx = px + dx
+                if xx < 0 or xx >= width or dx * dx + dy * dy >= r2:
+                    continue
+                pixels[xx, yy, 0] = np.uint8(red)
+                pixels[xx, yy, 1] = np.uint8(green)
+                pixels[xx, yy, 2] = np.uint8(blue)
+
+
+def draw_flock(surface, mode, positions, velocities, world_width, world_height, radius=1, previous=None,
+               alpha=1.0, species=None, colors=None, density_threshold=DENSITY_THRESHOLD, hue=True):
+    """
+    Draw the boids in one of the RENDER_MODES, the arguments are the same as for draw_points.
+    From density_threshold boids on the density mode is used no matter what mode says.
+    """
+    if mode == "density" or positions.shape[0] >= density_threshold:
+        DENSITY.draw(surface, positions, velocities, world_width, world_height, hue=hue)
+    elif mode == "glyphs":
+        draw_glyphs(surface, positions, velocities, world_width, world_height, GLYPH_SIZE + 4 * (int(radius) - 1),
+                    previous, alpha, species, colors)
+    else:
+        draw_points(surface, positions, world_width, world_height, radius, previous, alpha, species, colors)
+
+
+def draw_glyphs(surface, positions, velocities, world_width, world_height, size=GLYPH_SIZE, previous=None,
+                alpha=1.0, species=None, colors=None):
+    """
+    Draw every boid as an arrow along its velocity. The sprite of each boid is picked out of
+    the atlas by heading, species and position color bin in one Numba pass, then everything
+    goes to the screen in a single Surface.blits call.
+    """
+    if previous is None:
+        previous = positions
+    n = positions.shape[0]
+    if n == 0:
+        return
+    if species is None:
+        species, colors = np.zeros(n, np.int32), NO_TINT
+    sprites = glyph_atlas(size, colors)
+    width, height = surface.get_size()
+    indices = np.empty(n, np.int64)
+    corners = np.empty((n, 2), np.int64)
+    glyph_indices(previous, positions, velocities, species, float(alpha), width / world_width,
+                  height / world_height, float(world_width), float(world_height), size, indices, corners)
+    # Fancy indexing the object array and tolist keep the per boid Python work to a minimum
+    surface.blits(zip(sprites[indices].tolist(), corners.tolist()), doreturn=False)
+
+
+def glyph_atlas(size, colors):
+    """
+    The glyph sprites for the given size and (S, 3) species colors, built on first use, as an
+    object array of surfaces. The background is black, so the antialiased edges are blended
+    over black once here and the sprites are blitted with a black RLE colorkey, which is about
+    twice as fast as per pixel alpha.
+    Sprite ((species * GLYPH_COLOR_BINS + color_y) * GLYPH_COLOR_BINS + color_x) * GLYPH_ANGLES + angle
+    is the arrow of that species and position color bin, turned angle / GLYPH_ANGLES of a full circle.
+    """
+    key = (size, colors.shape[0], colors.tobytes())
+    sprites = GLYPH_ATLASES.get(key)
+    if sprites is not None:
+        return sprites
+    big = size * GLYPH_SUPERSAMPLE
+    # Arrow pointing along +x around the sprite center, in units of the sprite size
+    outline = np.array([(0.45, 0.0), (-0.4, -0.3), (-0.2, 0.0), (-0.4, 0.3)])
+    # Convert only once there is a display, the atlas can be built before one is set
+    convert = pg.display.get_surface() is not None
+    sprites = []
+    for tint in colors:
+        for color_y in range(GLYPH_COLOR_BINS):
+            for color_x in range(GLYPH_COLOR_BINS):
+                # Same gradient as splat_points, at the center of the bin
+                color = (min(100.0 * (color_x + 0.5) / GLYPH_COLOR_BINS + 155.0, 255.0) * tint[0],
+                         min(100.0 * (color_y + 0.5) / GLYPH_COLOR_BINS + 155.0, 255.0) * tint[1],
+                         255.0 * tint[2])
+                for angle in range(GLYPH_ANGLES):
+                    theta = 2.0 * np.pi * angle / GLYPH_ANGLES
+                    cos, sin = np.cos(theta), np.sin(theta)
+                    # Screen y points down, the same way as world y
+                    points = [(big / 2 + big * (x * cos - y * sin), big / 2 + big * (x * sin + y * cos))
+                              for x, y in outline]
+                    sprite = pg.Surface((big, big), pg.SRCALPHA)
+                    pg.draw.polygon(sprite, color, points)
+                    opaque = pg.Surface((size, size))
+                    opaque.blit(pg.transform.smoothscale(sprite, (size, size)), (0, 0))
+                    if convert:
+                        opaque = opaque.convert()
+                    opaque.set_colorkey((0, 0, 0), pg.RLEACCEL)
+                    sprites.append(opaque)
+    atlas = np.empty(len(sprites), object)
+    atlas[:] = sprites
+    GLYPH_ATLASES[key] = atlas
+    return atlas
+
+
+@njit(parallel=True, nogil=True, cache=True)
+def glyph_indices(previous, positions, velocities, species, alpha, scale_x, scale_y,
+                  world_width, world_height, size, indices, corners):
+    """
+    Atlas index and top left screen corner of every boid's glyph, see glyph_atlas for the
+    index layout. Interpolates between previous and positions the same way splat_points does.
+    """
+    bins = GLYPH_COLOR_BINS
+    for i in prange(positions.shape[0]):
+        x = positions[i, 0]
+        y = positions[i, 1]
+        step_x = x - previous[i, 0]
+        step_y = y - previous[i, 1]
+        if abs(step_x) < world_width / 2 and abs(step_y) < world_height / 2:
+            x -= step_x * (1.0 - alpha)
+            y -= step_y * (1.0 - alpha)
+        angle = np.arctan2(velocities[i, 1], velocities[i, 0])
+        turn = int(np.floor(angle / (2.0 * np.pi) * GLYPH_ANGLES + 0.5)) % GLYPH_ANGLES
+        color_x = min(max(int(x / world_width * bins), 0), bins - 1)
+        color_y = min(max(int(y / world_height * bins), 0), bins - 1)
+        indices[i] = ((species[i] * bins + color_y) * bins + color_x) * GLYPH_ANGLES + turn
+        corners[i, 0] = int(x * scale_x) - size // 2
+        corners[i, 1] = int(y * scale_y) - size // 2
+
+
+class DensityField(object):
+    """
+    Draws the flock as a histogram of boids per DENSITY_CELL sized screen cell, so the cost
+    is proportional to the screen size instead of the flock size. Each thread scatters its
+    share of the boids into a histogram of its own, so there are no write races, and the
+    histograms are summed and tone mapped straight into the surface's pixels.
+    With hue the color is the mean heading of the cell, otherwise the usual position gradient.
+    Buffers are kept between frames and only reallocated when the surface size changes.
+    """
+    def __init__(self, cell=DENSITY_CELL):
+        self.cell = cell
+        self.counts = None
+        self.velocity_sums = None
+
+    def draw(self, surface, positions, velocities, world_width, world_height, hue=True):
+        width, height = surface.get_size()
+        grid_w = -(-width // self.cell)
+        grid_h = -(-height // self.cell)
+        chunks = numba.get_num_threads()
+        if self.counts is None or self.counts.shape != (chunks, grid_h, grid_w):
+            self.counts = np.zeros((chunks, grid_h, grid_w), np.float32)
+            self.velocity_sums = np.zeros((chunks, grid_h, grid_w, 2), np.float32)
+        occupied = density_scatter(positions, velocities, grid_w / world_width, grid_h / world_height,
+                                   self.counts, self.velocity_sums)
+        if occupied == 0:
+            return
+        saturation = max(DENSITY_SATURATION * positions.shape[0] / occupied, 1.0)
+        pixels = pg.surfarray.pixels3d(surface)
+        density_shade(pixels, self.counts[0], self.velocity_sums[0], self.cell, float(saturation), hue)
+        del pixels
+
+
+@njit(parallel=True, nogil=True, cache=True)
+def density_scatter(positions, velocities, scale_x, scale_y, counts, velocity_sums):
+    """
+    Histogram the boids into counts[0] and their velocities into velocity_sums[0], both
+    indexed [cell_y, cell_x]. The other chunks are per thread scratch. Returns how many
+    cells have at least one boid in them.
+    """
+    chunks = counts.shape[0]
+    grid_h = counts.shape[1]
+    grid_w = counts.shape[2]
+    N = positions.shape[0]
+    share = (N + chunks - 1) // chunks
+    for chunk in prange(chunks):
+        counts[chunk] = 0.0
+        velocity_sums[chunk] = 0.0
+        for i in range(chunk * share, min((chunk + 1) * share, N)):
+            x = int(positions[i, 0] * scale_x)
+            y = int(positions[i, 1] * scale_y)
+            if x < 0 or x >= grid_w or y < 0 or y >= grid_h:
+                continue
+            counts[chunk, y, x] += 1.0
+            velocity_sums[chunk, y, x, 0] += velocities[i, 0]
+            velocity_sums[chunk, y, x, 1] += velocities[i, 1]
+    occupied = 0
+    for y in prange(grid_h):
+        for x in range(grid_w):
+            for chunk in range(1, chunks):
+                counts[0, y, x] += counts[chunk, y, x]
+                velocity_sums[0, y, x, 0] += velocity_sums[chunk, y, x, 0]
+                velocity_sums[0, y, x, 1] += velocity_sums[chunk, y, x, 1]
+            if counts[0, y, x] > 0:
+                occupied += 1
+    return occupied
+
+
+@njit(parallel=True, nogil=True, cache=True)
+def density_shade(pixels, counts, velocity_sums, cell, saturation, hue):
+    """
+    Tone map the histogram into a (width, height, 3) pixel array, log scaled so that
+    saturation boids in a cell are full brightness. Each color is worked out once per
+    cell and then filled into its pixels, empty cells are left untouched.
+    """
+    width = pixels.shape[0]
+    height = pixels.shape[1]
+    grid_h = counts.shape[0]
+    grid_w = counts.shape[1]
+    scale = 1.0 / np.log1p(saturation)
+    for cell_y in prange(grid_h):
+        for cell_x in range(grid_w):
+            count = counts[cell_y, cell_x]
+            if count == 0:
+                continue
+            value = min(np.log1p(count) * scale, 1.0)
+            if hue:
+                # Mean heading picks the hue, on a fully saturated color wheel
+                angle = np.arctan2(velocity_sums[cell_y, cell_x, 1], velocity_sums[cell_y, cell_x, 0])
+                h = (angle / (2.0 * np.pi) + 0.5) * 6.0
+                red = min(max(abs(h - 3.0) - 1.0, 0.0), 1.0)
+                green = min(max(2.0 - abs(h - 2.0), 0.0), 1.0)
+                blue = min(max(2.0 - abs(h - 4.0), 0.0), 1.0)
+            else:
+                red = (100.0 * cell_x / grid_w + 155.0) / 255.0
+                green = (100.0 * cell_y / grid_h + 155.0) / 255.0
+                blue = 1.0
+            r = np.uint8(255.0 * value * red)
+            g = np.uint8(255.0 * value * green)
+            b = np.uint8(255.0 * value * blue)
+            for y in range(cell_y * cell, min((cell_y + 1) * cell, height)):
+                for x in range(cell_x * cell, min((cell_x + 1) * cell, width)):
+                    pixels[x, y, 0] = r
+                    pixels[x, y, 1] = g
+                    pixels[x, y, 2] = b
+
+
+# Shared by everything that draws flocks, its buffers follow the size of the last surface
+DENSITY = DensityField()
+
+
+class Bloom(object):
+    """
+    Screenwide bloom that reuses its buffers between frames.
+    The frame is shrunk to quarter resolution (and box-downsampled again to eighth),
+    each level is blurred with a separable Gaussian in Numba, the levels are folded
+    back into the quarter res buffer and that is scaled up and added onto the frame.
+    Buffers are only reallocated after invalidate() or when the surface size changes.
+    """
+    DIVISORS = (4, 8) # One blur level per divisor, quality picks how many are used
+    KERNEL = np.array([1.0, 4.0, 6.0, 4.0, 1.0], dtype=np.float32) / 16.0
+
+    def __init__(self):
+        self.size = None
+        self.levels = []
+        self.small = None
+        self.glow = None
+
+    def invalidate(self):
+        """Drop the cached buffers, they get rebuilt on the next apply."""
+        self.size = None
+        self.levels = []
+        self.small = None
+        self.glow = None
+
+    def _allocate(self, surface):
+        width, height = self.size = surface.get_size()
+        self.levels = []
+        for divisor in self.DIVISORS:
+            shape = (max(width // divisor, 1), max(height // divisor, 1), 3)
+            # (divisor, blurred buffer, scratch buffer for the separable blur)
+            self.levels.append((divisor, np.zeros(shape, np.float32), np.zeros(shape, np.float32)))
+        # Surfaces for the first level and the full size glow, in the frame's pixel format
+        self.small = pg.Surface(self.levels[0][1].shape[:2], 0, surface)
+        self.glow = pg.Surface(self.size, 0, surface)
+
+    def apply(self, surface, intensity=0.5, quality=2):
+        """Add the bloom of surface back onto itself. quality is the number of blur levels."""
+        quality = min(int(quality), len(self.DIVISORS))
+        if quality <= 0 or intensity <= 0:
+            return
+        if surface.get_size() != self.size:
+            self._allocate(surface)
+        levels = self.levels[:quality]
+        # Resampling the full frame is left to pygame's SIMD smoothscale
+        pg.transform.smoothscale(surface, self.small.get_size(), self.small)
+        small_pixels = pg.surfarray.pixels3d(self.small)
+        # Each level is downsampled from the previous one
+        source, source_divisor = small_pixels, levels[0][0]
+        for divisor, buffer, scratch in levels:
+            downsample_box(source, buffer, divisor // source_divisor)
+            source, source_divisor = buffer, divisor
+        for divisor, buffer, scratch in levels:
+            blur_separable(buffer, scratch, self.KERNEL)
+        # Fold the coarser levels into the finest one so the glow is scaled up only once
+        for (divisor, buffer, scratch), (coarse_divisor, coarse, _) in reversed(list(zip(levels, levels[1:]))):
+            upsample_accumulate(buffer, coarse, coarse_divisor // divisor)
+        store_scaled(small_pixels, levels[0][1], float(intensity))
+        del small_pixels
+        pg.transform.smoothscale(self.small, self.size, self.glow)
+        surface.blit(self.glow, (0, 0), special_flags=pg.BLEND_RGB_ADD)
+
+
+@njit(parallel=True, nogil=True, cache=True)
+def downsample_box(pixels, out, divisor):
+    """Average divisor x divisor blocks of a (width, height, 3) array into out."""
+    out_w = out.shape[0]
+    out_h = out.shape[1]
+    width = pixels.shape[0]
+    height = pixels.shape[1]
+    for by in prange(out_h):
+        y0 = by * divisor
+        y1 = min(y0 + divisor, height)
+        for bx in range(out_w):
+            x0 = bx * divisor
+            x1 = min(x0 + divisor, width)
+            r = 0.0
+            g = 0.0
+            b = 0.0
+            for y in range(y0, y1):
+                for x in range(x0, x1):
+                    r += pixels[x, y, 0]
+                    g += pixels[x, y, 1]
+                    b += pixels[x, y, 2]
+            count = max((x1 - x0) * (y1 - y0), 1)
+            out[bx, by, 0] = r / count
+            out[bx, by, 1] = g / count
+            out[bx, by, 2] = b / count
+
+
+@njit(parallel=True, nogil=True, cache=True)
+def blur_separable(buffer, scratch, kernel):
+    """
+    Blur buffer in place with the 1D kernel applied along x and then along y.
+    scratch must have the same shape as buffer. Edges are clamped.
+    """
+    width = buffer.shape[0]
+    height = buffer.shape[1]
+    radius = kernel.shape[0] // 2
+    # Along x, whole (height, 3) planes are accumulated so the inner loops stay contiguous
+    for x in prange(width):
+        for y in range(height):
+            for c in range(3):
+                scratch[x, y, c] = 0.0
+        for k in range(kernel.shape[0]):
+            xx = min(max(x + k - radius, 0), width - 1)
+            weight = kernel[k]
+            for y in range(height):
+                for c in range(3):
+                    scratch[x, y, c] += weight * buffer[xx, y, c]
+    for x in prange(width):
+        for y in range(height):
+            for c in range(3):
+                total = 0.0
+                for k in range(kernel.shape[0]):
+                    yy = min(max(y + k - radius, 0), height - 1)
+                    total += kernel[k] * scratch[x, yy, c]
+                buffer[x, y, c] = total
+
+
+@njit(parallel=True, nogil=True, cache=True)
+def upsample_accumulate(target, buffer, factor):
+    """Bilinearly upsample buffer by factor and add it into the float array target."""
+    width = target.shape[0]
+    height = target.shape[1]
+    buf_w = buffer.shape[0]
+    buf_h = buffer.shape[1]
+    for y in prange(height):
+        fy = min(max((y + 0.5) / factor - 0.5, 0.0), buf_h - 1.0)
+        y0 = int(fy)
+        y1 = min(y0 + 1, buf_h - 1)
+        ty = fy - y0
+        for x in range(width):
+            fx = min(max((x + 0.5) / factor - 0.5, 0.0), buf_w - 1.0)
+            x0 = int(fx)
+            x1 = min(x0 + 1, buf_w - 1)
+            tx = fx - x0
+            for c in range(3):
+                top = buffer[x0, y0, c] + (buffer[x1, y0, c] - buffer[x0, y0, c]) * tx
+                bottom = buffer[x0, y1, c] + (buffer[x1, y1, c] - buffer[x0, y1, c]) * tx
+                target[x, y, c] += top + (bottom - top) * ty
+
+
+@njit(parallel=True, nogil=True, cache=True)
+def store_scaled(pixels, buffer, scale):
+    """Write buffer * scale into a (width, height, 3) uint8 pixel array, saturating at 255."""
+    for y in prange(pixels.shape[1]):
+        for x in range(pixels.shape[0]):
+            for c in range(3):
+                pixels[x, y, c] = np.uint8(min(max(buffer[x, y, c] * scale, 0.0), 255.0))
+
+
+def kernel_signatures(position_dtypes=(np.float64, np.float32)):
+    """
+    Explicit Numba signatures of the render kernels, as (kernel, argument types) pairs.
+    Surface pixel arrays from surfarray are strided views, hence the "A" layout.
+    """
+    pixels = types.Array(types.uint8, 3, "A")
+    buffer = types.Array(types.float32, 3, "C")
+    signatures = [
+        (downsample_box, (pixels, buffer, types.int64)),
+        (downsample_box, (buffer, buffer, types.int64)),
+        (blur_separable, (buffer, buffer, types.Array(types.float32, 1, "C"))),
+        (upsample_accumulate, (buffer, buffer, types.int64)),
+        (store_scaled, (pixels, buffer, types.float64)),
+        (density_shade, (pixels, types.Array(types.float32, 2, "C"), types.Array(types.float32, 3, "C"),
+                         types.int64, types.float64, types.boolean)),
+    ]
+    for dtype in position_dtypes:
+        real = types.float64 if np.dtype(dtype) == np.float64 else types.float32
+        positions = types.Array(real, 2, "C")
+        signatures.append((splat_points, (pixels, positions, positions, types.Array(types.int32, 1, "C"),
+                                          types.Array(types.float64, 2, "C")) + (types.float64,) * 5 + (types.int64,)))
+        signatures.append((density_scatter, (positions, positions, types.float64, types.float64,
+                                             types.Array(types.float32, 3, "C"),
+                                             types.Array(types.float32, 4, "C"))))
+        signatures.append((glyph_indices, (positions, positions, positions, types.Array(types.int32, 1, "C"))
+                           + (types.float64,) * 5 + (types.int64, types.Array(types.int64, 1, "C"),
+                                                      types.Array(types.int64, 2, "C"))))
+    return signatures
+
+
+def compile_kernels(position_dtypes=(np.float64, np.float32)):
+    """Compile (or load from Numba's on-disk cache) every render kernel ahead of time."""
+    for kernel, signature in kernel_signatures(position_dtypes):
+        kernel.compile(signature)
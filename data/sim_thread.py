@@ -0,0 +1,169 @@
+'''
+Simulation on a background thread.
+
+SimulationThread runs flock.update on its own thread at a fixed tick rate, so a slow
+draw or bloom pass no longer slows down the simulation and the other way round. The
+simulation kernels are compiled nogil and the render kernels too, so both threads
+really do run at the same time.
+
+Finished ticks are handed to the drawing side through a triple buffer. The sim thread
+copies the positions into its back slot and swaps it with the middle slot, the drawing
+side swaps the middle slot with its front slot whenever a newer tick is there. The only
+lock guards that swap of two slot indices, neither side ever waits on the other's work.
+
+Everything that changes the flock (spawns, slider edits, new species) goes through
+submit, which queues a callable that the sim thread runs between two ticks.
+'''
+
+import queue
+import threading
+import time
+import traceback
+
+import numpy as np
+
+from . import render
+from .tools import TIME_PER_UPDATE
+
+
+class _Frame(object):
+    """One slot of the triple buffer, a copy of the flock as of one tick."""
+    __slots__ = ("positions", "previous", "velocities", "species", "species_table", "num_boids", "time", "tick")
+
+    def __init__(self):
+        self.positions = self.previous = self.velocities = self.species = None
+        self.species_table = None # SpeciesSnapshot as of the tick, for the UI
+        self.num_boids = 0
+        self.time = 0.0
+        self.tick = -1
+
+    def store(self, flock, now, tick):
+        n = flock.num_boids
+        if self.positions is None or self.positions.shape[0] < n or self.positions.dtype != flock.dtype:
+            capacity = max(n, 1) * 2
+            self.positions = np.empty((capacity, 2), flock.dtype)
+            self.previous = np.empty((capacity, 2), flock.dtype)
+            self.velocities = np.empty((capacity, 2), flock.dtype)
+            self.species = np.empty(capacity, np.int32)
+        self.positions[:n] = flock.positions
+        self.previous[:n] = flock.prev_positions
+        self.velocities[:n] = flock.velocities
+        self.species[:n] = flock.species
+        self.species_table = flock.species_snapshot()
+        self.num_boids = n
+        self.time = now
+        self.tick = tick
+
+
+class SimulationThread(object):
+    """
+    Runs the flock's updates every interval milliseconds on a daemon thread.
+    The flock must only be touched through submit while the thread is running.
+    """
+    def __init__(self, flock, interval=TIME_PER_UPDATE):
+        self.flock = flock
+        self.interval = interval / 1000.0
+        self.commands = queue.SimpleQueue()
+        self.frames = [_Frame() for _ in range(3)]
+        self._back, self._middle, self._front = 0, 1, 2
+        self._fresh = False
+        self._swap = threading.Lock()
+        self._stop = threading.Event()
+        self.thread = None
+        self.ticks = 0
+        self.update_cost = 0.0 # Smoothed time one update takes, in milliseconds
+        self.error = None
+        # Publish the starting state so there is something to draw before the first tick
+        self._publish(time.perf_counter())
+
+    def start(self):
+        if self.thread is not None:
+            return
+        self._stop.clear()
+        self.thread = threading.Thread(target=self._run, name="boids-simulation", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Stop after the current tick. Commands still queued are run before this returns."""
+        if self.thread is None:
+            return
+        self._stop.set()
+        self.thread.join()
+        self.thread = None
+        self._drain()
+
+    def submit(self, command):
+        """Run command(flock) on the sim thread before its next tick."""
+        if self.thread is None:
+            command(self.flock)
+        else:
+            self.commands.put(command)
+
+    def check(self):
+        """Raise the error that stopped the sim thread, if any."""
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def _drain(self):
+        while True:
+            try:
+                command = self.commands.get_nowait()
+            except queue.Empty:
+                return
+            command(self.flock)
+
+    def _run(self):
+        next_tick = time.perf_counter()
+        try:
+            while not self._stop.is_set():
+                self._drain()
+                start = time.perf_counter()
+                self.flock.update(start * 1000.0)
+                now = time.perf_counter()
+                self.update_cost = 0.9 * self.update_cost + 0.1 * (now - start) * 1000.0
+                self.ticks += 1
+                self._publish(now)
+                # A tick that ran long is not caught up on, the simulation just falls behind
+                next_tick = max(next_tick + self.interval, now)
+                self._stop.wait(next_tick - now)
+        except Exception as error:
+            traceback.print_exc()
+            self.error = error
+
+    def _publish(self, now):
+        self.frames[self._back].store(self.flock, now, self.ticks)
+        with self._swap:
+            self._back, self._middle = self._middle, self._back
+            self._fresh = True
+
+    def latest(self):
+        """The newest finished tick. Only the drawing side may call this."""
+        with self._swap:
+            if self._fresh:
+                self._front, self._middle = self._middle, self._front
+                self._fresh = False
+        return self.frames[self._front]
+
+    def species(self):
+        """The species tables as of the newest tick. Only the drawing side may call this."""
+        return self.latest().species_table
+
+    def draw(self, surface, radius=None, render_scale=1.0):
+        """
+        Draw the newest tick like BoidFlock.draw does, interpolated by how far we are into
+        the tick after it, and keep the flock's window to world scale up to date.
+        """
+        flock = self.flock
+        frame = self.latest()
+        flock.scale_x = surface.get_width() / render_scale / flock.width
+        flock.scale_y = surface.get_height() / render_scale / flock.height
+        if not flock.visible or frame.num_boids == 0:
+            return
+        alpha = min(max((time.perf_counter() - frame.time) / self.interval, 0.0), 1.0)
+        n = frame.num_boids
+        radius = flock.splat_radius if radius is None else radius
+        render.draw_flock(surface, flock.render_mode, frame.positions[:n], frame.velocities[:n],
+                          flock.width, flock.height, radius, previous=frame.previous[:n], alpha=alpha,
+                          species=frame.species[:n], colors=frame.species_table.colors,
+                          density_threshold=flock.density_threshold, hue=flock.density_hue)
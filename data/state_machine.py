@@ -38,7 +38,15 @@ class StateMachine(object):
         self.state.update(keys, now, mouse)
 
     def draw(self, surface, interpolate):
-        self.state.draw(surface, interpolate)
+        """
+        Draw the current State. Returns the dirty rects it reports, or None when the
+        whole surface has to be shown.
+        """
+        return self.state.draw(surface, interpolate)
+
+    def repaint(self):
+        """Make the current State draw everything again, e.g. after the window changed."""
+        self.state.repaint = True
 
     def flip_state(self):
         """
@@ -50,6 +58,7 @@ class StateMachine(object):
         self.state = self.state_dict[self.state_name]
         self.state.startup(self.now, persist)
         self.state.previous = previous
+        self.state.repaint = True
 
     def get_event(self, event):
         """
@@ -74,6 +83,7 @@ class _State(object):
         self.previous = None
         self.persist = {}
         self.mouse = (0, 0)
+        self.repaint = True # Set when a State only drawing its dirty rects has to draw everything
 
     def get_event(self, event):
         """
@@ -100,4 +110,11 @@ class _State(object):
 
     def update(self, keys, now, mouse):
         """Update function for state.  Must be overloaded in children."""
-        pass
\ No newline at end of file
+        pass
+
+    def draw(self, surface, interpolate):
+        """
+        Draw function for state.  Return a list of the rects that changed, or None
+        (like this one does) if the whole surface has to be shown.
+        """
+        return None
\ No newline at end of file
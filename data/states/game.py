@@ -1,8 +1,20 @@
+import os
+import time
+
 import pygame as pg 
 
-from .. import prepare, state_machine
+from .. import prepare, render, state_machine, ui
+from ..governor import GOVERNOR
+from ..profiler import PROFILER
+from ..warmup import WARMUP
+
+from ..boids_logic import BoidFlock, WEIGHT_KEYS
+from ..decomposition import DistributedFlock
+from ..recording import TrajectoryRecorder
+from ..sim_thread import SimulationThread
+from ..streaming import StreamServer, parse_address
 
-from ..boids_logic import BoidFlock
+PAINT_RADIUS = 20.0 # Radius of the obstacle brush, in world units
 
 class Game(state_machine._State):
     """
@@ -10,35 +22,147 @@ class Game(state_machine._State):
     """
 
     BACKGROUND_COLOR = (0, 0, 0, 180)  # RGBA for semi-transparent background
-    def __init__(self):
+    def __init__(self, workers=0, record=None, quantize=False, autosave=None, lod=None, lod_budget=None,
+                 sim_thread=False, obstacles=None, density_threshold=None, serve=None):
         state_machine._State.__init__(self)
+        self.workers = workers # Worker processes for the simulation, 0 or 1 runs it in process
+        self.record = record # Path to record every game to, None to not record
+        self.quantize = quantize
+        self.recorder = None
+        self.recordings = 0 # Games recorded so far, each gets its own file
+        self.autosave = autosave # Checkpoint the flock is restored from and saved to, None to not save
+        self.lod = lod # Level of detail mode of the flock, None updates every boid every tick
+        self.lod_budget = lod_budget
+        self.sim_thread = sim_thread # Run the simulation on a background thread instead of in update
+        self.sim = None
+        self.obstacles = obstacles # Obstacle image to load on startup, a name in GFX["objects"] or a path
+        self.obstacle_image = -1 # Which of GFX["objects"] O loaded last
+        self.density_threshold = density_threshold # Overrides the flock's, None keeps it
+        self.serve = serve # "host:port" to stream the flock to, None to not stream
+        self.server = None
         self.next = "TITLE"
         self.done = False
         self.quit = False
         self.start_time = None
+        self.bloom = render.Bloom()
+        self.offscreen = None # Lower resolution frame for quality tiers with a render_scale below 1
 
     def startup(self, now, persistent):
         """Initialize the game state."""
         self.persist = persistent
         self.start_time = now
-        self.flock = BoidFlock(num_boids=3)
+        self.startup_clock = time.perf_counter()
+        # Normally the kernels finished compiling while the splash and title were up
+        waited = WARMUP.wait()
+        if waited > 0.001:
+            print(f"Waited {waited * 1000.0:.1f} ms for the JIT warm-up to finish")
+        self.first_frame_pending = True
+        self.flock = self.restore_flock()
+        if self.lod is not None and self.workers <= 1:
+            # Worker processes update every boid, a DistributedFlock has no level of detail
+            self.flock.lod_mode = self.lod
+            if self.lod_budget is not None:
+                self.flock.lod_budget = self.lod_budget
+        if self.density_threshold is not None:
+            self.flock.density_threshold = self.density_threshold
+        if self.obstacles is not None:
+            self.flock.obstacles.load_image(prepare.GFX["objects"].get(self.obstacles, self.obstacles))
+            self.obstacles = None # Only once, the obstacles carry over with the flock
+        if self.record is not None:
+            self.recordings += 1
+            self.recorder = TrajectoryRecorder(self.recording_path(), self.flock, quantize=self.quantize)
+            self.flock.attach(self.recorder)
+        if self.serve is not None:
+            self.server = StreamServer(*parse_address(self.serve))
+            self.flock.attach(self.server)
+        if self.sim_thread:
+            self.sim = SimulationThread(self.flock)
+            self.sim.start()
         print("Game started at:", self.start_time)
         self.elements = self.make_elements()
         self.now = now
         self.menu_visible = False
 
+    def restore_flock(self):
+        """
+        The flock carries over from the last game through persist, otherwise it is loaded
+        from the autosave checkpoint if there is one. Only a new flock starts from scratch.
+        """
+        flock = self.persist.pop("flock", None)
+        if flock is not None:
+            return flock
+        flock_class = DistributedFlock if self.workers > 1 else BoidFlock
+        kwargs = {"workers": self.workers} if self.workers > 1 else {}
+        if self.autosave is not None and os.path.exists(self.autosave):
+            start = time.perf_counter()
+            flock = flock_class.load(self.autosave, **kwargs)
+            print(f"Restored {flock.num_boids} boids from {self.autosave} in "
+                  f"{(time.perf_counter() - start) * 1000.0:.1f} ms")
+            return flock
+        flock = flock_class(num_boids=3, **kwargs)
+        flock.visible = prepare.BOIDS_VISIBLE
+        return flock
+
+    def recording_path(self):
+        """
+        The file the current game is recorded to. The first game uses the given path,
+        later ones get a number before the extension so they don't overwrite it.
+        """
+        if self.recordings <= 1:
+            return self.record
+        root, ext = os.path.splitext(self.record)
+        return f"{root}-{self.recordings}{ext}"
+
+    def cleanup(self):
+        if self.sim is not None:
+            self.sim.stop()
+            self.sim = None
+        if self.recorder is not None:
+            self.recorder.close()
+            print(f"Recorded {self.recorder.frames} frames to {self.recorder.path}")
+            self.flock.detach(self.recorder)
+            self.recorder = None
+        if self.server is not None:
+            self.flock.detach(self.server)
+            self.server.close()
+            self.server = None
+        if self.autosave is not None:
+            start = time.perf_counter()
+            self.flock.save(self.autosave)
+            print(f"Saved {self.flock.num_boids} boids to {self.autosave} in "
+                  f"{(time.perf_counter() - start) * 1000.0:.1f} ms")
+        self.persist["flock"] = self.flock
+        return state_machine._State.cleanup(self)
+
     def make_elements(self):
         group = pg.sprite.LayeredUpdates()
         group.add(BoidCounter(self.flock), layer=1)
-        group.add(BoidParameterMenu(self.flock), layer=2)
+        group.add(BoidParameterMenu(self.flock, submit=self.submit, species=self.species), layer=2)
         return group
+
+    def submit(self, command):
+        """
+        Run command(flock) now, or queue it onto the sim thread before its next tick.
+        Everything that changes the flock goes through here.
+        """
+        if self.sim is not None:
+            self.sim.submit(command)
+        else:
+            command(self.flock)
     
     def update(self, keys, now, mouse):
         self.now = now
         self.mouse = mouse
-        self.flock.update(now)
+        # "focus" level of detail keeps the boids around the mouse the most up to date
+        focus = (mouse[0] / self.flock.scale_x, mouse[1] / self.flock.scale_y)
+        self.submit(lambda flock: setattr(flock, "lod_focus", focus))
+        if self.sim is not None:
+            self.sim.check()
+        else:
+            self.flock.update(now)
         if keys[pg.K_SPACE]:
-                self.flock.add_boid(self.mouse)
+                self.submit(lambda flock: flock.add_boid(mouse))
+        PROFILER.boid_count = self.flock.num_boids
 
     def get_event(self, event):
         """Handle events for the game state."""
@@ -47,29 +171,108 @@ class Game(state_machine._State):
         elif event.type == pg.KEYDOWN and event.key == pg.K_TAB:
             self.menu_visible = not self.menu_visible
         elif event.type == pg.KEYDOWN and event.key == pg.K_SPACE:
-            self.flock.add_boid(self.mouse)
+            position = self.mouse
+            self.submit(lambda flock: flock.add_boid(position))
+        elif event.type == pg.KEYDOWN and event.key == pg.K_n:
+            # New species, spawned boids and the menu switch over to it
+            self.submit(lambda flock: setattr(flock, "selected_species", flock.add_species()))
+        elif event.type == pg.KEYDOWN and pg.K_1 <= event.key <= pg.K_9:
+            species = event.key - pg.K_1
+            if species < self.species().num_species:
+                self.submit(lambda flock: setattr(flock, "selected_species", species))
+        elif event.type == pg.KEYDOWN and event.key == pg.K_g:
+            modes = render.RENDER_MODES
+            mode = modes[(modes.index(self.flock.render_mode) + 1) % len(modes)]
+            self.submit(lambda flock: setattr(flock, "render_mode", mode))
+        elif event.type == pg.KEYDOWN and event.key == pg.K_c:
+            self.submit(lambda flock: flock.obstacles.clear())
+        elif event.type == pg.KEYDOWN and event.key == pg.K_o:
+            self.next_obstacle_image()
+        elif event.type == pg.MOUSEBUTTONDOWN and event.button in (2, 3):
+            self.paint_obstacle(event.pos, solid=event.button == 3)
+        elif event.type == pg.MOUSEMOTION and (event.buttons[1] or event.buttons[2]):
+            self.paint_obstacle(event.pos, solid=bool(event.buttons[2]))
+        elif event.type == pg.VIDEORESIZE:
+            self.bloom.invalidate()
         else:
             for element in self.elements:
                 if hasattr(element, 'handle_event'):
                     element.handle_event(event)
     
-    def _apply_bloom(self, surface, intensity=0.5):
+    def paint_obstacle(self, pos, solid=True):
+        """Right mouse paints obstacles at a window position, middle mouse erases them."""
+        x = pos[0] / self.flock.scale_x
+        y = pos[1] / self.flock.scale_y
+        self.submit(lambda flock: flock.obstacles.paint(x, y, PAINT_RADIUS, solid))
+
+    def next_obstacle_image(self):
+        """Replace the obstacles with the next image in resources/graphics/objects."""
+        images = sorted(prepare.GFX["objects"].items())
+        if not images:
+            return
+        self.obstacle_image = (self.obstacle_image + 1) % len(images)
+        name, image = images[self.obstacle_image]
+        print(f"Obstacles: {name}")
+        def load(flock):
+            flock.obstacles.clear()
+            flock.obstacles.load_image(image)
+        self.submit(load)
+
+    def _apply_bloom(self, surface):
         """Apply a screenwide bloom by downsampling, blurring, and blending back."""
-        w, h = surface.get_size()
-        # Two-pass bloom at different scales for a softer glow
-        for divisor in (8, 4):
-            small = pg.transform.smoothscale(surface, (w // divisor, h // divisor))
-            glow = pg.transform.smoothscale(small, (w, h))
+        quality = min(self.flock.bloom_quality, GOVERNOR.tier.bloom_quality)
+        self.bloom.apply(surface, self.flock.bloom_intensity, quality)
 
-            glow.set_alpha(int(255 * intensity))
-            surface.blit(glow, (0, 0), special_flags=pg.BLEND_RGB_ADD)
+    def render_target(self, surface):
+        """
+        The surface the flock and bloom are drawn into. Below full render_scale that is
+        an offscreen buffer, which draw scales up onto the screen afterwards.
+        """
+        scale = GOVERNOR.tier.render_scale
+        if scale >= 1.0:
+            return surface
+        size = (max(int(surface.get_width() * scale), 1), max(int(surface.get_height() * scale), 1))
+        if self.offscreen is None or self.offscreen.get_size() != size:
+            self.offscreen = pg.Surface(size, 0, surface)
+        return self.offscreen
 
     def draw(self, surface, interpolate):
-        """Draw the game state."""
-        surface.fill(prepare.BACKGROUND_COLOR)
-        self.flock.draw(surface)
+        """Draw the game state, at the resolution and detail of the current quality tier."""
+        tier = GOVERNOR.tier
+        target = self.render_target(surface)
+        target.fill(prepare.BACKGROUND_COLOR)
+        with PROFILER.phase("flock_draw"):
+            self.flock.obstacles.draw(target)
+            radius = max(min(round(self.flock.splat_radius * tier.render_scale), tier.splat_radius), 1)
+            if self.sim is not None:
+                # The sim thread's ticks don't line up with ours, it interpolates by itself
+                self.sim.draw(target, radius=radius, render_scale=tier.render_scale)
+            else:
+                self.flock.draw(target, interpolate, radius=radius, render_scale=tier.render_scale)
         if self.flock.bloom_on:
-            self._apply_bloom(surface)
+            with PROFILER.phase("bloom"):
+                self._apply_bloom(target)
+        if target is not surface:
+            with PROFILER.phase("flock_draw"):
+                pg.transform.scale(target, surface.get_size(), surface)
+        with PROFILER.phase("ui"):
+            self.draw_elements(surface)
+        if self.first_frame_pending:
+            self.first_frame_pending = False
+            latency = (time.perf_counter() - self.startup_clock) * 1000.0
+            print(f"First game frame drawn {latency:.1f} ms after the game started")
+
+    def species(self):
+        """
+        The flock's species tables. With the sim thread they come from the newest tick it
+        published, the live ones may be in the middle of changing on the other thread.
+        """
+        if self.sim is not None:
+            return self.sim.species()
+        return self.flock.species_snapshot()
+
+    def draw_elements(self, surface):
+        """Draw the menu and boid counter when the menu is visible."""
         for element in self.elements:
             if isinstance(element, BoidParameterMenu):
                 element.update_position(surface)
@@ -84,37 +287,51 @@ class Game(state_machine._State):
                     continue # Skip drawing the counter if not visible
         # Drawing code goes here
 
-class BoidCounter(pg.sprite.Sprite):
+class BoidCounter(ui.CachedWidget):
     """
     A simple class to count the number of boids in the flock.
+    The text is only rendered again when the count, tier or LOD share changes.
     """
     def __init__(self, flock, *groups):
-        pg.sprite.Sprite.__init__(self, *groups)
+        ui.CachedWidget.__init__(self, *groups)
         self.flock = flock
+        self.rect.topleft = (10, 10)
 
     def count(self):
         return self.flock.num_boids
-    
-    def draw(self, surface):
-        count_text = f"Boids: {self.count()}"
-        text_surface = prepare.PIXEL_FONT.render(count_text, True, pg.Color("white"))
-        surface.blit(text_surface, (10, 10))
+
+    def bound(self):
+        count_text = f"Boids: {self.count()}  Quality: {GOVERNOR.tier.name}"
+        if self.flock.lod_mode is not None and self.flock.num_boids > 0:
+            refreshed = 100.0 * self.flock.lod_subset / self.flock.num_boids
+            count_text += f"  LOD {refreshed:.0f}%"
+        return count_text
+
+    def render(self):
+        return ui.text(prepare.PIXEL_FONT, self._bound, pg.Color("white"))
         
-class BoidParameterMenu(pg.sprite.Sprite):
+class BoidParameterMenu(ui.CachedWidget):
     """
     A fixed menu in the top right with draggable sliders to adjust BoidFlock parameters.
+    The rule sliders edit the flock's selected species, N adds a species and 1-9 select one.
+    Edits are handed to submit as callables, so they can be queued onto the sim thread.
+    The menu surface is kept and only redrawn when one of the values it shows changes.
     """
     WIDTH = 220
-    HEIGHT = 250
+    HEIGHT = 340
     TITLE_HEIGHT = 30
     SPACE_BETWEEN_SLIDERS = 30
     SLIDER_WIDTH = 160
     SLIDER_HEIGHT = 20
+    SPECIES_ATTRS = WEIGHT_KEYS + ("cross_separation",) # Sliders that edit the selected species
     TOGGLE_SIZE = 16
 
-    def __init__(self, flock, *groups):
-        super().__init__(*groups)
+    def __init__(self, flock, *groups, submit=None, species=None):
+        ui.CachedWidget.__init__(self, *groups)
         self.flock = flock
+        self.submit = submit
+        # Returns the SpeciesSnapshot the species sliders show, safe to read while the sim runs
+        self.species = flock.species_snapshot if species is None else species
         self.rect = pg.Rect(prepare.SCREEN_SIZE[0] - self.WIDTH - 10, 10, self.WIDTH, self.HEIGHT)
         # List of parameters: (label, attr, min, max, step)
         self.params = [
@@ -123,6 +340,10 @@ class BoidParameterMenu(pg.sprite.Sprite):
             ("Alignment", "ali_weight", 0.0, 10.0, 0.1),
             ("Cohesion", "coh_weight", 0.0, 10.0, 0.1),
             ("Centering", "center_weight", 0.0, 1.0, 0.01),
+            ("Flee others", "cross_separation", 0.0, 5.0, 0.1),
+            ("Avoid walls", "avoid_weight", 0.0, 10.0, 0.1),
+            ("Intensity", "bloom_intensity", 0.0, 1.0, 0.05),
+            ("Quality", "bloom_quality", 1, 2, 1),
         ]
 
     def update_position(self, surface):
@@ -137,7 +358,7 @@ class BoidParameterMenu(pg.sprite.Sprite):
             toggle_y = self.rect.y + self.TITLE_HEIGHT + len(self.params) * self.SPACE_BETWEEN_SLIDERS + 10
             toggle_rect = pg.Rect(self.rect.x + 10, toggle_y, self.TOGGLE_SIZE, self.TOGGLE_SIZE)
             if toggle_rect.collidepoint(event.pos):
-                self.flock.bloom_on = not self.flock.bloom_on
+                self.apply("bloom_on", not self.flock.bloom_on)
                 return
             for i, (label, attr, mn, mxv, step) in enumerate(self.params):
                 slider_rect = pg.Rect(self.rect.x + 10, self.rect.y + 40 + i*self.SPACE_BETWEEN_SLIDERS, self.SLIDER_WIDTH, self.SLIDER_HEIGHT)
@@ -146,10 +367,22 @@ class BoidParameterMenu(pg.sprite.Sprite):
                     rel_x = max(0, min(rel_x, self.SLIDER_WIDTH))
                     value = mn + (mxv - mn) * (rel_x / self.SLIDER_WIDTH)
                     value = round(value / step) * step
-                    setattr(self.flock, attr, value)
+                    self.apply(attr, value)
                     break
 
-    def draw(self, surface):
+    def apply(self, attr, value):
+        if self.submit is None:
+            setattr(self.flock, attr, value)
+        else:
+            self.submit(lambda flock: setattr(flock, attr, value))
+
+    def bound(self):
+        species = self.species()
+        values = tuple(getattr(species if attr in self.SPECIES_ATTRS else self.flock, attr)
+                       for _, attr, _, _, _ in self.params)
+        return (species.selected_species, species.num_species, values, self.flock.bloom_on)
+
+    def render(self):
         # Create a transparent surface for the menu
         menu_surf = pg.Surface((self.WIDTH, self.HEIGHT), pg.SRCALPHA)
         # Draw semi-transparent background (RGBA)
@@ -157,14 +390,15 @@ class BoidParameterMenu(pg.sprite.Sprite):
 
         font = prepare.PIXEL_FONT
         # Optional: subtle title
-        title = font.render("Boid Params", True, (180, 180, 180))
+        title = ui.text(font, f"Species {self._bound[0] + 1}/{self._bound[1]}",
+                        (180, 180, 180))
         menu_surf.blit(title, (10, 8))
 
         # Draw minimal sliders
         for i, (label, attr, mn, mxv, step) in enumerate(self.params):
             y = self.TITLE_HEIGHT + i * self.SPACE_BETWEEN_SLIDERS
             slider_rect = pg.Rect(10, y, self.SLIDER_WIDTH, self.SLIDER_HEIGHT)
-            value = getattr(self.flock, attr)
+            value = self._bound[2][i]
             pct = (value - mn) / (mxv - mn)
             handle_x = int(slider_rect.x + pct * slider_rect.width)
 
@@ -175,18 +409,17 @@ class BoidParameterMenu(pg.sprite.Sprite):
             # Handle (small circle)
             pg.draw.circle(menu_surf, (255, 255, 180, 220), (handle_x, slider_rect.y + slider_rect.height // 2), 6)
             # Label (small, light)
-            label_surf = font.render(f"{label[0]}: {value:.1f}", True, (200, 200, 200))
+            label_surf = ui.text(font, f"{label[0]}: {value:.1f}", (200, 200, 200))
             menu_surf.blit(label_surf, (slider_rect.right + 8, y - 4))
 
         # Bloom toggle checkbox
         toggle_y = self.TITLE_HEIGHT + len(self.params) * self.SPACE_BETWEEN_SLIDERS + 10
         toggle_rect = pg.Rect(10, toggle_y, self.TOGGLE_SIZE, self.TOGGLE_SIZE)
         pg.draw.rect(menu_surf, (100, 100, 120, 180), toggle_rect, border_radius=2)
-        if self.flock.bloom_on:
+        if self._bound[3]:
             inner = toggle_rect.inflate(-6, -6)
             pg.draw.rect(menu_surf, (100, 200, 255, 220), inner, border_radius=1)
-        bloom_label = font.render("Bloom", True, (200, 200, 200))
+        bloom_label = ui.text(font, "Bloom", (200, 200, 200))
         menu_surf.blit(bloom_label, (10 + self.TOGGLE_SIZE + 8, toggle_y - 2))
 
-        # Blit the menu surface onto the main surface
-        surface.blit(menu_surf, (self.rect.x, self.rect.y))
\ No newline at end of file
+        return menu_surf
\ No newline at end of file
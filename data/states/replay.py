@@ -0,0 +1,128 @@
+"""
+State for playing back a recorded run.
+"""
+
+import pygame as pg
+
+from .. import prepare, render, state_machine
+from ..profiler import PROFILER
+from ..recording import TrajectoryReader
+
+SEEK_FRAMES = 60 # Frames skipped by the arrow keys, one second of simulation
+SPEEDS = (0.25, 0.5, 1, 2, 4, 8) # Playback speeds cycled through with up and down
+TIMELINE_HEIGHT = 8
+
+
+class Replay(state_machine._State):
+    """
+    Streams the frames of a recording from its memory map, the simulation is never run.
+    Space pauses, left/right seek, up/down change the speed and clicking the timeline jumps there.
+    """
+    def __init__(self, path):
+        state_machine._State.__init__(self)
+        self.path = path
+        self.next = "TITLE"
+        self.reader = None
+        self.bloom = render.Bloom()
+        self.frame = 0
+        self.cursor = 0.0 # Fractional frame position, so slow speeds advance every few ticks
+        self.speed_index = SPEEDS.index(1)
+        self.paused = False
+        self.positions = None
+        self.previous = None
+        self.species = None # Species ids of the boids in the current frame, None draws them untinted
+
+    def startup(self, now, persistent):
+        self.persist = persistent
+        self.start_time = now
+        self.now = now
+        if self.reader is None:
+            self.reader = TrajectoryReader(self.path)
+            print(f"Replaying {len(self.reader)} frames from {self.path}")
+        self.seek(0)
+
+    def seek(self, frame):
+        """Jump to a frame. Seeking never interpolates from the frame we jumped away from."""
+        if len(self.reader) == 0:
+            return
+        self.frame = min(max(int(frame), 0), len(self.reader) - 1)
+        self.cursor = float(self.frame)
+        self.positions, _ = self.reader.frame(self.frame)
+        self.species = self.reader.species(self.frame)
+        self.previous = self.positions
+
+    def update(self, keys, now, mouse):
+        self.now = now
+        if self.paused or len(self.reader) == 0:
+            return
+        self.cursor = min(self.cursor + SPEEDS[self.speed_index], len(self.reader) - 1)
+        frame = int(self.cursor)
+        # Drawing interpolates from previous, which only makes sense between consecutive frames
+        # of the same boids. Fast playback steps, slow playback holds still between frames.
+        self.previous = self.positions
+        if frame != self.frame:
+            positions, _ = self.reader.frame(frame)
+            if frame != self.frame + 1 or positions.shape != self.positions.shape:
+                self.previous = positions
+            self.frame = frame
+            self.positions = positions
+            self.species = self.reader.species(frame)
+        PROFILER.boid_count = self.positions.shape[0]
+
+    def get_event(self, event):
+        if event.type == pg.QUIT:
+            self.quit = True
+        elif event.type == pg.KEYDOWN:
+            if event.key == pg.K_SPACE:
+                self.paused = not self.paused
+            elif event.key == pg.K_LEFT:
+                self.seek(self.frame - SEEK_FRAMES)
+            elif event.key == pg.K_RIGHT:
+                self.seek(self.frame + SEEK_FRAMES)
+            elif event.key == pg.K_HOME:
+                self.seek(0)
+            elif event.key == pg.K_END:
+                self.seek(len(self.reader) - 1)
+            elif event.key == pg.K_UP:
+                self.speed_index = min(self.speed_index + 1, len(SPEEDS) - 1)
+            elif event.key == pg.K_DOWN:
+                self.speed_index = max(self.speed_index - 1, 0)
+            elif event.key == pg.K_BACKSPACE:
+                self.done = True
+        elif event.type == pg.MOUSEBUTTONDOWN and event.button == 1:
+            surface = pg.display.get_surface()
+            timeline = self.timeline_rect(surface)
+            if timeline.inflate(0, 20).collidepoint(event.pos):
+                self.seek((event.pos[0] - timeline.x) / timeline.width * (len(self.reader) - 1))
+        elif event.type == pg.VIDEORESIZE:
+            self.bloom.invalidate()
+
+    def timeline_rect(self, surface):
+        return pg.Rect(10, surface.get_height() - TIMELINE_HEIGHT - 10,
+                       surface.get_width() - 20, TIMELINE_HEIGHT)
+
+    def draw(self, surface, interpolate):
+        surface.fill(prepare.BACKGROUND_COLOR)
+        if self.positions is not None:
+            alpha = 1.0 if self.paused else interpolate
+            with PROFILER.phase("flock_draw"):
+                render.draw_points(surface, self.positions, self.reader.width, self.reader.height,
+                                   previous=self.previous, alpha=alpha, species=self.species,
+                                   colors=self.reader.colors)
+            with PROFILER.phase("bloom"):
+                self.bloom.apply(surface)
+        with PROFILER.phase("ui"):
+            self.draw_timeline(surface)
+
+    def draw_timeline(self, surface):
+        total = len(self.reader)
+        timeline = self.timeline_rect(surface)
+        pg.draw.rect(surface, (100, 100, 120), timeline, border_radius=4)
+        if total > 1:
+            played = timeline.copy()
+            played.width = int(timeline.width * self.frame / (total - 1))
+            pg.draw.rect(surface, (100, 200, 255), played, border_radius=4)
+        state = "paused" if self.paused else f"x{SPEEDS[self.speed_index]:g}"
+        text = f"Frame {self.frame + 1}/{total}  {state}"
+        text_surface = prepare.PIXEL_FONT.render(text, True, pg.Color("white"))
+        surface.blit(text_surface, (10, timeline.y - text_surface.get_height() - 4))
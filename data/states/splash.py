@@ -1,14 +1,17 @@
 import pygame as pg 
 
 from .. import prepare, state_machine
+from ..assets import ASSETS
 
 
 class Splash(state_machine._State):
     """
     This state is updated while the game shwos the splash screen.
+    With prefetch the rest of the assets are loaded in the background while it is up.
     """
-    def __init__(self):
+    def __init__(self, prefetch=True):
         state_machine._State.__init__(self)
+        self.prefetch = prefetch
         self.next = "TITLE"
         self.timeout = 5
         self.alpha = 0
@@ -16,7 +19,13 @@ class Splash(state_machine._State):
         self.image = prepare.GFX["misc"]['testcat'].copy().convert()
         self.image.set_alpha(self.alpha)
         self.rect = self.image.get_rect(center=prepare.SCREEN_RECT.center)
+        self.drawn_alpha = None # Alpha of the image on screen, it only needs drawing when that changes
         
+    def startup(self, now, persistent):
+        state_machine._State.startup(self, now, persistent)
+        if self.prefetch:
+            ASSETS.prefetch(prepare.PREFETCH_FONTS)
+
     def update(self, keys, now, mouse):
         """Updates the splash screen."""
         self.now = now
@@ -26,8 +35,19 @@ class Splash(state_machine._State):
             self.done = True
     
     def draw(self, surface, interpolate):
-        surface.fill(prepare.BACKGROUND_COLOR)
+        """Draw the splash screen. Once the fade in is over nothing changes any more."""
+        if self.repaint:
+            surface.fill(prepare.BACKGROUND_COLOR)
+            surface.blit(self.image, self.rect)
+            self.drawn_alpha = self.alpha
+            self.repaint = False
+            return None
+        if self.drawn_alpha == self.alpha:
+            return []
+        surface.fill(prepare.BACKGROUND_COLOR, self.rect)
         surface.blit(self.image, self.rect)
+        self.drawn_alpha = self.alpha
+        return [self.rect]
     
     def get_event(self, event):
         """
@@ -0,0 +1,81 @@
+"""
+State for watching a simulation streamed from somewhere else.
+"""
+
+import pygame as pg
+
+from .. import prepare, render, state_machine, ui
+from ..profiler import PROFILER
+from ..streaming import StreamClient
+
+
+class StreamViewer(state_machine._State):
+    """
+    Draws the frames a StreamServer sends, the simulation is never run here.
+    Frames are interpolated by how far we are into the interval the server sends them at.
+    Backspace goes back to the title screen.
+    """
+    def __init__(self, host, port):
+        state_machine._State.__init__(self)
+        self.host = host
+        self.port = port
+        self.next = "TITLE"
+        self.client = None
+        self.bloom = render.Bloom()
+        self.status = None # Bandwidth statistics shown at the bottom, refreshed once a second
+        self.status_time = 0.0
+        self.status_bytes = 0
+
+    def startup(self, now, persistent):
+        self.persist = persistent
+        self.start_time = now
+        self.now = now
+        if self.client is None or self.client.closed:
+            self.client = StreamClient(self.host, self.port)
+            print(f"Watching the stream from {self.host}:{self.port}")
+
+    def cleanup(self):
+        self.done = False
+        if self.client is not None:
+            self.client.close()
+            self.client = None
+        return self.persist
+
+    def update(self, keys, now, mouse):
+        self.now = now
+        if self.client.error is not None:
+            print(f"Stream from {self.host}:{self.port} ended: {self.client.error}")
+            self.client.error = None
+        if now - self.status_time >= 1000.0:
+            received = self.client.bytes_received
+            rate = (received - self.status_bytes) / max(now - self.status_time, 1.0)
+            self.status = (f"{self.host}:{self.port}  {rate:.0f} kB/s  "
+                           f"{self.client.frames} frames, {self.client.keyframes} keyframes")
+            if self.client.closed:
+                self.status += "  disconnected"
+            self.status_time = now
+            self.status_bytes = received
+
+    def get_event(self, event):
+        if event.type == pg.QUIT:
+            self.quit = True
+        elif event.type == pg.KEYDOWN and event.key == pg.K_BACKSPACE:
+            self.done = True
+        elif event.type == pg.VIDEORESIZE:
+            self.bloom.invalidate()
+
+    def draw(self, surface, interpolate):
+        surface.fill(prepare.BACKGROUND_COLOR)
+        previous, positions, age = self.client.latest()
+        if positions is not None:
+            alpha = min(max(age / self.client.interval, 0.0), 1.0)
+            width, height = self.client.world
+            PROFILER.boid_count = positions.shape[0]
+            with PROFILER.phase("flock_draw"):
+                render.draw_points(surface, positions, width, height, previous=previous, alpha=alpha)
+            with PROFILER.phase("bloom"):
+                self.bloom.apply(surface)
+        with PROFILER.phase("ui"):
+            if self.status is not None:
+                text_surface = ui.text(prepare.PIXEL_FONT, self.status, pg.Color("white"))
+                surface.blit(text_surface, (10, surface.get_height() - text_surface.get_height() - 10))
@@ -4,7 +4,8 @@ State for the Title scene.
 
 import pygame as pg
 
-from .. import prepare, state_machine, main
+from .. import prepare, state_machine, main, ui
+from ..assets import font as load_font
 SPACE_COLOR = (10, 10, 20)
 SPACE_RECT = pg.Rect(0, 0, 1200, 700)
 
@@ -12,15 +13,19 @@ SPACE_RECT = pg.Rect(0, 0, 1200, 700)
 class Title(state_machine._State):
     """ 
     This state is updated while the game is in the title screen.
+    Nothing but the start button ever changes here, so the title is pre-rendered into a
+    background and after the first frame only the button's dirty rects are drawn.
     """
     def __init__(self):
         state_machine._State.__init__(self)
+        self.background = None
         self.elements = self.make_elements()
     
     def startup(self, now, persistent):
         self.persist = persistent
         self.start_time = now
         self.elements = self.make_elements()
+        self.repaint = True
     
     def update(self, keys, now, mouse):
         self.now = now
@@ -32,24 +37,39 @@ class Title(state_machine._State):
                 break
     
     def draw(self, surface, interpolate):
-        surface.fill(SPACE_COLOR, SPACE_RECT)
-        _titletext = prepare.BIG_PIXEL_FONT.render("BOIDS", 0, pg.Color("white"))
-        surface.blit(_titletext, _titletext.get_rect(center=(SPACE_RECT.center[0], SPACE_RECT.center[1]-50)))
-        _subtitletext = prepare.PIXEL_FONT.render("A Clay Goldsmith Game", 0, pg.Color("white"))
-        surface.blit(_subtitletext, _subtitletext.get_rect(center=(SPACE_RECT.center[0], SPACE_RECT.center[1])))
-        self.elements.draw(surface)
+        """Draw the title screen and return the rects that changed since the last frame."""
+        if self.repaint or self.background is None or self.background.get_size() != surface.get_size():
+            self.background = self.make_background(surface)
+            self.elements.clear(surface, self.background)
+            surface.blit(self.background, (0, 0))
+            self.elements.repaint_rect(surface.get_rect())
+            self.elements.draw(surface)
+            self.repaint = False
+            return None
+        return self.elements.draw(surface)
+
+    def make_background(self, surface):
+        """Everything static on the title screen, rendered once."""
+        background = pg.Surface(surface.get_size()).convert()
+        background.fill(prepare.BACKGROUND_COLOR)
+        background.fill(SPACE_COLOR, SPACE_RECT)
+        _titletext = ui.text(prepare.BIG_PIXEL_FONT, "BOIDS", pg.Color("white"), antialias=False)
+        background.blit(_titletext, _titletext.get_rect(center=(SPACE_RECT.center[0], SPACE_RECT.center[1]-50)))
+        _subtitletext = ui.text(prepare.PIXEL_FONT, "A Clay Goldsmith Game", pg.Color("white"), antialias=False)
+        background.blit(_subtitletext, _subtitletext.get_rect(center=(SPACE_RECT.center[0], SPACE_RECT.center[1])))
+        return background
     
     def make_elements(self):
         """ 
         Create the elements for the title screen.
         """
-        group = pg.sprite.LayeredUpdates()
+        group = pg.sprite.LayeredDirty()
         group.add(StartButton(), layer=1)
         return group
 
-class StartButton(pg.sprite.Sprite):
+class StartButton(pg.sprite.DirtySprite):
     def __init__(self, *groups):
-        pg.sprite.Sprite.__init__(self, *groups)
+        pg.sprite.DirtySprite.__init__(self, *groups)
         self.raw_image = render_font("PixelifySans", 30, "Start", (0, 255, 255))
         self.hover_image = render_font("PixelifySans", 30, "Start", (255, 255, 0))
         self.null_image = pg.Surface((1,1)).convert_alpha()
@@ -74,13 +94,15 @@ class StartButton(pg.sprite.Sprite):
     
     def update(self, now, mouse, *args):
         self.check_hover(mouse)
-        self.image = self.raw_image if self.hover else self.hover_image
+        image = self.raw_image if self.hover else self.hover_image
+        if image is not self.image:
+            self.image = image
+            self.dirty = 1
         self.check_click()
 
 def render_font(font, size, msg, color=(255,255,255)):
         """
         Takes the name of a loaded font, the size, and the color and returns
-        a rendered surface of the msg given.
+        a rendered surface of the msg given. Fonts and rendered text are cached.
         """
-        selected_font = pg.font.Font(prepare.FONTS[font], size)
-        return selected_font.render(msg, 1, color)
\ No newline at end of file
+        return ui.text(load_font(font, size), msg, color)
\ No newline at end of file
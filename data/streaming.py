@@ -0,0 +1,377 @@
+'''
+Live streaming of a running simulation over TCP.
+
+StreamServer is a flock observer (attach it with flock.attach) that publishes the
+positions of every tick to any number of TCP clients, so a simulation on a box without
+a screen can be watched from somewhere else. StreamClient receives such a stream and
+the StreamViewer state draws it.
+
+Positions are quantized to 16 bit world coordinates, 65536 steps across the world on
+each axis. A frame is either a keyframe, the quantized positions themselves, or the
+residual against a prediction from the frames sent before it: a DELTA predicts that
+boids stay where they were, a PREDICTED frame that they keep the velocity they had.
+Residuals wrap modulo 2**16 just like the world does. Boids turn slowly, so predicted
+residuals are a handful of steps, which zigzag encoding maps to small unsigned values.
+Payloads are byte shuffled (all low bytes, then all high bytes) and zlib compressed,
+which brings a predicted frame down to under a byte per boid, from four raw.
+
+Every message is a FRAME header followed by payload_size bytes of payload:
+magic, kind (KEYFRAME, DELTA or PREDICTED), tick, number of boids, world width and height.
+
+The flock is never slowed down by the stream. on_update only quantizes the positions
+into a mailbox, an encoder thread compresses whatever is newest, and each client has
+its own sender thread with a short queue. A client that can't keep up has frames
+dropped instead, and as its next frame can't be predicted any more it gets a keyframe.
+'''
+
+import queue
+import socket
+import struct
+import threading
+import time
+import zlib
+
+import numpy as np
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 7878
+FRAME = struct.Struct("<4sBIIffI") # magic, kind, tick, boids, world width, world height, payload size
+MAGIC = b"BDS1"
+KEYFRAME = 0
+DELTA = 1
+PREDICTED = 2
+STEPS = 65536 # Quantization steps across the world, on each axis
+KEYFRAME_INTERVAL = 120 # Frames between keyframes, so a corrupted view heals within two seconds
+MAX_QUEUED = 2 # Frames waiting per client before frames get dropped for it
+COMPRESSION = 1 # zlib level, the deltas compress well even at the fastest level
+
+
+def parse_address(address, host=DEFAULT_HOST):
+    """Split "host:port" or just "port" into a (host, port) tuple."""
+    address = str(address)
+    if ":" in address:
+        host, port = address.rsplit(":", 1)
+    else:
+        port = address
+    return host or DEFAULT_HOST, int(port)
+
+
+def quantize(positions, width, height, out=None):
+    """Positions as an (N, 2) uint16 array of 16 bit world coordinates."""
+    scale = np.array([STEPS / width, STEPS / height])
+    quantized = np.rint(positions * scale).astype(np.int64)
+    quantized &= STEPS - 1
+    if out is None:
+        return quantized.astype(np.uint16)
+    out[:] = quantized
+    return out
+
+
+def dequantize(quantized, width, height):
+    return quantized * np.array([width / STEPS, height / STEPS])
+
+
+def zigzag(values):
+    """Map the wrapped uint16 residuals 0, -1, 1, -2, ... to 0, 1, 2, 3, ..."""
+    signed = values.view(np.int16).astype(np.int32)
+    return ((signed << 1) ^ (signed >> 15)).astype(np.uint16)
+
+
+def unzigzag(values):
+    unsigned = values.astype(np.int32)
+    return ((unsigned >> 1) ^ -(unsigned & 1)).astype(np.uint16)
+
+
+def residual(kind, current, history):
+    """What a frame of kind encodes, given the frames sent before it (newest last)."""
+    if kind == KEYFRAME:
+        return current
+    if kind == DELTA:
+        return zigzag(current - history[-1])
+    return zigzag(current - 2 * history[-1] + history[-2])
+
+
+def reconstruct(kind, values, history):
+    """Inverse of residual."""
+    if kind == KEYFRAME:
+        return values
+    if kind == DELTA:
+        return history[-1] + unzigzag(values)
+    return 2 * history[-1] - history[-2] + unzigzag(values)
+
+
+def encode(values):
+    """Byte shuffle and compress a uint16 array."""
+    shuffled = values.reshape(-1).view(np.uint8).reshape(-1, 2).T
+    return zlib.compress(np.ascontiguousarray(shuffled).tobytes(), COMPRESSION)
+
+
+def decode(payload, num_boids):
+    """Inverse of encode, an (num_boids, 2) uint16 array."""
+    shuffled = np.frombuffer(zlib.decompress(payload), np.uint8).reshape(2, -1)
+    return np.ascontiguousarray(shuffled.T).view(np.uint16).reshape(num_boids, 2)
+
+
+class _Client(object):
+    """A connected viewer, fed by its own sender thread."""
+    def __init__(self, connection, address, max_queued):
+        self.connection = connection
+        self.address = address
+        self.frames = queue.Queue(max_queued)
+        self.depth = 0 # Frames in a row the viewer has, 0 means it needs a keyframe
+        self.closed = False
+        self.bytes_sent = 0
+        self.sent = 0
+        self.dropped = 0
+        self.thread = threading.Thread(target=self._send, name=f"stream-{address[0]}:{address[1]}", daemon=True)
+        self.thread.start()
+
+    def offer(self, message, depth):
+        """
+        Queue the newest frame without ever waiting. message(kind) returns the encoded
+        frame, depth is how many frames before it the server can predict from.
+        """
+        kind = (KEYFRAME, DELTA, PREDICTED)[min(self.depth, depth, 2)]
+        try:
+            self.frames.put_nowait(message(kind))
+        except queue.Full:
+            self.dropped += 1
+            self.depth = 0
+        else:
+            self.depth = 1 if kind == KEYFRAME else self.depth + 1
+
+    def _send(self):
+        try:
+            while True:
+                message = self.frames.get()
+                if message is None:
+                    break
+                self.connection.sendall(message)
+                self.bytes_sent += len(message)
+                self.sent += 1
+        except OSError:
+            pass
+        self.closed = True
+        self.connection.close()
+
+    def close(self):
+        if not self.closed:
+            # Whatever is queued is dropped, the sentinel has to fit
+            while True:
+                try:
+                    self.frames.get_nowait()
+                except queue.Empty:
+                    break
+            self.frames.put(None)
+            self.connection.shutdown(socket.SHUT_RDWR)
+        self.thread.join()
+
+
+class StreamServer(object):
+    """
+    Flock observer publishing every tick to the clients connected to (host, port).
+    Port 0 picks a free port, see address.
+    """
+    def __init__(self, host=DEFAULT_HOST, port=DEFAULT_PORT, keyframe_interval=KEYFRAME_INTERVAL,
+                 max_queued=MAX_QUEUED):
+        self.keyframe_interval = keyframe_interval
+        self.max_queued = max_queued
+        self.listener = socket.create_server((host, port))
+        self.address = self.listener.getsockname()[:2]
+        self.clients = []
+        self._clients_lock = threading.Lock()
+        self._mailbox = None # (tick, quantized positions, width, height) of the newest tick
+        self._mailbox_lock = threading.Lock()
+        self._spare = None # Quantized positions array handed back by the encoder for reuse
+        self._history = [] # The last frames encoded, newest last
+        self._ready = threading.Event()
+        self._closing = False
+        self.ticks = 0
+        self.encoded = 0
+        self.skipped = 0 # Ticks overwritten in the mailbox before the encoder got to them
+        self._since_keyframe = 0
+        self._accept_thread = threading.Thread(target=self._accept, name="stream-accept", daemon=True)
+        self._encode_thread = threading.Thread(target=self._encode, name="stream-encode", daemon=True)
+        self._accept_thread.start()
+        self._encode_thread.start()
+        print(f"Streaming on {self.address[0]}:{self.address[1]}")
+
+    def on_update(self, flock):
+        n = flock.num_boids
+        spare, self._spare = self._spare, None
+        if spare is None or spare.shape[0] != n:
+            spare = np.empty((n, 2), np.uint16)
+        quantize(flock.positions, flock.width, flock.height, spare)
+        with self._mailbox_lock:
+            if self._mailbox is not None:
+                self.skipped += 1
+            self._mailbox = (self.ticks, spare, float(flock.width), float(flock.height))
+        self.ticks += 1
+        self._ready.set()
+
+    def _accept(self):
+        while not self._closing:
+            try:
+                connection, address = self.listener.accept()
+            except OSError:
+                return
+            connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            print(f"Stream client connected from {address[0]}:{address[1]}")
+            with self._clients_lock:
+                self.clients.append(_Client(connection, address, self.max_queued))
+
+    def _encode(self):
+        while True:
+            self._ready.wait()
+            self._ready.clear()
+            if self._closing:
+                return
+            with self._mailbox_lock:
+                frame, self._mailbox = self._mailbox, None
+            if frame is None:
+                continue
+            tick, current, width, height = frame
+            self.publish(tick, current, width, height)
+            self.encoded += 1
+            self._history.append(current)
+            if len(self._history) > 2:
+                # Predictions don't reach back further, the next tick can quantize into it
+                self._spare = self._history.pop(0)
+
+    def publish(self, tick, current, width, height):
+        """Encode one frame and offer it to every client, predicted as far as each one can take."""
+        history = self._history
+        n = current.shape[0]
+        if self._since_keyframe >= self.keyframe_interval or any(frame.shape != current.shape for frame in history):
+            # Everyone gets a keyframe, which the frames after it can be predicted from again
+            history.clear()
+        encoded = {}
+
+        def message(kind):
+            if kind not in encoded:
+                payload = encode(residual(kind, current, history))
+                encoded[kind] = FRAME.pack(MAGIC, kind, tick, n, width, height, len(payload)) + payload
+            return encoded[kind]
+
+        with self._clients_lock:
+            self.clients = [client for client in self.clients if not client.closed]
+            clients = list(self.clients)
+        for client in clients:
+            client.offer(message, len(history))
+        self._since_keyframe = self._since_keyframe + 1 if history else 0
+
+    def close(self):
+        """Stop accepting and encoding and disconnect every client."""
+        if self._closing:
+            return
+        self._closing = True
+        self._ready.set()
+        try:
+            # Closing alone doesn't wake up the accept thread on Linux, shutting down does
+            self.listener.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.listener.close()
+        self._encode_thread.join()
+        self._accept_thread.join()
+        with self._clients_lock:
+            clients, self.clients = self.clients, []
+        for client in clients:
+            try:
+                client.close()
+            except OSError:
+                pass
+            print(f"Stream client {client.address[0]}:{client.address[1]}: {client.sent} frames, "
+                  f"{client.bytes_sent / 1e6:.1f} MB sent, {client.dropped} dropped")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+
+class StreamClient(object):
+    """
+    Receives a stream on a background thread and keeps the newest two decoded frames.
+    The drawing side only ever calls latest.
+    """
+    def __init__(self, host=DEFAULT_HOST, port=DEFAULT_PORT, timeout=5.0):
+        self.address = (host, port)
+        self.connection = socket.create_connection(self.address, timeout=timeout)
+        self.connection.settimeout(None)
+        self._lock = threading.Lock()
+        self._history = [] # The last two quantized frames, newest last
+        self.positions = None # Newest frame, in world coordinates
+        self.previous = None # The frame before it, for interpolation
+        self.world = (1.0, 1.0)
+        self.tick = -1
+        self.time = 0.0 # perf_counter when the newest frame arrived
+        self.interval = 1.0 / 60.0 # Smoothed time between frames, in seconds
+        self.frames = 0
+        self.keyframes = 0
+        self.bytes_received = 0
+        self.error = None
+        self.closed = False
+        self.thread = threading.Thread(target=self._receive, name="stream-receive", daemon=True)
+        self.thread.start()
+
+    def _read(self, size):
+        buffer = bytearray(size)
+        view = memoryview(buffer)
+        while view:
+            received = self.connection.recv_into(view)
+            if received == 0:
+                raise ConnectionError("Stream closed by the server")
+            view = view[received:]
+        self.bytes_received += size
+        return bytes(buffer)
+
+    def _receive(self):
+        try:
+            while True:
+                magic, kind, tick, n, width, height, size = FRAME.unpack(self._read(FRAME.size))
+                if magic != MAGIC:
+                    raise ValueError("Not a boids stream")
+                values = decode(self._read(size), n)
+                if kind == KEYFRAME:
+                    self.keyframes += 1
+                    self._history.clear()
+                elif len(self._history) < kind or self._history[-1].shape != values.shape:
+                    continue # Can only happen on a broken stream, wait for the next keyframe
+                quantized = reconstruct(kind, values, self._history)
+                self._history = self._history[-1:] + [quantized]
+                self.store(tick, quantized, width, height)
+        except (OSError, ValueError, zlib.error) as error:
+            if not self.closed:
+                self.error = error
+        self.closed = True
+
+    def store(self, tick, quantized, width, height):
+        positions = dequantize(quantized, width, height)
+        now = time.perf_counter()
+        with self._lock:
+            consecutive = self.positions is not None and self.positions.shape == positions.shape
+            self.previous = self.positions if consecutive else positions
+            self.positions = positions
+            if self.frames:
+                self.interval = 0.9 * self.interval + 0.1 * max(now - self.time, 1e-4)
+            self.time = now
+            self.world = (width, height)
+            self.tick = tick
+            self.frames += 1
+
+    def latest(self):
+        """(previous, positions, seconds since positions arrived) of the newest frame."""
+        with self._lock:
+            return self.previous, self.positions, time.perf_counter() - self.time
+
+    def close(self):
+        self.closed = True
+        try:
+            self.connection.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.connection.close()
+        self.thread.join()
@@ -0,0 +1,207 @@
+'''
+Parameter sweeps over the flocking rules.
+
+A sweep runs one headless simulation per configuration of the BoidFlock weights, on a
+pool of worker processes. The configurations are either the full grid of the values
+given per parameter or a random sample from them. Every run reports a few summary
+metrics of the flock it ended up with, and each one is appended to a JSON lines results
+file as soon as it finishes, so a sweep that gets interrupted loses at most the runs in
+flight. Running the same sweep again skips the runs the results file already has.
+
+Each worker limits Numba to its share of the cores, so the workers' parallel kernels
+don't fight over the same cores.
+
+A parameter spec is either a comma separated list of values ("1,2,4") or a range
+"low:high:count". Grids take count evenly spaced values from a range, random samples
+draw uniformly from it and ignore count.
+'''
+
+import itertools
+import json
+import multiprocessing as mp
+import os
+import time
+
+import numpy as np
+
+from .boids_logic import BACKENDS, WEIGHT_KEYS
+
+SAMPLE_EVERY = 10 # Steps between metric samples in the second half of a run
+NEIGHBOR_SAMPLE = 1000 # Boids the nearest neighbor distance is measured for
+
+
+def parse_spec(spec):
+    """A parameter spec as a list of values, or a (low, high, count) tuple for a range."""
+    if ":" in spec:
+        parts = spec.split(":")
+        if len(parts) not in (2, 3):
+            raise ValueError(f"Range {spec!r} is not low:high or low:high:count")
+        low, high = float(parts[0]), float(parts[1])
+        count = int(parts[2]) if len(parts) == 3 else 2
+        return (low, high, count)
+    return [float(value) for value in spec.split(",")]
+
+
+def parse_space(assignments):
+    """Turn ["sep_weight=0:4:5", "max_force=0.05,0.1"] into a parameter space dict."""
+    space = {}
+    for assignment in assignments:
+        key, _, spec = assignment.partition("=")
+        key = key.strip()
+        if key not in WEIGHT_KEYS:
+            raise ValueError(f"Unknown parameter {key!r}, expected one of {WEIGHT_KEYS}")
+        if not spec:
+            raise ValueError(f"No values given for {key!r}, expected {key}=SPEC")
+        space[key] = parse_spec(spec)
+    return space
+
+
+def grid(space):
+    """Every combination of the values of the parameters, as weights dicts."""
+    keys = list(space)
+    axes = [np.linspace(*spec).tolist() if isinstance(spec, tuple) else spec for spec in space.values()]
+    return [dict(zip(keys, values)) for values in itertools.product(*axes)]
+
+
+def random_sample(space, count, seed=None):
+    """count weights dicts drawn independently from the parameters' values."""
+    rng = np.random.default_rng(seed)
+    samples = []
+    for _ in range(count):
+        weights = {}
+        for key, spec in space.items():
+            if isinstance(spec, tuple):
+                weights[key] = float(rng.uniform(spec[0], spec[1]))
+            else:
+                weights[key] = float(rng.choice(spec))
+        samples.append(weights)
+    return samples
+
+
+def flock_metrics(flock):
+    """
+    Summary of the current state of a flock:
+    polarization, the length of the mean heading (1 when all boids fly the same way),
+    mean_speed, dispersion, the RMS distance from the flock's centroid, and
+    nearest_neighbor, the mean distance to the closest other boid (wrapping around the world).
+    """
+    positions = flock.positions
+    velocities = flock.velocities
+    n = positions.shape[0]
+    if n == 0:
+        return {"polarization": 0.0, "mean_speed": 0.0, "dispersion": 0.0, "nearest_neighbor": 0.0}
+    speeds = np.hypot(velocities[:, 0], velocities[:, 1])
+    headings = velocities / np.maximum(speeds, 1e-12)[:, None]
+    polarization = float(np.hypot(*headings.mean(axis=0)))
+    dispersion = float(np.sqrt(((positions - positions.mean(axis=0)) ** 2).sum(axis=1).mean()))
+    nearest = 0.0
+    if n > 1:
+        world = np.array([flock.width, flock.height], dtype=float)
+        sample = np.linspace(0, n - 1, min(n, NEIGHBOR_SAMPLE)).astype(np.int64)
+        distances = np.empty(sample.shape[0])
+        for start in range(0, sample.shape[0], 100):
+            chunk = sample[start:start + 100]
+            offsets = np.abs(positions[chunk, None, :] - positions[None, :, :])
+            offsets = np.minimum(offsets, world - offsets)
+            squared = (offsets ** 2).sum(axis=2)
+            squared[np.arange(chunk.shape[0]), chunk] = np.inf
+            distances[start:start + 100] = np.sqrt(squared.min(axis=1))
+        nearest = float(distances.mean())
+    return {"polarization": polarization, "mean_speed": float(speeds.mean()),
+            "dispersion": dispersion, "nearest_neighbor": nearest}
+
+
+def run_config(config):
+    """
+    Simulate one configuration and return its result record. Errors are recorded
+    instead of raised, so one bad configuration doesn't end the sweep.
+    """
+    from .boids_logic import BoidFlock
+    result = dict(config)
+    try:
+        flock = BoidFlock(config["num_boids"], weights=config["weights"], backend=config["backend"],
+                          dtype=config["dtype"], seed=config["seed"])
+        steps = config["steps"]
+        samples = []
+        wall_time = 0.0
+        for step in range(steps):
+            start = time.perf_counter()
+            flock.update(step)
+            if step > 0:
+                # The first step loads or compiles the kernels, it isn't timed
+                wall_time += time.perf_counter() - start
+            if step >= steps // 2 and (steps - 1 - step) % SAMPLE_EVERY == 0:
+                samples.append(flock_metrics(flock))
+        final = samples[-1] if samples else flock_metrics(flock)
+        result["final"] = final
+        # Averages over the second half, less noisy than the final state alone
+        result["mean"] = {key: float(np.mean([sample[key] for sample in samples])) for key in final} if samples else final
+        result["wall_time"] = wall_time
+        result["steps_per_sec"] = (steps - 1) / wall_time if wall_time > 0 else float("inf")
+    except Exception as error:
+        result["error"] = repr(error)
+    return result
+
+
+def _init_worker(threads):
+    """Pool initializer, limits the Numba threads of the worker."""
+    import numba
+    numba.set_num_threads(max(1, min(threads, numba.config.NUMBA_NUM_THREADS)))
+
+
+def run_key(config):
+    """What identifies a run in the results file, to skip it when a sweep is resumed."""
+    return json.dumps([config["weights"], config["seed"], config["num_boids"], config["steps"],
+                       config["backend"], config["dtype"]], sort_keys=True)
+
+
+def finished_runs(path):
+    """run_keys of the runs in an existing results file that finished without an error."""
+    keys = set()
+    if not os.path.exists(path):
+        return keys
+    with open(path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue # A line cut off by an interrupted sweep
+            if "error" not in record:
+                keys.add(run_key(record))
+    return keys
+
+
+def run_sweep(space, out, samples=None, num_boids=1000, steps=1000, repeats=1, processes=None,
+              threads=None, backend="grid", dtype="float64", seed=0):
+    """
+    Run the grid of space (or samples random configurations of it) repeats times each,
+    with seeds seed, seed + 1, ..., and append a JSON line per run to out.
+    processes defaults to one per core, threads (Numba threads per process) to an even
+    share of the cores. Returns the number of runs done.
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown backend {backend!r}, expected one of {BACKENDS}")
+    weight_sets = grid(space) if samples is None else random_sample(space, samples, seed)
+    configs = [{"weights": weights, "seed": seed + repeat, "num_boids": num_boids, "steps": steps,
+                "backend": backend, "dtype": dtype}
+               for weights in weight_sets for repeat in range(repeats)]
+    done = finished_runs(out)
+    todo = [config for config in configs if run_key(config) not in done]
+    if len(todo) < len(configs):
+        print(f"Skipping {len(configs) - len(todo)} runs already in {out}")
+    if not todo:
+        return 0
+    cores = os.cpu_count() or 1
+    processes = min(processes or cores, len(todo))
+    threads = threads or max(1, cores // processes)
+    print(f"Running {len(todo)} runs on {processes} processes with {threads} Numba threads each")
+    start = time.perf_counter()
+    context = mp.get_context("spawn") # Forking a process that already runs Numba's thread pool is unsafe
+    with context.Pool(processes, initializer=_init_worker, initargs=(threads,)) as pool, open(out, "a") as f:
+        for finished, result in enumerate(pool.imap_unordered(run_config, todo), 1):
+            f.write(json.dumps(result) + "\n")
+            f.flush()
+            status = result["error"] if "error" in result else f"polarization {result['mean']['polarization']:.3f}"
+            print(f"[{finished}/{len(todo)}] {result['weights']} seed {result['seed']}: {status}")
+    print(f"Sweep of {len(todo)} runs finished in {time.perf_counter() - start:.1f} s, results in {out}")
+    return len(todo)
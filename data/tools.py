@@ -1,15 +1,21 @@
 '''
-Fundamental control class and resource loading functions.
+Fundamental control class.
 Control class is used to manage the game loop.
 '''
 
-import os
+import time
 import pygame as pg
 
 # Import State Machine
 from . import state_machine
+from .governor import GOVERNOR
+from .profiler import PROFILER
+from .warmup import milliseconds_since_launch
 
 TIME_PER_UPDATE = 16.0 #Milliseconds
+MAX_TIME_PER_UPDATE = 64.0 # Slowest the simulation tick is allowed to get under load
+MAX_SUBSTEPS = 5 # Most updates run in one frame before the remaining lag is dropped
+UPDATE_HEADROOM = 1.5 # Keep the tick interval this many times longer than an update takes
 
 
 class Control(object):
@@ -22,8 +28,13 @@ class Control(object):
         self.done = False
         self.clock = pg.time.Clock()
         self.fps = 60.0
+        GOVERNOR.target_fps = self.fps
         self.fps_visible = True
         self.now = 0.0
+        self.time_per_update = TIME_PER_UPDATE
+        self.update_cost = 0.0 # Smoothed time one update takes, in milliseconds
+        self.max_substeps = MAX_SUBSTEPS
+        self.frames_drawn = 0
         self.keys = pg.key.get_pressed()
         self.mouse = pg.mouse.get_pos()
         self.state_machine = state_machine.StateMachine()
@@ -38,15 +49,32 @@ class Control(object):
         self.state_machine.update(self.keys, self.now, self.mouse)
     
     def draw(self, interpolate):
+        """
+        Draw the current state. States that report dirty rects only get those updated on
+        the display, the rest get a full update.
+        """
         if not self.state_machine.state.done:
-            self.state_machine.draw(self.screen, interpolate)
-            pg.display.update()
+            if PROFILER.overlay_visible:
+                # The overlay is blended over whatever is below it, that has to be fresh
+                self.state_machine.repaint()
+            rects = self.state_machine.draw(self.screen, interpolate)
+            if PROFILER.overlay_visible:
+                PROFILER.draw_overlay(self.screen)
+                rects = None
+            with PROFILER.phase("display"):
+                if rects is None:
+                    pg.display.update()
+                elif rects:
+                    pg.display.update(rects)
             self.show_fps()
+            if self.frames_drawn == 0:
+                print(f"Startup latency: first frame shown {milliseconds_since_launch():.1f} ms after launch")
+            self.frames_drawn += 1
     
     def event_loop(self):
         '''
         Handle events and pass them to the state machine.
-        f5 toggles the FPS display. F11 toggles fullscreen. esc quits the game.
+        f5 toggles the FPS display. F3 toggles the frame profiler overlay. F11 toggles fullscreen. esc quits the game.
         '''
         for event in pg.event.get():
             if event.type == pg.QUIT:
@@ -55,6 +83,7 @@ class Control(object):
                 if not pg.display.get_surface().get_flags() & pg.FULLSCREEN:
                     self.screen = pg.display.set_mode(event.size, pg.RESIZABLE)
                     self.screen = pg.display.get_surface()
+                    self.state_machine.repaint()
             elif event.type == pg.KEYDOWN:
                 self.keys = pg.key.get_pressed()
                 self.toggle_show_fps(event.key)
@@ -71,12 +100,15 @@ class Control(object):
             self.fps_visible = not self.fps_visible
             if not self.fps_visible:
                 pg.display.set_caption(self.caption)
+        elif key == pg.K_F3:
+            PROFILER.toggle_overlay()
         elif key == pg.K_F11:
             if not pg.display.get_surface().get_flags() & pg.FULLSCREEN:
                 pg.display.set_mode((0, 0), pg.FULLSCREEN)
             else:
                 pg.display.set_mode((800,800), pg.RESIZABLE)
             self.screen = pg.display.get_surface()
+            self.state_machine.repaint()
         elif key == pg.K_ESCAPE:
             self.done = True
     
@@ -89,66 +121,49 @@ class Control(object):
             with_fps = f"{self.caption} - FPS: {fps:.2f}"
             pg.display.set_caption(with_fps)
     
+    def adapt_update_rate(self, cost):
+        '''
+        Stretch the simulation tick interval when updates get too expensive to keep up, and
+        shrink it back towards TIME_PER_UPDATE once they are cheap again. A slow simulation
+        then runs in slow motion instead of locking up the whole app.
+        '''
+        # One-off hitches (like JIT compiles) are clipped so they don't poison the average
+        cost = min(cost, MAX_TIME_PER_UPDATE)
+        self.update_cost = 0.9 * self.update_cost + 0.1 * cost
+        target = min(max(self.update_cost * UPDATE_HEADROOM, TIME_PER_UPDATE), MAX_TIME_PER_UPDATE)
+        self.time_per_update += 0.1 * (target - self.time_per_update)
+
     def main(self):
         '''
         Main loop for the entire program.
+        Runs at most max_substeps updates per frame, and stops early once updates have
+        used up a frame's worth of time. Whatever lag is left after that is dropped,
+        so falling behind can never snowball into a spiral of death.
+        The quality governor trades drawing quality and substeps for holding self.fps.
         '''
         lag = 0.0
         while not self.done:
             lag += self.clock.tick(self.fps)
-            self.event_loop()
-            while lag >= TIME_PER_UPDATE:
-                self.update()
-                lag -= TIME_PER_UPDATE
-            self.draw(lag/TIME_PER_UPDATE)
+            PROFILER.begin_frame()
+            with PROFILER.phase("event_loop"):
+                self.event_loop()
+            substeps = 0
+            budget = 1000.0 / self.fps
+            spent = 0.0
+            with PROFILER.phase("update"):
+                while lag >= self.time_per_update and substeps < self.max_substeps and spent < budget:
+                    start = time.perf_counter()
+                    self.update()
+                    cost = (time.perf_counter() - start) * 1000.0
+                    self.adapt_update_rate(cost)
+                    spent += cost
+                    lag -= self.time_per_update
+                    substeps += 1
+            if lag >= self.time_per_update:
+                lag %= self.time_per_update
+            self.draw(max(lag, 0.0)/self.time_per_update)
+            PROFILER.end_frame(substeps)
+            GOVERNOR.update(time.perf_counter())
+            self.max_substeps = min(GOVERNOR.tier.max_substeps, MAX_SUBSTEPS)
 
 # Maybe define an animation class here?
-
-
-# Resource loading functions
-def load_all_gfx(directory, colorkey=(255,0,255), accept=('.png', '.jpg', '.jpeg', '.gif')):
-    """
-    Load all graphics from the given directory.
-    """
-    graphics = {}
-    for pic in os.listdir(directory):
-        name, ext = os.path.splitext(pic)
-        if ext.lower() in accept:
-            img=  pg.image.load(os.path.join(directory, pic))
-            if img.get_alpha():
-                img = img.convert_alpha()
-            else:
-                img = img.convert()
-                img.set_colorkey(colorkey)
-            graphics[name] = img
-    return graphics
-
-def load_all_music(directory, accept=('.ogg', '.wav', '.mp3', '.mdi')):
-    '''
-    Create a dictionary of paths to all music files in the given directory.
-    '''
-    songs = {}
-    for song in os.listdir(directory):
-        name, ext = os.path.splitext(song)
-        if ext.lower() in accept:
-            songs[name] = os.path.join(directory, song)
-    return songs
-
-
-def load_all_fonts(directory, accept=('.ttf')):
-    """
-    Create a dictionary of paths to all font files in the given directory.
-    """
-    return load_all_music(directory, accept)
-
-
-def load_all_sfx(directory, accept=('.ogg', '.wav', '.mp3', '.mdi')):
-    '''
-    Load all sound effects from the given directory.
-    '''
-    effects = {}
-    for fx in os.listdir(directory):
-        name, ext = os.path.splitext(fx)
-        if ext.lower() in accept:
-            effects[name] = pg.mixer.Sound(os.path.join(directory, fx))
-    return effects
\ No newline at end of file
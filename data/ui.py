@@ -0,0 +1,63 @@
+'''
+Retained-mode helpers for the UI.
+
+Text and widgets are only rendered again when what they show changes. text() keeps the
+surfaces of recently rendered strings (fonts themselves are cached by assets.font), and
+CachedWidget re-renders its image only when the values it is bound to change. Static
+screens combine these with the dirty rects of a pg.sprite.LayeredDirty group, so the
+display is only updated where something changed.
+'''
+
+import pygame as pg
+
+TEXT_CACHE_SIZE = 512 # Rendered strings kept before the text cache starts over
+
+_text = {}
+
+
+def text(font, msg, color=(255, 255, 255), antialias=True):
+    """font.render(msg, antialias, color), but each distinct string is only rendered once."""
+    key = (font, msg, antialias, tuple(color))
+    surface = _text.get(key)
+    if surface is None:
+        if len(_text) >= TEXT_CACHE_SIZE:
+            # Labels like the boid count can take any number of values, don't keep them all
+            _text.clear()
+        surface = _text[key] = font.render(msg, antialias, color)
+    return surface
+
+
+class CachedWidget(pg.sprite.DirtySprite):
+    """
+    A widget whose image is kept between frames. Subclasses return everything the image
+    depends on from bound() and draw it in render(), which then only runs when that changes.
+    """
+    def __init__(self, *groups):
+        pg.sprite.DirtySprite.__init__(self, *groups)
+        self.image = None
+        self.rect = pg.Rect(0, 0, 0, 0)
+        self._bound = None
+
+    def bound(self):
+        """The values shown by the widget, compared between frames. Must be overloaded."""
+        return ()
+
+    def render(self):
+        """Return a new image of the widget. Must be overloaded."""
+        raise NotImplementedError
+
+    def refresh(self):
+        """Re-render the image if the bound values changed. Returns whether it did."""
+        bound = self.bound()
+        if self.image is not None and bound == self._bound:
+            return False
+        self._bound = bound
+        self.image = self.render()
+        self.rect.size = self.image.get_size()
+        self.dirty = 1
+        return True
+
+    def draw(self, surface):
+        """Blit the (possibly refreshed) image and return the rect it covers."""
+        self.refresh()
+        return surface.blit(self.image, self.rect)
@@ -0,0 +1,67 @@
+'''
+Background JIT warm-up for the Numba kernels.
+
+main starts WARMUP before the splash screen is shown, so the kernels compile (or load
+from Numba's on-disk cache) while Splash and Title are up. Game.startup waits for it
+to finish, which is a no-op unless the player got there before compilation did.
+Nothing in here may import prepare, the warm-up must not touch the display.
+'''
+
+import threading
+import time
+
+import numba
+
+# Taken as soon as main imports this module, used to report startup latency
+LAUNCH_TIME = time.perf_counter()
+
+
+class KernelWarmup(object):
+    """
+    Compiles every simulation and render kernel on a background thread.
+    """
+    def __init__(self):
+        self.thread = None
+        self.compile_time = None # Seconds the compile took, None until it is done
+        self.error = None
+
+    def start(self):
+        if self.thread is not None:
+            return
+        # Numba's parallel thread pool has to be launched from the main thread, a pool
+        # first started from the warm-up thread hangs the interpreter on exit
+        numba.get_num_threads()
+        self.thread = threading.Thread(target=self._compile, name="numba-warmup", daemon=True)
+        self.thread.start()
+
+    def _compile(self):
+        from . import boids_logic, render
+        start = time.perf_counter()
+        try:
+            boids_logic.compile_kernels()
+            render.compile_kernels()
+        except Exception as error:
+            # The kernels will still compile lazily on first use
+            self.error = error
+            print(f"JIT warm-up failed: {error!r}")
+        self.compile_time = time.perf_counter() - start
+        print(f"JIT warm-up finished in {self.compile_time * 1000.0:.1f} ms")
+
+    @property
+    def done(self):
+        return self.thread is not None and not self.thread.is_alive()
+
+    def wait(self):
+        """Block until the warm-up is finished. Returns how long we had to wait, in seconds."""
+        if self.thread is None:
+            return 0.0
+        start = time.perf_counter()
+        self.thread.join()
+        return time.perf_counter() - start
+
+
+def milliseconds_since_launch():
+    return (time.perf_counter() - LAUNCH_TIME) * 1000.0
+
+
+WARMUP = KernelWarmup()